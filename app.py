@@ -1,23 +1,79 @@
 import os, gradio as gr
+from rag import models, metrics
 from rag.pipeline import CryptoRAGPipeline
-from rag.tools import get_price, get_fear_greed
+from rag.tools import atool_answer
+from rag.streaming import coalesce
 
 pipe: CryptoRAGPipeline | None = None
 DEFAULT_DENSE = "sentence-transformers/all-MiniLM-L6-v2"
 DEFAULT_RERANK = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# Optional snapshot directory: restarted workers load the last built index from here
+INDEX_DIR = os.environ.get("CRYPTORAG_INDEX_DIR", "").strip()
+# Dense retrieval backend: exact (NumPy) | flat | ivf | hnsw (faiss)
+DENSE_BACKEND = os.environ.get("CRYPTORAG_DENSE_BACKEND", "exact").strip() or "exact"
+# Embedding storage for the exact backend: float32 | float16 | int8 (top hits re-scored in float32)
+EMBEDDING_DTYPE = os.environ.get("CRYPTORAG_EMBEDDING_DTYPE", "float32").strip() or "float32"
+# Sharded index: partition by a metadata key (e.g. "coin") and/or into N hash shards
+SHARD_KEY = os.environ.get("CRYPTORAG_SHARD_KEY", "").strip() or None
+SHARDS = int(os.environ.get("CRYPTORAG_SHARDS", "0") or 0)
+# Micro-batch query embeddings / reranker pairs across concurrent chats (set to 0 to disable)
+MICRO_BATCH = os.environ.get("CRYPTORAG_MICRO_BATCH", "1") != "0"
+# Input-token budget for each chat prompt (contexts are packed until it is spent)
+PROMPT_BUDGET = int(os.environ.get("CRYPTORAG_PROMPT_BUDGET", "2048") or 2048)
+# Skip reranking candidates whose hybrid score trails the leader by a wide margin
+ADAPTIVE_RERANK = os.environ.get("CRYPTORAG_ADAPTIVE_RERANK", "0") == "1"
+# Streamed answers are pushed to the browser at most this often (tokens in between are coalesced)
+STREAM_INTERVAL = int(os.environ.get("CRYPTORAG_STREAM_INTERVAL_MS", "80") or 0) / 1000
+# Start loading the default models in the background at launch (before "Initialize pipeline")
+PRELOAD_MODELS = os.environ.get("CRYPTORAG_PRELOAD_MODELS", "1") != "0"
+# Prometheus metrics on http://127.0.0.1:<port>/metrics (0 = off, nothing is recorded)
+METRICS_PORT = int(os.environ.get("CRYPTORAG_METRICS_PORT", "0") or 0)
+# Append a per-answer stage timing line to the status box
+TIMING_LINE = os.environ.get("CRYPTORAG_TIMING", "0") == "1"
+# session -> timing line of its last answer, picked up by answer_timing_s
+_timings: dict[str, str] = {}
 
 def _ensure_pipe(dense_model: str | None = None, reranker_model: str | None = None):
     global pipe
     if pipe is None:
         pipe = CryptoRAGPipeline(
             dense_model=dense_model or DEFAULT_DENSE,
-            reranker_model=reranker_model or DEFAULT_RERANK
+            reranker_model=reranker_model or DEFAULT_RERANK,
+            dense_backend=DENSE_BACKEND,
+            embedding_dtype=EMBEDDING_DTYPE,
+            shards=SHARDS,
+            shard_key=SHARD_KEY,
+            prompt_budget=PROMPT_BUDGET,
+            micro_batch=MICRO_BATCH,
+            adaptive_rerank=ADAPTIVE_RERANK
         )
+        if INDEX_DIR:
+            try:
+                pipe.load_index(INDEX_DIR)
+            except Exception as e:
+                print(f"Index snapshot not loaded from {INDEX_DIR}: {e}")
     return pipe
 
 def setup_pipeline(dense_model, reranker_model):
-    _ensure_pipe(dense_model, reranker_model)
-    return "✅ Pipeline initialised."
+    p = _ensure_pipe(dense_model, reranker_model)
+    # Clicking again after a failed download retries it in the same pipeline
+    p.retry_models()
+    msg = "✅ Pipeline initialised"
+    if p.index.ready():
+        msg += f" (loaded index snapshot: {p.index.n_built} chunks)"
+    if not p.models_ready():
+        msg += "; models are loading in the background"
+    return msg + "."
+
+def _models_line(ms) -> str | None:
+    # None while any model is still loading
+    if any(m["state"] == "loading" for m in ms.values()):
+        return None
+    failed = [f"{role} ({m['name']}): {m['error']}" for role, m in ms.items() if m["state"] == "failed"]
+    if failed:
+        return "❌ Model load failed: " + "; ".join(failed)
+    secs = max((m["seconds"] or 0.0) for m in ms.values())
+    return f"🧠 Models ready ({secs:.1f}s): " + ", ".join(m["name"] for m in ms.values())
 
 def add_openai_key(key):
     p = _ensure_pipe()
@@ -27,89 +83,81 @@ def add_openai_key(key):
     p.set_openai(key)
     return "🔐 OpenAI key set (not stored on disk)."
 
-def add_files(files):
+def add_files(files, progress=None):
     p = _ensure_pipe()
     paths = [f.name for f in (files or [])]
     if not paths:
         return "No files uploaded."
-    p.add_local_files(paths)
-    return f"📄 Added {len(paths)} file(s)."
+    def report(done, total, chunks):
+        if progress is not None:
+            progress((done, total), desc=f"Parsed {done}/{total} file(s), {chunks} chunk(s)")
+    n = p.add_local_files(paths, progress=report)
+    return f"📄 Added {len(paths)} file(s), {n} new chunk(s) (duplicates skipped)."
 
 def add_urls(urls_text):
     p = _ensure_pipe()
     urls = [u.strip() for u in (urls_text or "").splitlines() if u.strip()]
     if not urls:
         return "No URLs provided."
-    p.add_urls(urls)
-    return f"🔗 Added {len(urls)} URL(s)."
+    n = p.add_urls(urls)
+    return f"🔗 Added {len(urls)} URL(s), {n} new chunk(s) (duplicates skipped)."
 
 def build_index():
+    # Runs in the background; the current index keeps answering until the new one is swapped
+    # in. Progress is reported by the status poller (build_progress_s).
     p = _ensure_pipe()
-    p.build()
-    return "🧱 Index built (hybrid: BM25 + Dense)."
-
-#def answer(query, k, alpha, top_k_rerank, filter_coin, stream_enable, model):
-def answer(query, k, alpha, top_k_rerank, stream_enable, model):
+    n = p.index.pending()
+    if not n:
+        return f"🧱 Nothing new to build — {p.index.n_built} chunk(s) indexed."
+    p.build_async(save_to=INDEX_DIR or None)
+    return f"🧱 Building index in the background (hybrid: BM25 + Dense) — {n} new chunk(s) queued."
+
+def _build_line(st) -> str:
+    if st["running"]:
+        if st["stage"] == "embedding" or st["total"]:
+            return f"⏳ Building index: {st['stage']} {st['done']}/{st['total']} chunk(s)…"
+        return f"⏳ Building index: {st['stage']}…"
+    if st["stage"] == "failed":
+        return f"❌ Index build failed: {st['error']}"
+    msg = f"🧱 Index built — {st['n_built']} chunk(s) searchable, {st['pending']} staged."
+    if st.get("note"):
+        msg += f" {st['note']}"
+    elif INDEX_DIR:
+        msg += " Snapshot saved."
+    return msg
+
+# Async generator: Gradio runs it on the event loop, so concurrent chats don't each hold a worker thread.
+# delta=False yields the whole answer so far (for the Markdown output); delta=True yields only
+# new text, for API clients that append (the "answer_delta" endpoint).
+async def _answer(query, k, alpha, top_k_rerank, filter_coin, stream_enable, model, delta=False, request=None):
     p = _ensure_pipe()
- 
+    coin = (filter_coin or "").strip()
+    filters = {"coin": coin} if coin else None
+    trace = metrics.Trace() if TIMING_LINE and request is not None else None
+
     try:
-        result = p.ask(
+        result = await p.aask(
             query, k=int(k), alpha=float(alpha),
             top_k_rerank=int(top_k_rerank),
-            filters=None, stream=stream_enable
+            filters=filters, stream=stream_enable, trace=trace
         )
     except Exception as e:
         yield f"❌ Error while routing: {e}"
         return
 
-    # Tool route (non-stream)
+    # Tool route (non-stream): price, Fear & Greed and the ETH/SOL/XRP trio fetched concurrently
     if result["route"] == "tools":
-        # Auto-detect coin from the user's query and show its price.
-        from rag.tools import get_price_any, get_price_multi, get_fear_greed
-        try:
-            coin_id, price = get_price_any(query, "usd")
-        except Exception as e:
-            yield f"🔧 Tool route: error resolving coin/price — {e}"
-            return
-
-        # Always include Fear & Greed (market mood)
-        parts = []
-        if price is not None:
-            parts.append(f"{coin_id} price ≈ ${price}")
-        else:
-            parts.append(f"{coin_id} price unavailable")
-
-        try:
-            fng = get_fear_greed()
-            if fng:
-                parts.append(f"Fear&Greed: {fng.get('value')} – {fng.get('value_classification')}")
-        except Exception:
-            pass
-
-        # (Optional) If user didn’t specify a coin clearly, also show a quick trio: ETH, SOL, XRP
-        if coin_id not in {"ethereum", "solana", "ripple"} and any(w in query.lower() for w in ["price", "quote"]):
-            try:
-                batch = get_price_multi(["ethereum", "solana", "ripple"], "usd")
-                trio = []
-                if "ethereum" in batch and "usd" in batch["ethereum"]:
-                    trio.append(f"ETH ${batch['ethereum']['usd']}")
-                if "solana" in batch and "usd" in batch["solana"]:
-                    trio.append(f"SOL ${batch['solana']['usd']}")
-                if "ripple" in batch and "usd" in batch["ripple"]:
-                    trio.append(f"XRP ${batch['ripple']['usd']}")
-                if trio:
-                    parts.append("Also: " + " | ".join(trio))
-            except Exception:
-                pass
-
-        yield "🔧 " + " | ".join(parts)
+        yield await atool_answer(query, "usd")
         return
 
 
     # Retrieval not ready / no results
     if result["route"] == "not_ready":
         reason = result.get("reason")
-        if reason == "index_empty":
+        if reason == "building":
+            st = result.get("status") or {}
+            yield f"⏳ Your documents are being indexed in the background ({st.get('done', 0)}/{st.get('total', 0)} chunk(s) embedded). Ask again in a moment."
+        elif reason == "index_empty":
             yield "⚠️ Your knowledge base is empty. Upload PDF/TXT/MD or add URLs, then click **Build Index**."
         elif reason == "build_failed":
             yield "⚠️ Index not built. Try clicking **Build Index** (after adding docs/URLs)."
@@ -122,24 +170,33 @@ def answer(query, k, alpha, top_k_rerank, stream_enable, model):
     # RAG route
     contexts = result["contexts"]
 
-    # Stream tokens → progressively yield the growing string
+    # Stream tokens, coalesced into a few updates per second so per-answer work and bytes
+    # stay linear in its length instead of re-sending the growing text for every token
     if stream_enable:
-        full = ""
         try:
-            for token in p.answer_stream(query, contexts, model=model):
-                full += token
-                yield full
+            async for part in coalesce(p.aanswer_stream(query, contexts, model=model, trace=trace),
+                                       interval=STREAM_INTERVAL, delta=delta):
+                yield part
         except Exception as e:
-            yield f"❌ Error while streaming: {e}"
-        return
+            yield (f"\n\n❌ Error while streaming: {e}" if delta else f"❌ Error while streaming: {e}")
     else:
         # Non-streaming fallback (join all tokens)
         try:
-            text = "".join(p.answer_stream(query, contexts, model=model))
+            text = "".join([t async for t in p.aanswer_stream(query, contexts, model=model, trace=trace)])
         except Exception as e:
             yield f"❌ Error while generating: {e}"
             return
         yield text
+    if trace is not None:
+        _timings[request.session_hash] = trace.line()
+
+async def answer(query, k, alpha, top_k_rerank, filter_coin, stream_enable, model, request: gr.Request):
+    async for out in _answer(query, k, alpha, top_k_rerank, filter_coin, stream_enable, model, request=request):
+        yield out
+
+async def answer_delta(query, k, alpha, top_k_rerank, filter_coin, stream_enable, model):
+    async for out in _answer(query, k, alpha, top_k_rerank, filter_coin, stream_enable, model, delta=True):
+        yield out
 
 def _push_status(msg: str, history: list[str] | None, keep: int = 10):
     # 1 line per message; strip newlines
@@ -158,8 +215,8 @@ def add_openai_key_s(key, history):
     msg = add_openai_key(key)
     return _push_status(msg, history)
 
-def add_files_s(files, history):
-    msg = add_files(files)
+def add_files_s(files, history, progress=gr.Progress()):
+    msg = add_files(files, progress)
     return _push_status(msg, history)
 
 def add_urls_s(urls_text, history):
@@ -170,76 +227,126 @@ def build_index_s(history):
     msg = build_index()
     return _push_status(msg, history)
 
+def build_progress_s(history, seen, models_seen):
+    # Polled by a timer: reports when the pipeline's models have loaded (or failed, and
+    # again if a retry changes that), keeps one
+    # live progress line while a build runs and reports each finished build once;
+    # otherwise leaves the status box untouched
+    if pipe is None:
+        return history, gr.update(), seen, models_seen
+    hist, text = list(history or []), None
+    line = _models_line(pipe.models_status())
+    if line is not None and line != models_seen:
+        hist, text = _push_status(line, hist)
+        models_seen = line
+    st = pipe.build_status()
+    if st["started"] is not None and (st["running"] or seen != st["started"]):
+        if hist and hist[-1].startswith("⏳ Building index"):
+            hist = hist[:-1]
+        hist, text = _push_status(_build_line(st), hist)
+        seen = seen if st["running"] else st["started"]
+    return hist, (gr.update() if text is None else text), seen, models_seen
+
+def answer_timing_s(history, request: gr.Request):
+    # Runs after each answer (CRYPTORAG_TIMING=1); RAG answers only
+    line = _timings.pop(request.session_hash, None) if request is not None else None
+    if not line:
+        return history, gr.update()
+    return _push_status(line, history)
+
 def on_load_s(history):
     # If you want MANUAL init, return a neutral line here instead
     return _push_status("👋 Ready. Click 'Initialize pipeline' to begin.", history)
 
-with gr.Blocks(
-    title="Crypto RAG Chatbot",
-    css="""
-#status-box { border: 1px solid #e5e7eb; border-radius: 10px; padding: 10px; margin-top: 12px; }
-#status-body { white-space: pre-wrap; line-height: 1.25; max-height: calc(1.25em * 5 + 12px); overflow: auto; }
-"""
-) as demo:
-    gr.Markdown(
-    "# 🟠 Crypto RAG Chatbot:<br>"
-    "<span style='font-size:0.95rem; line-height:1.4;'>"
-    "Step 1: click Initialize pipeline, enter OpenAI Key,Step 2: Upload documents and Paste links,Step 3: Build Index, Step 4: Ask away<br>" 
-    "</span>"
-    )
+def build_ui() -> gr.Blocks:
+    # Built on demand rather than at import: ingestion's spawn workers re-import this
+    # script as __mp_main__, and each would otherwise construct the whole UI
+    with gr.Blocks(
+        title="Crypto RAG Chatbot",
+        css="""
+    #status-box { border: 1px solid #e5e7eb; border-radius: 10px; padding: 10px; margin-top: 12px; }
+    #status-body { white-space: pre-wrap; line-height: 1.25; max-height: calc(1.25em * 5 + 12px); overflow: auto; }
+    """
+    ) as demo:
+        gr.Markdown(
+        "# 🟠 Crypto RAG Chatbot:<br>"
+        "<span style='font-size:0.95rem; line-height:1.4;'>"
+        "Step 1: click Initialize pipeline, enter OpenAI Key,Step 2: Upload documents and Paste links,Step 3: Build Index, Step 4: Ask away<br>" 
+        "</span>"
+        )
     
-    with gr.Row():
-        with gr.Column(scale=1):
-            gr.Markdown("### 1) Init & Keys")
-            dense = gr.Textbox(value=DEFAULT_DENSE, label="Embedding model")
-            rerank = gr.Textbox(value=DEFAULT_RERANK, label="Reranker model")
-            btn_init = gr.Button("Initialize pipeline")
-            #status = gr.Markdown("...")
-            key = gr.Textbox(type="password", label="OpenAI API Key (required for chat)")
-            btn_key = gr.Button("Set OpenAI Key")
-
-            gr.Markdown("### 2) Ingest Data")
-            files = gr.File(label="Upload .pdf / .txt / .md", file_count="multiple")
-            btn_files = gr.Button("Add files")
-            urls = gr.Textbox(lines=3, label="URLs (one per line)")
-            btn_urls = gr.Button("Add URLs")
-            btn_build = gr.Button("3) Build Index")
-
-            gr.Markdown("### 3) Query Settings")
-            k = gr.Slider(2, 15, value=8, step=1, label="Top-K retrieve")
-            alpha = gr.Slider(0, 1, value=0.5, step=0.05, label="Hybrid alpha (BM25↔Dense)")
-            topk_rerank = gr.Slider(1, 10, value=5, step=1, label="Top-K after reranker")
-            #filter_coin = gr.Textbox(value="", label="Metadata filter: coin (optional)")
-            stream_toggle = gr.Checkbox(value=True, label="Streaming")
-            model = gr.Textbox(value="gpt-4o-mini", label="Chat model")
-
-        with gr.Column(scale=2):
-            # NEW: wider status in the chat column
-            #status = gr.Markdown("...", elem_id="status-banner")
-            gr.Markdown("### 4) Chat")
-            q = gr.Textbox(label="Ask a crypto question", lines=2)
-            btn_ask = gr.Button("Ask")
-            a = gr.Markdown("...")
-            with gr.Group(elem_id="status-box"):
-                gr.Markdown("**Status showing below (last 10 statuses):**")
-                status = gr.Markdown("...", elem_id="status-body")
-
-    status_state = gr.State([])
-
-    # on load
-    # remove auto load 
-    # demo.load(on_load_s, [status_state], [status_state, status])
-
-    # init / keys / ingest / build → use the “_s” wrappers
-    btn_init.click( setup_pipeline_s, [dense, rerank, status_state], [status_state, status] )
-    btn_key.click(  add_openai_key_s, [key, status_state],          [status_state, status] )
-    btn_files.click(add_files_s,      [files, status_state],        [status_state, status] )
-    btn_urls.click( add_urls_s,       [urls, status_state],         [status_state, status] )
-    btn_build.click(build_index_s,    [status_state],               [status_state, status] )
-
-    # chat output remains the same (streams into `a`)
-    btn_ask.click(answer, [q, k, alpha, topk_rerank, stream_toggle, model], [a])
+        with gr.Row():
+            with gr.Column(scale=1):
+                gr.Markdown("### 1) Init & Keys")
+                dense = gr.Textbox(value=DEFAULT_DENSE, label="Embedding model")
+                rerank = gr.Textbox(value=DEFAULT_RERANK, label="Reranker model")
+                btn_init = gr.Button("Initialize pipeline")
+                #status = gr.Markdown("...")
+                key = gr.Textbox(type="password", label="OpenAI API Key (required for chat)")
+                btn_key = gr.Button("Set OpenAI Key")
+
+                gr.Markdown("### 2) Ingest Data")
+                files = gr.File(label="Upload .pdf / .txt / .md", file_count="multiple")
+                btn_files = gr.Button("Add files")
+                urls = gr.Textbox(lines=3, label="URLs (one per line)")
+                btn_urls = gr.Button("Add URLs")
+                btn_build = gr.Button("3) Build Index")
+
+                gr.Markdown("### 3) Query Settings")
+                k = gr.Slider(2, 15, value=8, step=1, label="Top-K retrieve")
+                alpha = gr.Slider(0, 1, value=0.5, step=0.05, label="Hybrid alpha (BM25↔Dense)")
+                topk_rerank = gr.Slider(1, 10, value=5, step=1, label="Top-K after reranker")
+                filter_coin = gr.Textbox(value="", label="Metadata filter: coin (optional)")
+                stream_toggle = gr.Checkbox(value=True, label="Streaming")
+                model = gr.Textbox(value="gpt-4o-mini", label="Chat model")
+
+            with gr.Column(scale=2):
+                # NEW: wider status in the chat column
+                #status = gr.Markdown("...", elem_id="status-banner")
+                gr.Markdown("### 4) Chat")
+                q = gr.Textbox(label="Ask a crypto question", lines=2)
+                btn_ask = gr.Button("Ask")
+                a = gr.Markdown("...")
+                # Hidden target of the delta-streaming API endpoint (not shown in the UI)
+                a_delta = gr.Textbox(visible=False)
+                with gr.Group(elem_id="status-box"):
+                    gr.Markdown("**Status showing below (last 10 statuses):**")
+                    status = gr.Markdown("...", elem_id="status-body")
+
+        status_state = gr.State([])
+        # started-timestamp of the last build whose outcome was reported
+        build_seen = gr.State(None)
+        # last model readiness line reported
+        models_seen = gr.State(None)
+        build_timer = gr.Timer(1.0)
+
+        # on load
+        # remove auto load 
+        # demo.load(on_load_s, [status_state], [status_state, status])
+
+        # init / keys / ingest / build → use the “_s” wrappers
+        btn_init.click( setup_pipeline_s, [dense, rerank, status_state], [status_state, status] )
+        btn_key.click(  add_openai_key_s, [key, status_state],          [status_state, status] )
+        btn_files.click(add_files_s,      [files, status_state],        [status_state, status] )
+        btn_urls.click( add_urls_s,       [urls, status_state],         [status_state, status] )
+        btn_build.click(build_index_s,    [status_state],               [status_state, status] )
+        build_timer.tick(build_progress_s, [status_state, build_seen, models_seen],
+                         [status_state, status, build_seen, models_seen])
+
+        # chat output remains the same (streams into `a`)
+        ask_event = btn_ask.click(answer, [q, k, alpha, topk_rerank, filter_coin, stream_toggle, model], [a])
+        if TIMING_LINE:
+            ask_event.then(answer_timing_s, [status_state], [status_state, status])
+        # API-only: same answer streamed as appended chunks (gradio_client: api_name="/answer_delta")
+        gr.Button(visible=False).click(answer_delta, [q, k, alpha, topk_rerank, filter_coin, stream_toggle, model],
+                                       [a_delta], api_name="answer_delta")
+    return demo
 
 if __name__ == "__main__":
+    if PRELOAD_MODELS:
+        models.preload(DEFAULT_DENSE, DEFAULT_RERANK)
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    demo = build_ui()
     # Set share=True if you want a public link locally
-    demo.launch()
+    demo.queue(default_concurrency_limit=int(os.environ.get("CRYPTORAG_CONCURRENCY", "64"))).launch()
@@ -0,0 +1,49 @@
+from __future__ import annotations
+import sys, json, argparse
+from typing import Any, Dict
+
+# Side-by-side diff of two bench.run results: every latency/throughput figure with its
+# relative change. Exits non-zero if a latency regressed by more than --threshold.
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms", "mean_ms", "seconds", "build_seconds", "add_seconds")
+RATE_KEYS = ("qps", "chunks_per_s", "mb_per_s", "pairs_per_s", "answers_per_s")
+
+def flatten(res: Dict[str, Any]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+
+    def walk(prefix: str, node: Any):
+        if isinstance(node, dict):
+            for k, v in node.items():
+                walk(f"{prefix}.{k}" if prefix else k, v)
+        elif isinstance(node, (int, float)) and not isinstance(node, bool):
+            if prefix.rsplit(".", 1)[-1] in LATENCY_KEYS + RATE_KEYS:
+                out[prefix] = float(node)
+
+    for stage in ("ingest", "build", "batch", "rerank", "ask"):
+        walk(stage, res.get(stage))
+    for row in res.get("search") or []:
+        walk(f"search[k={row['k']},alpha={row['alpha']},filter={row['filter']}]", row)
+    return out
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Compare two benchmark JSON files")
+    ap.add_argument("old")
+    ap.add_argument("new")
+    ap.add_argument("--threshold", type=float, default=0.10, help="relative latency regression that fails")
+    args = ap.parse_args(argv)
+    with open(args.old) as f:
+        old = flatten(json.load(f))
+    with open(args.new) as f:
+        new = flatten(json.load(f))
+    regressions = 0
+    for key in sorted(old.keys() & new.keys()):
+        a, b = old[key], new[key]
+        change = (b - a) / a if a else 0.0
+        worse = change > args.threshold if key.rsplit(".", 1)[-1] in LATENCY_KEYS else change < -args.threshold
+        regressions += worse
+        print(f"{'!' if worse else ' '} {key:70s} {a:12.3f} -> {b:12.3f}  {change:+7.1%}")
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+from __future__ import annotations
+import os, re, glob
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from rag.ingest import chunk_id
+from rag.utils import Doc, normalize_text
+
+# Synthetic crypto corpora for benchmarks. Sentences from data/samples are mixed with
+# templated ones over a fixed coin/topic vocabulary; every chunk also gets a few rare
+# tokens (block heights, tx ids) so BM25 postings are not all the same length. The
+# same seed always gives the same corpus.
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "samples")
+
+COINS = ["bitcoin", "ethereum", "solana", "xrp", "cardano", "polkadot", "dogecoin", "litecoin",
+         "avalanche", "chainlink", "tron", "stellar", "cosmos", "monero", "tezos", "algorand"]
+TOPICS = ["halving", "staking", "validators", "consensus", "fees", "mempool", "liquidity", "custody",
+          "wallets", "bridges", "rollups", "governance", "supply", "inflation", "mining", "slashing",
+          "oracles", "smart contracts", "etf flows", "market cap", "volatility", "exchanges", "keys",
+          "finality", "throughput", "sharding", "airdrops", "tokenomics", "regulation", "lending"]
+TEMPLATES = [
+    "{Coin} {topic} changed after the {year} upgrade, according to on-chain data.",
+    "Analysts compare {coin} {topic} with {other} {topic2} when assessing network risk.",
+    "The {coin} community debated {topic} and {topic2} in proposal {n}.",
+    "In {year}, {coin} processed about {n} transactions per day while {topic} stayed stable.",
+    "{Coin} relies on {topic} to secure the network; {topic2} affects miner and validator economics.",
+    "Reports on {topic} note that {coin} and {other} differ mainly in {topic2}.",
+    "Block {n} on {coin} included a record number of transfers related to {topic}.",
+    "Self-custody of {coin} requires managing private keys, unlike exchange {topic}.",
+]
+
+def sample_sentences(samples_dir: str = SAMPLES_DIR) -> List[str]:
+    out = []
+    for path in sorted(glob.glob(os.path.join(samples_dir, "*"))):
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+        for line in text.splitlines():
+            line = line.strip().lstrip("#").strip()
+            # Skip headings and metadata lines
+            if len(line.split()) >= 5 and not line.lower().startswith("metadata:"):
+                out += [s for s in re.split(r"(?<=[.!?])\s+", line) if s]
+    return out
+
+class CorpusGenerator:
+    def __init__(self, seed: int = 0, sentences_per_chunk: Tuple[int, int] = (6, 10),
+                 samples_dir: str = SAMPLES_DIR):
+        self.seed = seed
+        self.sentences_per_chunk = sentences_per_chunk
+        self.samples = sample_sentences(samples_dir)
+
+    def _sentence(self, rng: np.random.Generator, coin: str) -> str:
+        if self.samples and rng.random() < 0.2:
+            s = self.samples[rng.integers(len(self.samples))]
+            return re.sub(r"\bBitcoin\b", coin.capitalize(), s)
+        t = TEMPLATES[rng.integers(len(TEMPLATES))]
+        other = COINS[rng.integers(len(COINS))]
+        return t.format(coin=coin, Coin=coin.capitalize(), other=other,
+                        topic=TOPICS[rng.integers(len(TOPICS))], topic2=TOPICS[rng.integers(len(TOPICS))],
+                        year=int(rng.integers(2013, 2026)), n=int(rng.integers(1_000, 9_000_000)))
+
+    def chunk(self, i: int) -> Tuple[str, str]:
+        # (coin, text) of chunk i; independent of the other chunks, so any slice is reproducible
+        rng = np.random.default_rng((self.seed, i))
+        # Skewed coin distribution, like real corpora
+        coin = COINS[min(int(rng.zipf(1.6)) - 1, len(COINS) - 1)]
+        lo, hi = self.sentences_per_chunk
+        n = int(rng.integers(lo, hi + 1))
+        tail = f"Reference tx {rng.integers(16 ** 12):012x}."
+        return coin, " ".join(self._sentence(rng, coin) for _ in range(n)) + " " + tail
+
+    def docs(self, n: int, start: int = 0) -> Iterator[Doc]:
+        for i in range(start, start + n):
+            coin, text = self.chunk(i)
+            text = normalize_text(text)
+            yield Doc(id=chunk_id(text), text=text,
+                      metadata={"source": "bench", "path": f"synthetic/{coin}", "chunk": i, "coin": coin})
+
+    def write_files(self, root: str, n: int, chunks_per_file: int = 500) -> List[str]:
+        # Text files for the ingest benchmark, named <coin>_<n>.txt so guess_coin tags them;
+        # each generated chunk becomes a "## Section" block
+        os.makedirs(root, exist_ok=True)
+        paths = []
+        for f, a in enumerate(range(0, n, chunks_per_file)):
+            parts = [self.chunk(i) for i in range(a, min(n, a + chunks_per_file))]
+            path = os.path.join(root, f"{parts[0][0]}_{f:05d}.txt")
+            with open(path, "w", encoding="utf-8") as out:
+                for j, (coin, text) in enumerate(parts):
+                    out.write(f"## {coin.capitalize()} notes {a + j}\n\n{text}\n\n")
+            paths.append(path)
+        return paths
+
+    def queries(self, n: int, seed: int = 1) -> List[Tuple[str, str]]:
+        # (query, coin) pairs drawn from chunk vocabulary: a coin, a topic and a few content words
+        rng = np.random.default_rng((self.seed, seed, 7))
+        out = []
+        for _ in range(n):
+            coin, text = self.chunk(int(rng.integers(1 << 30)))
+            words = [w for w in re.findall(r"[a-z]+", text.lower()) if len(w) > 3]
+            picked = [words[j] for j in rng.choice(len(words), size=min(4, len(words)), replace=False)]
+            out.append((" ".join([coin] + picked), coin))
+        return out
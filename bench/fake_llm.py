@@ -0,0 +1,101 @@
+from __future__ import annotations
+import json, time, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local OpenAI-compatible chat completions server for offline end-to-end benchmarks.
+# Streams `n_tokens` (capped by the request's max_tokens) one word per SSE chunk after
+# `ttft` seconds, then at `tokens_per_second`.
+
+class FakeLLMServer:
+    def __init__(self, ttft: float = 0.05, tokens_per_second: float = 200.0, n_tokens: int = 120,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.ttft, self.tokens_per_second, self.n_tokens = ttft, tokens_per_second, n_tokens
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                server.requests += 1
+                n = min(server.n_tokens, int(body.get("max_tokens") or server.n_tokens))
+                model = body.get("model", "fake")
+                if body.get("stream"):
+                    self._stream(model, n)
+                else:
+                    self._complete(model, n)
+
+            def _chunk(self, model, delta, finish=None):
+                data = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+                self.wfile.write(f"data: {json.dumps(data)}\n\n".encode())
+                self.wfile.flush()
+
+            def _stream(self, model, n):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                time.sleep(server.ttft)
+                self._chunk(model, {"role": "assistant", "content": ""})
+                gap = 1.0 / server.tokens_per_second if server.tokens_per_second > 0 else 0.0
+                for i in range(n):
+                    self._chunk(model, {"content": f"tok{i} "})
+                    if gap:
+                        time.sleep(gap)
+                self._chunk(model, {}, finish="stop")
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _complete(self, model, n):
+                time.sleep(server.ttft + (n / server.tokens_per_second if server.tokens_per_second > 0 else 0))
+                data = {"id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                        "model": model, "choices": [{"index": 0, "finish_reason": "stop",
+                                                     "message": {"role": "assistant",
+                                                                 "content": " ".join(f"tok{i}" for i in range(n))}}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": n, "total_tokens": n}}
+                raw = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeLLMServer":
+        threading.Thread(target=self.httpd.serve_forever, name="fake-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Fake OpenAI-compatible streaming chat server")
+    ap.add_argument("--port", type=int, default=8010)
+    ap.add_argument("--ttft", type=float, default=0.05)
+    ap.add_argument("--tps", type=float, default=200.0)
+    ap.add_argument("--tokens", type=int, default=120)
+    args = ap.parse_args()
+    srv = FakeLLMServer(args.ttft, args.tps, args.tokens, port=args.port)
+    print(f"serving on {srv.base_url}")
+    srv.httpd.serve_forever()
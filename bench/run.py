@@ -0,0 +1,262 @@
+from __future__ import annotations
+import os, sys, json, time, shutil, asyncio, argparse, platform, resource, subprocess, tempfile
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from rag.utils import HybridIndex, Reranker
+from rag.shards import ShardedHybridIndex
+from rag.ingest import build_docs_from_paths
+from rag.cache import AnswerCache
+from . import stand_ins
+from .corpus import CorpusGenerator
+from .fake_llm import FakeLLMServer
+
+# Retrieval benchmark: ingest throughput, index build time/memory, search latency over
+# a k/alpha/filter grid, batched search throughput, rerank cost and end-to-end ask latency against a local fake
+# LLM. Everything runs offline on CPU; results are one JSON document so runs can be
+# diffed across commits (python -m bench.compare old.json new.json).
+#
+#   python -m bench.run --chunks 10000 --out bench-10k.json
+#   python -m bench.run --chunks 1000000 --skip ingest,ask --models real
+
+BENCH_VERSION = 1
+STAGES = ["ingest", "build", "search", "batch", "rerank", "ask"]
+
+def log(msg: str):
+    print(f"[bench] {msg}", file=sys.stderr, flush=True)
+
+def latency_stats(samples: List[float]) -> Dict[str, float]:
+    a = np.asarray(samples, dtype=np.float64) * 1000
+    if not len(a):
+        return {"n": 0}
+    p50, p95, p99 = np.percentile(a, [50, 95, 99])
+    return {"n": int(len(a)), "mean_ms": float(a.mean()), "p50_ms": float(p50), "p95_ms": float(p95),
+            "p99_ms": float(p99), "max_ms": float(a.max())}
+
+def timed_each(items, fn: Callable[[Any], Any], warmup: int = 5) -> List[float]:
+    for it in items[:warmup]:
+        fn(it)
+    out = []
+    for it in items:
+        t0 = time.perf_counter()
+        fn(it)
+        out.append(time.perf_counter() - t0)
+    return out
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def git_rev() -> Dict[str, Any]:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, timeout=30)
+        return {"commit": rev.stdout.strip() or None, "dirty": bool(dirty.stdout.strip())}
+    except Exception:
+        return {"commit": None, "dirty": None}
+
+# --- stages ---
+
+def bench_ingest(gen: CorpusGenerator, n: int) -> Dict[str, Any]:
+    root = tempfile.mkdtemp(prefix="rag-bench-")
+    try:
+        paths = gen.write_files(root, n)
+        size = sum(os.path.getsize(p) for p in paths)
+        t0 = time.perf_counter()
+        docs = build_docs_from_paths(paths, source_label="bench")
+        dt = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return {"files": len(paths), "source_chunks": n, "chunks": len(docs), "bytes": size, "seconds": dt,
+            "chunks_per_s": len(docs) / dt, "mb_per_s": size / dt / 1e6}
+
+def make_index(args):
+    kw = dict(dense_model_name=args.dense_model, dense_backend=args.backend, embedding_dtype=args.dtype)
+    if args.shards or args.shard_key:
+        return ShardedHybridIndex(shard_key=args.shard_key, n_shards=args.shards or 4, **kw)
+    return HybridIndex(**kw)
+
+def bench_build(index, gen: CorpusGenerator, n: int, batch: int = 10000) -> Dict[str, Any]:
+    rss0 = rss_mb()
+    t0 = time.perf_counter()
+    for a in range(0, n, batch):
+        index.add(list(gen.docs(min(batch, n - a), start=a)))
+    t_add = time.perf_counter() - t0
+    t1 = time.perf_counter()
+    index.build()
+    t_build = time.perf_counter() - t1
+    shards = getattr(index, "shards", [index])
+    emb = sum(getattr(s.embeddings, "nbytes", 0) for s in shards if s.embeddings is not None)
+    dense = sum(s.dense.nbytes() for s in shards if s.dense is not None and hasattr(s.dense, "nbytes"))
+    return {"chunks": index.n_built, "add_seconds": t_add, "build_seconds": t_build,
+            "chunks_per_s": index.n_built / max(t_build, 1e-9), "embeddings_bytes": int(emb),
+            "dense_index_bytes": int(dense), "rss_before_mb": rss0, "rss_after_mb": rss_mb(),
+            "peak_rss_mb": peak_rss_mb()}
+
+def bench_search(index, queries, ks: List[int], alphas: List[float]) -> List[Dict[str, Any]]:
+    index.query_cache = None  # every search pays for its query embedding
+    rows = []
+    for filt in (False, True):
+        for k in ks:
+            for alpha in alphas:
+                fn = lambda qc: index.search(qc[0], k=k, alpha=alpha, filters={"coin": qc[1]} if filt else None)
+                times = timed_each(queries, fn)
+                rows.append({"k": k, "alpha": alpha, "filter": "coin" if filt else None,
+                             **latency_stats(times), "qps": len(times) / sum(times)})
+                log(f"search k={k} alpha={alpha} filter={filt}: p50 {rows[-1]['p50_ms']:.2f}ms")
+    return rows
+
+def bench_batch(index, queries, k: int = 10) -> Dict[str, Any]:
+    # Whole query set through search_many() vs the same queries one search() at a time
+    index.query_cache = None
+    rows = {}
+    for filt in (False, True):
+        qs = [q for q, _ in queries]
+        fl = [{"coin": c} for _, c in queries] if filt else None
+        index.search_many(qs[:5], k=k, filters=fl[:5] if fl else None)
+        t0 = time.perf_counter()
+        index.search_many(qs, k=k, filters=fl)
+        dt = time.perf_counter() - t0
+        name = "coin" if filt else "none"
+        rows[name] = {"queries": len(qs), "seconds": dt, "qps": len(qs) / dt}
+        log(f"batch k={k} filter={filt}: {rows[name]['qps']:.0f} q/s")
+    return {"k": k, "filter": rows}
+
+def bench_rerank(index, reranker: Reranker, queries, k: int, top_k: int = 5) -> Dict[str, Any]:
+    work = [(q, index.search(q, k=k)) for q, _ in queries]
+    gen = iter(range(1 << 30))
+    # A new generation per call clears the score cache, so every pair goes to the model
+    fn = lambda qh: reranker.rerank(qh[0], qh[1], top_k=top_k, generation=next(gen))
+    times = timed_each(work, fn)
+    pairs = sum(len(h) for _, h in work)
+    return {"candidates": k, "top_k": top_k, **latency_stats(times), "pairs_per_s": pairs / sum(times)}
+
+def bench_ask(index, args, queries) -> Dict[str, Any]:
+    try:
+        import openai  # noqa: F401  (the pipeline's chat client)
+    except ImportError as e:
+        return {"skipped": f"openai not installed: {e}"}
+    from rag.pipeline import CryptoRAGPipeline
+    p = CryptoRAGPipeline(dense_model=args.dense_model, reranker_model=args.reranker_model,
+                          answer_cache=AnswerCache(maxsize=0))
+    # Reuse the benchmark index instead of building a second one
+    p.index = index
+    index.query_cache = p.query_cache
+    p._answer_cache_gen = index.generation
+    p.warmup.result()
+
+    async def one(q, coin, sem, out):
+        async with sem:
+            t0 = time.perf_counter()
+            res = await p.aask(q, k=args.ask_k, top_k_rerank=5)
+            t_ret = time.perf_counter() - t0
+            first = None
+            async for _ in p.aanswer_stream(q, res["contexts"], model="gpt-4o-mini"):
+                if first is None:
+                    first = time.perf_counter() - t0
+            out.append((t_ret, first if first is not None else float("nan"), time.perf_counter() - t0))
+
+    async def run_all():
+        sem = asyncio.Semaphore(args.concurrency)
+        out: List[tuple] = []
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(q, c, sem, out) for q, c in queries))
+        return out, time.perf_counter() - t0
+
+    async def warm_then_run():
+        # One loop for both passes: the async client's connection pool is bound to it
+        await run_all()  # warm-up: connections, tokenizer, executor threads
+        return await run_all()
+
+    with FakeLLMServer(ttft=args.llm_ttft, tokens_per_second=args.llm_tps, n_tokens=args.llm_tokens) as llm:
+        p.set_openai("bench", base_url=llm.base_url)
+        out, wall = asyncio.run(warm_then_run())
+    ret, first, total = zip(*out)
+    return {"concurrency": args.concurrency, "llm": {"ttft_s": args.llm_ttft, "tokens_per_s": args.llm_tps,
+                                                     "tokens": args.llm_tokens},
+            "retrieval": latency_stats(list(ret)), "first_token": latency_stats(list(first)),
+            "total": latency_stats(list(total)), "answers_per_s": len(out) / wall}
+
+def main(argv: List[str] | None = None) -> Dict[str, Any]:
+    ap = argparse.ArgumentParser(description="Offline retrieval benchmark (JSON results)")
+    ap.add_argument("--chunks", type=int, default=10000, help="synthetic corpus size (10k..1M)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", default="5,10,20", help="comma-separated k values for search")
+    ap.add_argument("--alpha", default="0,0.5,1", help="comma-separated alpha values for search")
+    ap.add_argument("--ingest-chunks", type=int, default=20000, help="corpus size for the ingest stage")
+    ap.add_argument("--models", choices=["stand-in", "real"], default="stand-in",
+                    help="stand-in: hashing embedder + overlap reranker; real: sentence-transformers models")
+    ap.add_argument("--dense-model", default="sentence-transformers/all-MiniLM-L6-v2")
+    ap.add_argument("--reranker-model", default="cross-encoder/ms-marco-MiniLM-L-6-v2")
+    ap.add_argument("--backend", default="exact", help="dense backend: exact | flat | ivf | hnsw")
+    ap.add_argument("--dtype", default="float32", help="embedding dtype for the exact backend")
+    ap.add_argument("--shards", type=int, default=0)
+    ap.add_argument("--shard-key", default=None)
+    ap.add_argument("--rerank-k", type=int, default=20)
+    ap.add_argument("--ask-k", type=int, default=8)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--llm-ttft", type=float, default=0.05)
+    ap.add_argument("--llm-tps", type=float, default=200.0)
+    ap.add_argument("--llm-tokens", type=int, default=120)
+    ap.add_argument("--skip", default="", help=f"comma-separated stages to skip: {','.join(STAGES)}")
+    ap.add_argument("--out", default=None, help="write JSON here instead of stdout")
+    args = ap.parse_args(argv)
+    skip = {s.strip() for s in args.skip.split(",") if s.strip()}
+    if args.models == "stand-in":
+        args.dense_model, args.reranker_model = stand_ins.install()
+
+    gen = CorpusGenerator(seed=args.seed)
+    queries = gen.queries(args.queries)
+    result: Dict[str, Any] = {
+        "version": BENCH_VERSION,
+        "meta": {**git_rev(), "created": time.time(), "python": platform.python_version(),
+                 "numpy": np.__version__, "platform": platform.platform(), "cpus": os.cpu_count(),
+                 "argv": sys.argv[1:] if argv is None else argv},
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "skip")},
+    }
+
+    if "ingest" not in skip:
+        log(f"ingest: {args.ingest_chunks} chunks")
+        result["ingest"] = bench_ingest(gen, args.ingest_chunks)
+    index = make_index(args)
+    # Later stages need the built index
+    if not {"build", "search", "batch", "rerank", "ask"} <= skip:
+        log(f"build: {args.chunks} chunks")
+        result["build"] = bench_build(index, gen, args.chunks)
+    if "search" not in skip:
+        ks = [int(x) for x in args.k.split(",")]
+        alphas = [float(x) for x in args.alpha.split(",")]
+        result["search"] = bench_search(index, queries, ks, alphas)
+    if "batch" not in skip:
+        result["batch"] = bench_batch(index, queries)
+    if "rerank" not in skip:
+        log("rerank")
+        result["rerank"] = bench_rerank(index, Reranker(args.reranker_model), queries, args.rerank_k)
+    if "ask" not in skip:
+        log(f"ask: concurrency {args.concurrency}")
+        result["ask"] = bench_ask(index, args, gen.queries(args.queries, seed=2))
+
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        log(f"wrote {args.out}")
+    else:
+        print(text)
+    return result
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+from __future__ import annotations
+import re, zlib
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from rag import models
+
+# Deterministic CPU-cheap replacements for the sentence-transformers models, so index
+# mechanics can be benchmarked offline at scales where real embedding would dominate.
+# They have the same call surface as the real models (encode / predict).
+
+HASH_EMBEDDER = "bench/hash-embedder-384"
+OVERLAP_RERANKER = "bench/overlap-reranker"
+
+_TOKEN_RE = re.compile(r"\w+")
+
+class HashEmbedder:
+    # Signed feature hashing of word unigrams into `dim` buckets, L2-normalised
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self._slots: Dict[str, Tuple[int, float]] = {}
+
+    def _slot(self, tok: str) -> Tuple[int, float]:
+        s = self._slots.get(tok)
+        if s is None:
+            h = zlib.crc32(tok.encode())
+            s = self._slots[tok] = (h % self.dim, 1.0 if (h >> 16) & 1 else -1.0)
+        return s
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, sentences: Sequence[str], convert_to_numpy: bool = True,
+               normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        out = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        for i, s in enumerate(sentences):
+            for tok in _TOKEN_RE.findall(s.lower()):
+                j, sign = self._slot(tok)
+                out[i, j] += sign
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-8)
+        return out
+
+class OverlapReranker:
+    # Query/passage word overlap, normalised by passage length
+    max_length = 512
+
+    def predict(self, pairs: Sequence[Tuple[str, str]], **kwargs) -> np.ndarray:
+        out = np.empty(len(pairs), dtype=np.float32)
+        for i, (q, d) in enumerate(pairs):
+            qs = set(_TOKEN_RE.findall(q.lower()))
+            ds = _TOKEN_RE.findall(d.lower())
+            out[i] = sum(t in qs for t in ds) / np.sqrt(len(ds) + 1)
+        return out
+
+def install() -> List[str]:
+    # Registers the stand-ins in the process-wide model registry; returns their names
+    models.register("embedder", HASH_EMBEDDER, HashEmbedder())
+    models.register("cross-encoder", OVERLAP_RERANKER, OverlapReranker())
+    return [HASH_EMBEDDER, OVERLAP_RERANKER]
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import time, threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence
+
+import numpy as np
+
+class MicroBatcher:
+    # Collects items submitted by concurrent callers for up to max_wait_ms (or until
+    # max_batch items are queued), runs fn once over the whole batch on a worker thread
+    # and hands each caller its own result.
+    def __init__(self, fn: Callable[[List[Any]], Sequence[Any]], max_batch: int = 32,
+                 max_wait_ms: float = 4.0, name: str = "batcher"):
+        self.fn, self.max_batch, self.max_wait = fn, max_batch, max_wait_ms / 1000.0
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+        self.size_hist: Dict[int, int] = {}  # batch size bucket (power of two) -> count
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit_many(self, items: Sequence[Any]) -> List[Future]:
+        futs = [Future() for _ in items]
+        with self._cond:
+            self._queue.extend(zip(items, futs))
+            self._cond.notify()
+        return futs
+
+    def run(self, items: Sequence[Any]) -> List[Any]:
+        return [f.result() for f in self.submit_many(items)]
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.max_wait
+                while len(self._queue) < self.max_batch:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+                batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+            items, futs = [b[0] for b in batch], [b[1] for b in batch]
+            try:
+                results = self.fn(items)
+            except BaseException as e:
+                for f in futs:
+                    f.set_exception(e)
+                continue
+            for f, r in zip(futs, results):
+                f.set_result(r)
+            self._record(len(batch))
+
+    def _record(self, n: int):
+        self.batches += 1
+        self.items += n
+        self.max_seen = max(self.max_seen, n)
+        bucket = 1 << (n - 1).bit_length()
+        self.size_hist[bucket] = self.size_hist.get(bucket, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queue_depth": len(self._queue), "batches": self.batches, "items": self.items,
+                "avg_batch": (self.items / self.batches) if self.batches else 0.0,
+                "max_batch": self.max_seen, "batch_size_hist": dict(sorted(self.size_hist.items()))}
+
+class BatchedEmbedder:
+    # Drop-in for SentenceTransformer.encode on the query path: small calls with the
+    # standard arguments go through the batcher, everything else (e.g. index builds)
+    # goes straight to the model.
+    _BATCHED_KW = {"convert_to_numpy": True, "normalize_embeddings": True}
+
+    def __init__(self, model, max_batch: int = 32, max_wait_ms: float = 4.0):
+        self.model = model
+        self.batcher = MicroBatcher(
+            lambda texts: list(model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)),
+            max_batch=max_batch, max_wait_ms=max_wait_ms, name="embed-batcher")
+
+    def encode(self, sentences, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if kwargs != self._BATCHED_KW or len(texts) > self.batcher.max_batch:
+            return self.model.encode(sentences, **kwargs)
+        vecs = np.vstack(self.batcher.run(texts)) if texts else np.zeros((0, 0), dtype=np.float32)
+        return vecs[0] if single else vecs
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+class BatchedCrossEncoder:
+    # Drop-in for CrossEncoder.predict: pairs from concurrent reranks share one forward pass
+    def __init__(self, model, max_batch: int = 64, max_wait_ms: float = 4.0):
+        self.model = model
+        self.batcher = MicroBatcher(lambda pairs: [float(s) for s in model.predict(pairs)],
+                                    max_batch=max_batch, max_wait_ms=max_wait_ms, name="rerank-batcher")
+
+    def predict(self, pairs, **kwargs):
+        pairs = list(pairs)
+        if kwargs or len(pairs) > self.batcher.max_batch:
+            return self.model.predict(pairs, **kwargs)
+        return np.asarray(self.batcher.run(pairs), dtype=np.float32)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
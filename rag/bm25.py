@@ -0,0 +1,254 @@
+from __future__ import annotations
+import os, re, json
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from .dense import topk_indices
+
+# Lowercased word tokens; punctuation around a word is dropped ("Bitcoin," -> "bitcoin")
+# while in-word dots/apostrophes are kept ("eth2.0", "don't").
+_TOKEN_RE = re.compile(r"[^\W_]+(?:['.][^\W_]+)*")
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+def sparse_lookup(ids: np.ndarray, vals: np.ndarray, want: np.ndarray) -> np.ndarray:
+    # Values of a sparse (ascending ids, vals) vector at `want`; missing ids score 0
+    out = np.zeros(len(want), dtype=np.float32)
+    if not len(ids) or not len(want):
+        return out
+    pos = np.minimum(np.searchsorted(ids, want), len(ids) - 1)
+    hit = ids[pos] == want
+    out[hit] = vals[pos[hit]]
+    return out
+
+@dataclass
+class CorpusStats:
+    # Corpus-wide BM25 statistics for indexes split into shards: each shard scores its own
+    # postings with these instead of its local n/df/avgdl, so scores are comparable
+    n_docs: int
+    avgdl: float
+    df: Dict[str, int]
+
+class _Segment:
+    # Term-major CSR postings for a contiguous run of docs: postings of term t are
+    # docs[indptr[t]:indptr[t+1]] (ascending global doc ids) with term counts in tfs.
+    __slots__ = ("indptr", "docs", "tfs")
+
+    def __init__(self, indptr: np.ndarray, docs: np.ndarray, tfs: np.ndarray):
+        self.indptr, self.docs, self.tfs = indptr, docs, tfs
+
+    def postings(self, t: int) -> Tuple[np.ndarray, np.ndarray]:
+        if t + 1 >= len(self.indptr):
+            return self.docs[:0], self.tfs[:0]
+        a, b = int(self.indptr[t]), int(self.indptr[t + 1])
+        return self.docs[a:b], self.tfs[a:b]
+
+    def to_coo(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        terms = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int32), np.diff(self.indptr))
+        return terms, self.docs, self.tfs
+
+def _csr(terms: np.ndarray, docs: np.ndarray, tfs: np.ndarray, n_terms: int) -> _Segment:
+    # Stable sort keeps doc ids ascending inside each term's postings
+    order = np.argsort(terms, kind="stable")
+    indptr = np.zeros(n_terms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=n_terms), out=indptr[1:])
+    return _Segment(indptr, docs[order].astype(np.int32), tfs[order].astype(np.float32))
+
+class SparseBM25:
+    # BM25 over an inverted index. Each add() appends one segment (cost ~ size of the
+    # delta); segments are merged once there are more than max_segments of them.
+    # Queries only touch the postings of their own terms.
+    def __init__(self, k1: float = 1.5, b: float = 0.75, max_segments: int = 8):
+        self.k1, self.b, self.max_segments = k1, b, max_segments
+        self.vocab: Dict[str, int] = {}
+        self.df = np.zeros(0, dtype=np.int64)
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.n_tokens = 0
+        self.segments: List[_Segment] = []
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_len)
+
+    def add(self, tokenized: Iterable[List[str]]):
+        base = self.n_docs
+        terms: List[int] = []
+        docs: List[int] = []
+        tfs: List[int] = []
+        lens: List[int] = []
+        for j, toks in enumerate(tokenized):
+            lens.append(len(toks))
+            for w, c in Counter(toks).items():
+                t = self.vocab.get(w)
+                if t is None:
+                    t = self.vocab[w] = len(self.vocab)
+                terms.append(t)
+                docs.append(base + j)
+                tfs.append(c)
+        if not lens:
+            return
+        n_terms = len(self.vocab)
+        t_arr = np.asarray(terms, dtype=np.int32)
+        seg = _csr(t_arr, np.asarray(docs, dtype=np.int32), np.asarray(tfs, dtype=np.float32), n_terms)
+        df = np.zeros(n_terms, dtype=np.int64)
+        df[:len(self.df)] = self.df
+        df += np.bincount(t_arr, minlength=n_terms)
+        self.df = df
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(lens, dtype=np.int32)])
+        self.n_tokens += int(sum(lens))
+        self.segments.append(seg)
+        if len(self.segments) > self.max_segments:
+            self.compact()
+
+    def copy(self) -> "SparseBM25":
+        # Cheap fork for building the next index generation: segments are immutable and
+        # shared, only the vocab dict is duplicated (add() replaces df/doc_len arrays)
+        bm = SparseBM25(k1=self.k1, b=self.b, max_segments=self.max_segments)
+        bm.vocab = dict(self.vocab)
+        bm.df, bm.doc_len, bm.n_tokens = self.df, self.doc_len, self.n_tokens
+        bm.segments = list(self.segments)
+        return bm
+
+    def _merged(self) -> _Segment:
+        if len(self.segments) == 1:
+            return self.segments[0]
+        if not self.segments:
+            return _csr(np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0, np.float32), len(self.vocab))
+        parts = [s.to_coo() for s in self.segments]
+        terms = np.concatenate([p[0] for p in parts])
+        docs = np.concatenate([p[1] for p in parts])
+        tfs = np.concatenate([p[2] for p in parts])
+        return _csr(terms, docs, tfs, len(self.vocab))
+
+    def compact(self):
+        if len(self.segments) > 1:
+            self.segments = [self._merged()]
+
+    def term_df(self, tokens: List[str]) -> Dict[str, int]:
+        return {w: int(self.df[self.vocab[w]]) for w in set(tokens) if w in self.vocab}
+
+    def _query_terms(self, tokens: List[str], stats: CorpusStats | None = None) -> List[Tuple[int, float]]:
+        # (term id, idf * query term count); unknown terms contribute nothing
+        n = self.n_docs if stats is None else stats.n_docs
+        out = []
+        for w, qtf in Counter(tokens).items():
+            t = self.vocab.get(w)
+            if t is None:
+                continue
+            df = float(self.df[t] if stats is None else stats.df.get(w, self.df[t]))
+            out.append((t, qtf * float(np.log1p((n - df + 0.5) / (df + 0.5)))))
+        return out
+
+    def scores(self, tokens: List[str], mask: np.ndarray | None = None,
+               stats: CorpusStats | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        # All docs containing at least one query term: (ascending doc ids, scores).
+        # With a boolean doc mask, postings outside it are dropped before scoring.
+        qterms = self._query_terms(tokens, stats)
+        if not qterms or not self.n_docs:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        docs, tfs, ws = [], [], []
+        for seg in self.segments:
+            for t, w in qterms:
+                d, tf = seg.postings(t)
+                if len(d):
+                    docs.append(d)
+                    tfs.append(tf)
+                    ws.append(np.full(len(d), w, dtype=np.float32))
+        if not docs:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        d = np.concatenate(docs)
+        tf = np.concatenate(tfs)
+        w = np.concatenate(ws)
+        if mask is not None:
+            keep = mask[d]
+            d, tf, w = d[keep], tf[keep], w[keep]
+        avgdl = self.n_tokens / max(1, self.n_docs) if stats is None else stats.avgdl
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[d] / max(avgdl, 1e-9))
+        contrib = w * tf * (self.k1 + 1) / (tf + norm)
+        ids, inv = np.unique(d, return_inverse=True)
+        return ids.astype(np.int64), np.bincount(inv, weights=contrib).astype(np.float32)
+
+    def scores_many(self, token_lists: List[List[str]], mask: np.ndarray | None = None,
+                    stats: CorpusStats | None = None, max_cells: int = 1 << 24) -> List[Tuple[np.ndarray, np.ndarray]]:
+        # scores() for many queries in one pass. The tf part of BM25 does not depend on the
+        # query, so postings of every distinct query term are gathered and normalised once;
+        # each term then adds (its queries' weights) x (its postings) as one outer product
+        # into a dense (queries x docs) accumulator. Queries are processed in groups that
+        # keep the accumulator under max_cells.
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        qterms = [self._query_terms(toks, stats) for toks in token_lists]
+        terms = sorted({t for q in qterms for t, _ in q})
+        if not terms or not self.n_docs:
+            return [empty for _ in token_lists]
+        avgdl = self.n_tokens / max(1, self.n_docs) if stats is None else stats.avgdl
+        postings: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for t in terms:
+            parts = [seg.postings(t) for seg in self.segments]
+            d = np.concatenate([p[0] for p in parts])
+            tf = np.concatenate([p[1] for p in parts])
+            if mask is not None:
+                keep = mask[d]
+                d, tf = d[keep], tf[keep]
+            if len(d):
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[d] / max(avgdl, 1e-9))
+                postings[t] = (d, tf * (self.k1 + 1) / (tf + norm))
+
+        n = self.n_docs
+        step = max(1, max_cells // n)
+        out: List[Tuple[np.ndarray, np.ndarray]] = []
+        for a in range(0, len(qterms), step):
+            group = qterms[a:a + step]
+            by_term: Dict[int, Tuple[List[int], List[float]]] = {}
+            for i, q in enumerate(group):
+                for t, w in q:
+                    if t in postings:
+                        rows, ws = by_term.setdefault(t, ([], []))
+                        rows.append(i)
+                        ws.append(w)
+            acc = np.zeros((len(group), n), dtype=np.float64)
+            for t, (rows, ws) in by_term.items():
+                d, part = postings[t]
+                if len(rows) == 1:
+                    acc[rows[0], d] += ws[0] * part
+                else:
+                    acc[np.ix_(rows, d)] += np.outer(ws, part)
+            # Every contribution is positive, so non-zero cells are exactly the matching docs
+            for row in acc:
+                ids = np.flatnonzero(row)
+                out.append((ids, row[ids].astype(np.float32)) if len(ids) else empty)
+        return out
+
+    def top_k(self, tokens: List[str], k: int, mask: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        ids, sc = self.scores(tokens, mask=mask)
+        order = topk_indices(sc, k)
+        return ids[order], sc[order]
+
+    def save(self, path: str):
+        # Writes a merged copy; the live segments are left alone for concurrent readers
+        seg = self._merged()
+        terms = [None] * len(self.vocab)
+        for w, t in self.vocab.items():
+            terms[t] = w
+        with open(os.path.join(path, "bm25.json"), "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "n_tokens": self.n_tokens, "vocab": terms}, f, ensure_ascii=False)
+        for name, arr in (("indptr", seg.indptr), ("docs", seg.docs), ("tfs", seg.tfs),
+                          ("df", self.df), ("doc_len", self.doc_len)):
+            np.save(os.path.join(path, f"bm25_{name}.npy"), arr)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "SparseBM25":
+        with open(os.path.join(path, "bm25.json"), encoding="utf-8") as f:
+            st = json.load(f)
+        arr = {name: np.load(os.path.join(path, f"bm25_{name}.npy"), mmap_mode="r" if mmap else None)
+               for name in ("indptr", "docs", "tfs", "df", "doc_len")}
+        bm = cls(k1=st["k1"], b=st["b"])
+        bm.vocab = {w: i for i, w in enumerate(st["vocab"])}
+        bm.n_tokens = st["n_tokens"]
+        bm.df = np.array(arr["df"])  # small and updated in place on add()
+        bm.doc_len = arr["doc_len"]
+        bm.segments = [_Segment(arr["indptr"], arr["docs"], arr["tfs"])]
+        return bm
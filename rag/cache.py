@@ -0,0 +1,137 @@
+from __future__ import annotations
+import time, threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List
+
+import numpy as np
+
+from .utils import normalize_text
+
+class LRUCache:
+    # Thread-safe bounded LRU with hit/miss counters
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "hit_rate": (self.hits / total) if total else 0.0}
+
+class QueryEmbeddingCache(LRUCache):
+    # Query vectors keyed by (model name, whitespace-normalised query)
+    def encode(self, embedder, model_name: str, query: str) -> np.ndarray:
+        key = (model_name, normalize_text(query))
+        vec = self.get(key)
+        if vec is None:
+            vec = embedder.encode([key[1]], convert_to_numpy=True, normalize_embeddings=True)[0]
+            vec.setflags(write=False)  # shared between callers
+            self.put(key, vec)
+        return vec
+
+    def encode_many(self, embedder, model_name: str, queries: List[str], batch_size: int = 256) -> np.ndarray:
+        # (len(queries), dim) matrix; cache misses are encoded together in one batched call
+        keys = [(model_name, normalize_text(q)) for q in queries]
+        vecs = [self.get(k) for k in keys]
+        missing = list(dict.fromkeys(k for k, v in zip(keys, vecs) if v is None))
+        if missing:
+            enc = embedder.encode([k[1] for k in missing], batch_size=batch_size,
+                                  convert_to_numpy=True, normalize_embeddings=True)
+            fresh = {}
+            for k, v in zip(missing, enc):
+                v = np.array(v)  # own copy, so the cache doesn't pin the whole batch
+                v.setflags(write=False)
+                fresh[k] = v
+                self.put(k, v)
+            vecs = [v if v is not None else fresh[k] for k, v in zip(keys, vecs)]
+        return np.vstack(vecs) if vecs else np.zeros((0, 0), dtype=np.float32)
+
+class AnswerCache:
+    # Completed answers keyed by (chat model, retrieved context ids); within that bucket a
+    # new question hits when its embedding is within `threshold` cosine of a cached one.
+    # Entries expire after `ttl` seconds and are evicted LRU beyond `maxsize`.
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600.0, maxsize: int = 512):
+        self.threshold, self.ttl, self.maxsize = threshold, ttl, maxsize
+        self._entries: OrderedDict = OrderedDict()  # key -> (bucket, qvec, answer, ts)
+        self._buckets: Dict[Hashable, set] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _drop(self, key: Hashable):
+        bucket = self._entries.pop(key)[0]
+        keys = self._buckets.get(bucket)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._buckets[bucket]
+
+    def get(self, query: str, query_vec: np.ndarray, model: str, context_ids: tuple) -> str | None:
+        bucket = (model, context_ids)
+        now = time.monotonic()
+        with self._lock:
+            best, best_sim = None, self.threshold
+            for key in list(self._buckets.get(bucket, ())):
+                _, vec, _, ts = self._entries[key]
+                if now - ts > self.ttl:
+                    self._drop(key)
+                    continue
+                sim = float(vec @ query_vec)
+                if sim >= best_sim:
+                    best, best_sim = key, sim
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return self._entries[best][2]
+
+    def put(self, query: str, query_vec: np.ndarray, model: str, context_ids: tuple, answer: str):
+        bucket = (model, context_ids)
+        key = (bucket, normalize_text(query))
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (bucket, query_vec, answer, time.monotonic())
+            self._buckets.setdefault(bucket, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "hit_rate": (self.hits / total) if total else 0.0}
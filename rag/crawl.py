@@ -0,0 +1,169 @@
+from __future__ import annotations
+import os, re, json, codecs, hashlib, threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cryptorag", "http")
+
+_HEADER_CHARSET_RE = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.I)
+_META_CHARSET_RE = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?([\w.:-]+)", re.I)
+
+def _codec(name: bytes | str | None) -> str | None:
+    if not name:
+        return None
+    name = name.decode("ascii", "ignore") if isinstance(name, bytes) else name
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+def decode_body(content: bytes, content_type: str | None = None) -> str:
+    # Charset from the Content-Type header, else a <meta charset> in the page head, else
+    # UTF-8 if the body is valid UTF-8, else windows-1252 (the HTML standard's fallback).
+    # requests' r.text assumes ISO-8859-1 for text/* without a charset, garbling UTF-8.
+    m = _HEADER_CHARSET_RE.search(content_type or "")
+    enc = _codec(m.group(1)) if m else None
+    if enc is None:
+        m = _META_CHARSET_RE.search(content[:4096])
+        enc = _codec(m.group(1)) if m else None
+    if enc is None:
+        try:
+            return content.decode("utf-8")
+        except UnicodeDecodeError:
+            enc = "cp1252"
+    return content.decode(enc, errors="replace")
+
+def extract_text(html: str, url: str | None = None) -> str:
+    # Worker-pool task: boilerplate removal is CPU-bound, so it runs off the fetch threads
+    import trafilatura
+    return trafilatura.extract(html, url=url) or ""
+
+@dataclass
+class FetchResult:
+    url: str
+    text: str
+    status: str  # "fetched" | "not_modified" | "unchanged" | "error"
+    error: str | None = None
+
+class UrlFetcher:
+    # Bounded concurrent fetcher: one pooled keep-alive session, at most `per_host`
+    # concurrent requests per host, and an on-disk cache of validators (ETag /
+    # Last-Modified) plus extracted text. Revalidated pages that come back 304, or 200
+    # with a byte-identical body, reuse the cached text and skip extraction.
+    def __init__(self, cache_dir: str | None = DEFAULT_CACHE_DIR, max_workers: int = 8, per_host: int = 4,
+                 timeout: Tuple[float, float] = (5.0, 20.0), user_agent: str = "CryptoRAG/1.0"):
+        self.cache_dir = cache_dir
+        self.max_workers, self.per_host, self.timeout = max_workers, per_host, timeout
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max(max_workers, per_host))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._hosts: Dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+        self.stats = {"fetched": 0, "not_modified": 0, "unchanged": 0, "error": 0}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _host_slot(self, url: str) -> threading.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            sem = self._hosts.get(host)
+            if sem is None:
+                sem = self._hosts[host] = threading.Semaphore(self.per_host)
+            return sem
+
+    def _cache_path(self, url: str) -> str | None:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def _load(self, url: str) -> Dict | None:
+        path = self._cache_path(url)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            return entry if entry.get("url") == url else None
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, url: str, entry: Dict):
+        path = self._cache_path(url)
+        if not path:
+            return
+        tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _count(self, status: str):
+        with self._lock:
+            self.stats[status] += 1
+
+    def _get(self, url: str) -> Tuple[FetchResult | None, Dict | None, str | None]:
+        # Network half of a fetch; returns a finished result, or (cache entry, html) to extract
+        cached = self._load(url)
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        try:
+            with self._host_slot(url):
+                r = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            return FetchResult(url, "", "error", str(e)), None, None
+        if r.status_code == 304 and cached:
+            return FetchResult(url, cached.get("text", ""), "not_modified"), None, None
+        if r.status_code >= 400:
+            return FetchResult(url, "", "error", f"HTTP {r.status_code}"), None, None
+        body_sha = hashlib.sha256(r.content).hexdigest()
+        entry = {"url": url, "etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified"),
+                 "body_sha": body_sha}
+        if cached and cached.get("body_sha") == body_sha:
+            entry["text"] = cached.get("text", "")
+            self._store(url, entry)
+            return FetchResult(url, entry["text"], "unchanged"), None, None
+        return None, entry, decode_body(r.content, r.headers.get("Content-Type"))
+
+    def fetch_all(self, urls: List[str], extract_pool: Executor | None = None) -> Iterator[FetchResult]:
+        # Yields one result per URL in input order while later URLs are still in flight.
+        # Each page is handed to extract_pool (e.g. a process pool) as soon as its body
+        # arrives; without a pool it is extracted on the fetch thread.
+        urls = list(urls or [])
+        if not urls:
+            return
+
+        def fetch_one(u: str):
+            done, entry, html = self._get(u)
+            if done is not None:
+                return done, None, None
+            if extract_pool is not None:
+                return None, entry, extract_pool.submit(extract_text, html, u)
+            return None, entry, extract_text(html, u)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as net:
+            futs = [net.submit(fetch_one, u) for u in urls]
+            for u, fut in zip(urls, futs):
+                try:
+                    done, entry, job = fut.result()
+                    if done is None:
+                        text = job.result() if extract_pool is not None else job
+                        entry["text"] = text
+                        self._store(u, entry)
+                        done = FetchResult(u, text, "fetched")
+                except Exception as e:
+                    done = FetchResult(u, "", "error", f"extract failed: {e}")
+                self._count(done.status)
+                yield done
+
+    def close(self):
+        self.session.close()
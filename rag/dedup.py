@@ -0,0 +1,74 @@
+from __future__ import annotations
+import zlib, threading
+from typing import Dict, List
+
+import numpy as np
+
+from .bm25 import tokenize
+
+_BITS = np.arange(64, dtype=np.uint64)
+
+# Texts with fewer word shingles skip the near-duplicate check (exact-id dedup only): a
+# few bits of distance over a handful of shingles would merge distinct one-liners such
+# as "Price of bitcoin on day 1." / "... day 2."
+MIN_SHINGLES = 16
+
+def fingerprint(text: str, shingle: int = 3, min_shingles: int = MIN_SHINGLES) -> int | None:
+    # simhash() for texts long enough for near-duplicate checks, else None
+    toks = tokenize(text)
+    if len(toks) - shingle + 1 < min_shingles:
+        return None
+    return _simhash(toks, shingle)
+
+def simhash(text: str, shingle: int = 3) -> int:
+    # 64-bit SimHash over word shingles; near-identical texts differ in only a few bits
+    return _simhash(tokenize(text), shingle)
+
+def _simhash(toks: List[str], shingle: int) -> int:
+    if not toks:
+        return 0
+    grams = [" ".join(toks[i:i + shingle]) for i in range(max(1, len(toks) - shingle + 1))]
+    hashes = np.fromiter(
+        ((zlib.crc32(b) << 32) | zlib.crc32(b, 0x9E3779B9) for b in (g.encode() for g in grams)),
+        dtype=np.uint64, count=len(grams))
+    votes = ((hashes[:, None] >> _BITS) & np.uint64(1)).sum(axis=0, dtype=np.int64) * 2 - len(hashes)
+    return int(((votes > 0).astype(np.uint64) << _BITS).sum(dtype=np.uint64))
+
+class NearDupIndex:
+    # Fingerprints split into bands; two fingerprints within max_distance bits must agree
+    # on at least one band when bands > max_distance, so only same-band entries are compared.
+    # add_new() is safe to call from several threads (shards of one index share an instance).
+    def __init__(self, max_distance: int = 3, bands: int = 4):
+        assert bands > max_distance and 64 % bands == 0
+        self.max_distance, self.bands = max_distance, bands
+        self._width = 64 // bands
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in range(bands)]
+        self.fingerprints: List[int] = []
+        self._lock = threading.Lock()
+
+    def _keys(self, fp: int):
+        mask = (1 << self._width) - 1
+        return [(fp >> (b * self._width)) & mask for b in range(self.bands)]
+
+    def find(self, fp: int) -> int | None:
+        # Position of a stored near-duplicate, or None
+        for table, key in zip(self._tables, self._keys(fp)):
+            for pos in table.get(key, ()):
+                if bin(self.fingerprints[pos] ^ fp).count("1") <= self.max_distance:
+                    return pos
+        return None
+
+    def add(self, fp: int) -> int:
+        pos = len(self.fingerprints)
+        self.fingerprints.append(fp)
+        for table, key in zip(self._tables, self._keys(fp)):
+            table.setdefault(key, []).append(pos)
+        return pos
+
+    def add_new(self, fp: int) -> bool:
+        # Adds fp unless a near-duplicate is stored; False if it was a near-duplicate
+        with self._lock:
+            if self.find(fp) is not None:
+                return False
+            self.add(fp)
+            return True
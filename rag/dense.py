@@ -0,0 +1,344 @@
+from __future__ import annotations
+import os, copy
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# Dense retrieval backends for HybridIndex. Every backend answers top-k candidate
+# queries over L2-normalised vectors (inner product == cosine); the index keeps the
+# full embedding matrix itself for exact re-scoring of fused candidates.
+
+def topk_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    # argpartition + sort of the k winners instead of a full argsort over the corpus
+    n = len(scores)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+def topk_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    # topk_indices for each row of an (m, n) score matrix: (m, min(k, n)) column ids, best first
+    m, n = scores.shape
+    if n == 0 or k <= 0:
+        return np.empty((m, 0), dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, axis=1, kind="stable")
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, 1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, 1)
+
+# Score-matrix budget (floats) for batched search: queries are scanned in groups of
+# about this many / n_rows, so a group's (queries x rows) matrix stays ~128 MB
+_BATCH_SCORES = 1 << 25
+
+# int8: share of appended values outside the fitted range that triggers re-quantizing
+# every row with a refitted scale (instead of clipping them)
+_REQUANT_CLIPPED = 1e-3
+
+def _empty_results(m: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in range(m)]
+
+def _subset_search(vecs: np.ndarray, q: np.ndarray, k: int, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Exact search restricted to `rows` (e.g. a metadata-filtered subset)
+    scores = vecs[rows] @ q
+    top = topk_indices(scores, k)
+    return rows[top], scores[top]
+
+class ExactDense:
+    # Brute-force search. With dtype float16/int8 the scan runs over a compressed copy
+    # (int8: per-dimension scalar quantization) in row blocks, and the top k * rescore
+    # candidates are re-scored exactly against the float32 vectors, which the index can
+    # keep on disk (memmap) so only the compressed copy stays resident.
+    kind = "exact"
+
+    def __init__(self, dtype: str = "float32", rescore: int = 4, block: int = 16384):
+        if dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"unsupported embedding dtype: {dtype}")
+        self.dtype, self.rescore, self.block = dtype, rescore, block
+        self.vecs = None
+        self.codes = None
+        self.scale = None
+
+    def params(self) -> Dict[str, Any]:
+        return {"dtype": self.dtype, "rescore": self.rescore}
+
+    def set_params(self, **params):
+        if "rescore" in params:
+            self.rescore = int(params["rescore"])
+
+    def _quantize(self, x: np.ndarray) -> np.ndarray:
+        if self.dtype == "float16":
+            return np.asarray(x, dtype=np.float16)
+        return np.clip(np.rint(x / self.scale), -127, 127).astype(np.int8)
+
+    def _blocks(self, embeddings: np.ndarray, a: int):
+        for b in range(a, len(embeddings), self.block):
+            yield np.asarray(embeddings[b:b + self.block], dtype=np.float32)
+
+    def _clipped(self, embeddings: np.ndarray, a: int) -> float:
+        n = sum(int((np.abs(x) > 127.5 * self.scale).sum()) for x in self._blocks(embeddings, a))
+        return n / max(1, (len(embeddings) - a) * embeddings.shape[1])
+
+    def sync(self, embeddings: np.ndarray, n_prev: int):
+        self.vecs = embeddings
+        if self.dtype == "float32":
+            return
+        if self.codes is None or n_prev == 0 or len(self.codes) != n_prev:
+            self.codes, n_prev = None, 0
+        elif self.dtype == "int8" and self._clipped(embeddings, n_prev) > _REQUANT_CLIPPED:
+            # Incremental builds often start from a handful of chunks whose range is too
+            # narrow for the rest of the corpus
+            self.codes, n_prev = None, 0
+        if self.codes is None and self.dtype == "int8":
+            peak = np.zeros(embeddings.shape[1], dtype=np.float32)
+            for x in self._blocks(embeddings, 0):
+                peak = np.maximum(peak, np.abs(x).max(axis=0))
+            self.scale = np.maximum(peak, 1e-8) / 127.0
+        parts = [self._quantize(x) for x in self._blocks(embeddings, n_prev)]
+        if parts:
+            self.codes = np.concatenate(([self.codes] if self.codes is not None else []) + parts)
+
+    def approx_scores(self, q: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        # Scores in the compressed domain, upcast one block at a time (float32 result)
+        if self.codes is None:
+            m = self.vecs if rows is None else self.vecs[rows]
+            return m @ q
+        codes = self.codes if rows is None else self.codes[rows]
+        qq = (q * self.scale if self.dtype == "int8" else q).astype(np.float32)
+        out = np.empty(len(codes), dtype=np.float32)
+        for a in range(0, len(codes), self.block):
+            out[a:a + self.block] = codes[a:a + self.block].astype(np.float32) @ qq
+        return out
+
+    def approx_scores_many(self, Q: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        # (queries, rows) scores as matrix-matrix products over row blocks
+        if self.codes is None:
+            m, QQ = (self.vecs if rows is None else self.vecs[rows]), Q
+        else:
+            m = self.codes if rows is None else self.codes[rows]
+            QQ = (Q * self.scale if self.dtype == "int8" else Q).astype(np.float32)
+        out = np.empty((len(Q), len(m)), dtype=np.float32)
+        for a in range(0, len(m), self.block):
+            out[:, a:a + self.block] = QQ @ np.asarray(m[a:a + self.block], dtype=np.float32).T
+        return out
+
+    def search_many(self, Q: np.ndarray, k: int, rows: np.ndarray | None = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        # search() for each row of Q (same rows restriction for all), one scan per query group
+        if self.vecs is None:
+            return _empty_results(len(Q))
+        Q = np.asarray(Q, dtype=np.float32)
+        n = len(self.vecs) if rows is None else len(rows)
+        step = max(1, _BATCH_SCORES // max(1, n))
+        out = []
+        for a in range(0, len(Q), step):
+            Qg = Q[a:a + step]
+            S = self.approx_scores_many(Qg, rows)
+            if self.codes is None:
+                top = topk_rows(S, k)
+                ids = top if rows is None else rows[top]
+                out += list(zip(ids, np.take_along_axis(S, top, 1)))
+                continue
+            cand = topk_rows(S, k * max(1, self.rescore))
+            cand = cand if rows is None else rows[cand]
+            # Exact re-scoring reads the union of all candidates once, in ascending order
+            uniq, inv = np.unique(cand, return_inverse=True)
+            E = np.asarray(self.vecs[uniq], dtype=np.float32) @ Qg.T
+            exact = E[inv.reshape(cand.shape), np.arange(len(Qg))[:, None]]
+            top = topk_rows(exact, k)
+            out += list(zip(np.take_along_axis(cand, top, 1), np.take_along_axis(exact, top, 1)))
+        return out
+
+    def search(self, q: np.ndarray, k: int, rows: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self.vecs is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.approx_scores(q, rows)
+        if self.codes is None:
+            top = topk_indices(scores, k)
+            ids = top if rows is None else rows[top]
+            return ids, scores[top]
+        cand = topk_indices(scores, k * max(1, self.rescore))
+        cand = cand if rows is None else rows[cand]
+        cand = np.sort(cand)  # ascending rows read the memmap sequentially
+        exact = np.asarray(self.vecs[cand], dtype=np.float32) @ q
+        top = topk_indices(exact, k)
+        return cand[top], exact[top]
+
+    def copy(self) -> "ExactDense":
+        # sync() replaces vecs/codes rather than writing into them, so a shallow copy is a fork
+        return copy.copy(self)
+
+    def nbytes(self) -> int:
+        # Resident bytes of the scanned matrix
+        return int(self.codes.nbytes if self.codes is not None else getattr(self.vecs, "nbytes", 0))
+
+    def save(self, path: str):
+        pass
+
+    def load(self, path: str, embeddings: np.ndarray) -> bool:
+        self.sync(embeddings, 0)
+        return True
+
+class FaissDense:
+    # kind: "flat" (exact, SIMD), "ivf" (inverted lists; recall/latency via nprobe)
+    # or "hnsw" (graph; recall/latency via ef_search, build quality via ef_construction)
+    def __init__(self, kind: str = "hnsw", nlist: int = 1024, nprobe: int = 16,
+                 hnsw_m: int = 32, ef_construction: int = 200, ef_search: int = 64):
+        import faiss  # optional dependency, only needed for ANN backends
+        self._faiss = faiss
+        self.kind = kind
+        self.nlist, self.nprobe = nlist, nprobe
+        self.hnsw_m, self.ef_construction, self.ef_search = hnsw_m, ef_construction, ef_search
+        self.index = None
+        self.vecs = None
+
+    def params(self) -> Dict[str, Any]:
+        return {"nlist": self.nlist, "nprobe": self.nprobe, "hnsw_m": self.hnsw_m,
+                "ef_construction": self.ef_construction, "ef_search": self.ef_search}
+
+    def set_params(self, **params):
+        # Query-time knobs can be changed without rebuilding
+        for name in ("nprobe", "ef_search"):
+            if name in params:
+                setattr(self, name, int(params[name]))
+        self._apply_query_params()
+
+    def _apply_query_params(self):
+        if self.index is None:
+            return
+        if self.kind == "ivf":
+            self.index.nprobe = self.nprobe
+        elif self.kind == "hnsw":
+            self.index.hnsw.efSearch = self.ef_search
+
+    def _new_index(self, train: np.ndarray):
+        faiss = self._faiss
+        d = train.shape[1]
+        if self.kind == "flat":
+            return faiss.IndexFlatIP(d)
+        if self.kind == "hnsw":
+            index = faiss.IndexHNSWFlat(d, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.ef_construction
+            return index
+        if self.kind == "ivf":
+            # faiss wants ~39 training points per centroid; shrink nlist on small corpora
+            nlist = max(1, min(self.nlist, len(train) // 39))
+            index = faiss.IndexIVFFlat(faiss.IndexFlatIP(d), d, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(train)
+            return index
+        raise ValueError(f"unknown dense backend: {self.kind}")
+
+    def _outgrown(self, n: int) -> bool:
+        # An IVF trained on a small first build keeps its few lists forever; retrain once
+        # the corpus could support at least 4x as many (the clone is rebuilt, not the live index)
+        return self.kind == "ivf" and self.index.nlist < self.nlist and n > 4 * 39 * self.index.nlist
+
+    def sync(self, embeddings: np.ndarray, n_prev: int):
+        self.vecs = embeddings
+        if (self.index is None or n_prev == 0 or self.index.ntotal != n_prev
+                or self._outgrown(len(embeddings))):
+            self.index = self._new_index(np.ascontiguousarray(embeddings, dtype=np.float32))
+            n_prev = 0
+        new = np.ascontiguousarray(embeddings[n_prev:], dtype=np.float32)
+        if len(new):
+            self.index.add(new)
+        self._apply_query_params()
+
+    def search(self, q: np.ndarray, k: int, rows: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        if rows is not None:
+            # ANN structures cannot be restricted cheaply; filtered subsets are scored exactly
+            return _subset_search(self.vecs, q, k, rows)
+        if self.index is None or self.index.ntotal == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores, idx = self.index.search(np.asarray(q, dtype=np.float32).reshape(1, -1), min(k, self.index.ntotal))
+        keep = idx[0] >= 0
+        return idx[0][keep].astype(np.int64), scores[0][keep]
+
+    def search_many(self, Q: np.ndarray, k: int, rows: np.ndarray | None = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        Q = np.asarray(Q, dtype=np.float32)
+        if rows is not None:
+            # Filtered subsets are scored exactly, as in search()
+            sub = np.asarray(self.vecs[rows], dtype=np.float32)
+            step = max(1, _BATCH_SCORES // max(1, len(rows)))
+            out = []
+            for a in range(0, len(Q), step):
+                S = Q[a:a + step] @ sub.T
+                top = topk_rows(S, k)
+                out += list(zip(rows[top], np.take_along_axis(S, top, 1)))
+            return out
+        if self.index is None or self.index.ntotal == 0:
+            return _empty_results(len(Q))
+        scores, idx = self.index.search(Q, min(k, self.index.ntotal))
+        return [(i[i >= 0].astype(np.int64), s[i >= 0]) for s, i in zip(scores, idx)]
+
+    def copy(self) -> "FaissDense":
+        # faiss indexes are mutated in place by add(); the next generation gets its own
+        # clone (transiently doubling ANN memory during a build) so readers are unaffected
+        out = copy.copy(self)
+        if self.index is not None:
+            out.index = self._faiss.clone_index(self.index)
+            out._apply_query_params()
+        return out
+
+    def save(self, path: str):
+        if self.index is not None:
+            self._faiss.write_index(self.index, os.path.join(path, "dense.faiss"))
+
+    def load(self, path: str, embeddings: np.ndarray) -> bool:
+        self.vecs = embeddings
+        fp = os.path.join(path, "dense.faiss")
+        if os.path.exists(fp):
+            self.index = self._faiss.read_index(fp)
+        if self.index is None or self.index.ntotal != len(embeddings):
+            self.index = None
+            self.sync(embeddings, 0)
+        self._apply_query_params()
+        return True
+
+def make_dense_backend(kind: str = "exact", **params):
+    if kind in ("exact", "numpy"):
+        return ExactDense(**params)
+    if kind in ("flat", "ivf", "hnsw"):
+        return FaissDense(kind, **params)
+    raise ValueError(f"unknown dense backend: {kind}")
+
+def quantization_report(embeddings: np.ndarray, queries: np.ndarray, k: int = 10, rescore: int = 4) -> List[Dict[str, Any]]:
+    # Recall@k of each storage dtype against exact float32 search, with and without
+    # exact re-scoring, next to the resident bytes of the scanned matrix. The
+    # "_incremental" figures build from a 3-row first batch, as after a small upload.
+    emb = np.asarray(embeddings, dtype=np.float32)
+    truth = [set(topk_indices(emb @ q, k).tolist()) for q in queries]
+    out = []
+    for dtype in ("float32", "float16", "int8"):
+        row = {"dtype": dtype}
+        for rs in (1, rescore):
+            for first in (0, min(3, len(emb))):
+                be = ExactDense(dtype=dtype, rescore=rs)
+                if first:
+                    be.sync(emb[:first], 0)
+                be.sync(emb, first)
+                hits = sum(len(t & set(be.search(q, k)[0].tolist())) for q, t in zip(queries, truth))
+                key = f"recall@{k}" if rs == 1 else f"recall@{k}_rescore{rs}"
+                row[key + ("_incremental" if first else "")] = hits / (k * max(1, len(queries)))
+        row["bytes"] = be.nbytes()
+        row["bytes_per_vector"] = row["bytes"] / max(1, len(emb))
+        out.append(row)
+    return out
+
+if __name__ == "__main__":
+    # python -m rag.dense <snapshot dir> [n_queries]: recall-vs-memory report for a saved index
+    import sys, json
+    snap = sys.argv[1]
+    cur = os.path.join(snap, "CURRENT")
+    if os.path.exists(cur):
+        with open(cur, encoding="utf-8") as f:
+            snap = os.path.join(snap, f.read().strip())
+    emb = np.load(os.path.join(snap, "embeddings.npy"), mmap_mode="r")
+    rng = np.random.default_rng(0)
+    n_q = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    # Perturbed corpus rows stand in for queries near the data distribution
+    qs = np.asarray(emb[rng.choice(len(emb), size=min(n_q, len(emb)), replace=False)], dtype=np.float32)
+    qs = qs + rng.normal(scale=0.05, size=qs.shape).astype(np.float32)
+    qs /= np.linalg.norm(qs, axis=1, keepdims=True)
+    print(json.dumps(quantization_report(emb, qs), indent=2))
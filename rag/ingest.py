@@ -1,9 +1,11 @@
 from __future__ import annotations
-import uuid, pathlib, logging
-from typing import List, Dict, Any
-from pypdf import PdfReader
-import trafilatura
-from .utils import Doc, normalize_text
+import os, re, pathlib, logging, threading, multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Tuple
+from .utils import Doc, normalize_text, cache_key
+from .tokens import count_tokens, split_sentences
+from .crawl import UrlFetcher, DEFAULT_CACHE_DIR
 
 # Silence noisy pypdf warnings from malformed PDFs
 logging.getLogger("pypdf").setLevel(logging.ERROR)
@@ -12,12 +14,44 @@ def read_txt(path: str) -> str:
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
         return f.read()
 
+def iter_text_blocks(path: str, block_chars: int = 65536) -> Iterator[str]:
+    # Text files in ~block_chars pieces cut at line ends, so a file is never read whole
+    buf, size = [], 0
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            buf.append(line)
+            size += len(line)
+            if size >= block_chars:
+                yield "".join(buf)
+                buf, size = [], 0
+    if buf:
+        yield "".join(buf)
+
 def read_pdf(path: str) -> str:
-    text = []
+    return "\n".join(iter_pdf_pages(path))
+
+def iter_pdf_pages(path: str) -> Iterator[str]:
+    from pypdf import PdfReader  # imported on first PDF, not at startup
     reader = PdfReader(path)
     for page in reader.pages:
-        text.append(page.extract_text() or "")
-    return "\n".join(text)
+        yield page.extract_text() or ""
+
+def pdf_page_count(path: str) -> int:
+    from pypdf import PdfReader
+    try:
+        return len(PdfReader(path).pages)
+    except Exception:
+        return 0
+
+def read_pdf_pages(path: str, start: int, stop: int) -> List[str]:
+    # Process-pool task: extract one page range of a PDF
+    from pypdf import PdfReader
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    try:
+        reader = PdfReader(path)
+        return [(reader.pages[i].extract_text() or "") for i in range(start, min(stop, len(reader.pages)))]
+    except Exception:
+        return []
 
 def read_any(path: str) -> str:
     ext = pathlib.Path(path).suffix.lower()
@@ -28,24 +62,128 @@ def read_any(path: str) -> str:
     else:
         return read_txt(path)
 
+_POOL: ProcessPoolExecutor | None = None
+_POOL_LOCK = threading.Lock()
+
+def _worker_pool() -> ProcessPoolExecutor:
+    # PDF page extraction and HTML boilerplate removal; shared across ingestion calls.
+    # spawn avoids forking a process that holds model threads; workers re-import the
+    # main script as __mp_main__, so scripts keep heavy setup under a __main__ guard.
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+_FETCHER: UrlFetcher | None = None
+
+def url_fetcher() -> UrlFetcher:
+    # Process-wide fetcher so the connection pool and HTTP cache are reused across calls
+    global _FETCHER
+    with _POOL_LOCK:
+        if _FETCHER is None:
+            _FETCHER = UrlFetcher(cache_dir=os.environ.get("CRYPTORAG_HTTP_CACHE", DEFAULT_CACHE_DIR) or None)
+        return _FETCHER
+
 def fetch_url(url: str) -> str:
-    downloaded = trafilatura.fetch_url(url)
-    if not downloaded:
-        return ""
-    return trafilatura.extract(downloaded) or ""
-
-def split_to_chunks(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
-    words = text.split()
-    if not words:
-        return []
-    chunks = []
-    i = 0
-    step = max(1, chunk_size - overlap)
-    while i < len(words):
-        chunk = " ".join(words[i:i+chunk_size])
-        chunks.append(chunk)
-        i += step
-    return chunks or [text]
+    for res in url_fetcher().fetch_all([url]):
+        return res.text
+    return ""
+
+# Chunks are sized in tokens so they fit the models: the default embedder reads 256
+# wordpieces and the cross-encoder 512 (query + chunk); BPE counts run a little lower
+# than wordpiece counts, hence the margin.
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP = 32
+_BLOCK_RE = re.compile(r"\n\s*\n")
+_HEADING_RE = re.compile(r"^(#{1,6}\s+\S.*|\d+(\.\d+)*\.?\s+[A-Z][^.!?]{0,80})$")
+
+def _block_units(block: str) -> Iterator[Tuple[str, bool]]:
+    # (unit, is_heading): heading lines stand alone, other lines of the block are joined
+    # into one paragraph and split into sentences
+    para: List[str] = []
+    for line in block.splitlines():
+        line = line.strip()
+        if _HEADING_RE.match(line):
+            if para:
+                yield from ((x, False) for x in split_sentences(" ".join(para)))
+                para = []
+            yield line, True
+        elif line:
+            para.append(line)
+    if para:
+        yield from ((x, False) for x in split_sentences(" ".join(para)))
+
+def _iter_units(pieces: Iterable[str], max_tokens: int) -> Iterator[Tuple[str, bool]]:
+    # Sentence/heading units from a stream of text pieces (e.g. PDF pages). The last,
+    # possibly unfinished sentence of a piece is carried into the next one, so memory
+    # is bounded by one piece plus that tail.
+    carry = ""
+    for piece in pieces:
+        text = f"{carry}\n{piece}" if carry else piece
+        units = [u for b in _BLOCK_RE.split(text) for u in _block_units(b)]
+        carry = ""
+        if units and not units[-1][1] and not text.rstrip(" \t").endswith("\n\n"):
+            tail = units.pop()[0]
+            if count_tokens(tail) <= max_tokens:
+                carry = tail
+            else:
+                units.append((tail, False))
+        yield from units
+    if carry:
+        yield carry, False
+
+def _split_long(unit: str, max_tokens: int) -> Iterator[str]:
+    # Word windows of at most max_tokens for a unit that cannot fit one chunk
+    buf: List[str] = []
+    n = 0
+    for w in unit.split():
+        c = count_tokens(" " + w)
+        if buf and n + c > max_tokens:
+            yield " ".join(buf)
+            buf, n = [], 0
+        buf.append(w)
+        n += c
+    if buf:
+        yield " ".join(buf)
+
+def iter_chunks(pieces: Iterable[str], chunk_tokens: int = CHUNK_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP) -> Iterator[str]:
+    # Streaming chunker: packs whole sentences into chunks of at most chunk_tokens tokens,
+    # carrying up to overlap_tokens of trailing sentences into the next chunk. A heading
+    # starts a new chunk (without overlap) once the current one is half full. Only one
+    # chunk of units is buffered, so peak memory does not grow with document size.
+    buf: deque = deque()  # (unit, tokens)
+    total = 0
+    fresh = False  # buf holds units not yet emitted
+    for unit, heading in _iter_units(pieces, chunk_tokens):
+        n = count_tokens(unit)
+        parts = [(unit, n)] if n <= chunk_tokens else [(x, count_tokens(x)) for x in _split_long(unit, chunk_tokens)]
+        for text, n in parts:
+            if fresh and (total + n > chunk_tokens or (heading and total >= chunk_tokens // 2)):
+                yield " ".join(u for u, _ in buf)
+                fresh = False
+                if heading:
+                    buf.clear()
+                    total = 0
+                while buf and total > overlap_tokens:
+                    total -= buf.popleft()[1]
+            while buf and total + n > chunk_tokens:
+                total -= buf.popleft()[1]
+            buf.append((text, n))
+            total += n
+            fresh = True
+            heading = False
+    if fresh:
+        yield " ".join(u for u, _ in buf)
+
+def split_to_chunks(text: str, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP) -> List[str]:
+    return list(iter_chunks([text], chunk_tokens, overlap_tokens))
+
+def chunk_id(text: str) -> str:
+    # Content-addressed: the same chunk text always gets the same id, whatever its source
+    return cache_key(text)[:32]
 
 def guess_coin(label: str) -> str:
     low = label.lower()
@@ -53,32 +191,85 @@ def guess_coin(label: str) -> str:
     if "ethereum" in low or "eth" in low: return "ethereum"
     return ""
 
-def build_docs_from_paths(paths: List[str], source_label: str = "local") -> List[Doc]:
-    docs: List[Doc] = []
-    for p in paths or []:
-        raw = read_any(p)
-        if not raw: 
+# A lone PDF smaller than this is extracted in-process: starting spawn workers (each
+# re-imports the package) costs more than the pages
+POOL_MIN_PDF_BYTES = 1 << 20
+
+def _iter_file_pieces(paths: List[str], pages_per_task: int, max_inflight: int) -> Iterator[tuple]:
+    # Yields (path, iterator of text pieces) in input order; each file's pieces must be
+    # consumed before the next file. PDF page ranges are extracted on the process pool with
+    # at most max_inflight ranges outstanding across files, so memory stays bounded while
+    # every core works ahead of the chunker/embedder. Page counts are read by the workers
+    # too, all submitted up front, and each file's ranges are planned once its count is in.
+    pdfs = [p for p in paths if pathlib.Path(p).suffix.lower() == ".pdf"]
+    use_pool = len(pdfs) > 1 or any(os.path.getsize(p) >= POOL_MIN_PDF_BYTES for p in pdfs)
+    pool = _worker_pool() if use_pool else None
+    counts = {p: pool.submit(pdf_page_count, p) for p in pdfs} if pool is not None else {}
+
+    def page_ranges(p):
+        return [(p, a, a + pages_per_task) for a in range(0, counts[p].result(), pages_per_task)]
+
+    ranges = (t for p in pdfs for t in page_ranges(p))
+    window: deque = deque()
+
+    def submit_more():
+        while len(window) < max_inflight:
+            t = next(ranges, None)
+            if t is None:
+                return
+            window.append(pool.submit(read_pdf_pages, *t))
+
+    def pdf_pieces(p):
+        for _ in page_ranges(p):
+            submit_more()
+            yield from window.popleft().result()
+
+    for p in paths:
+        if p not in counts:
+            yield p, (iter(read_pdf_pages(p, 0, 1 << 31)) if p in pdfs else iter_text_blocks(p))
             continue
+        submit_more()
+        yield p, pdf_pieces(p)
+
+def iter_docs_from_paths(paths: List[str], source_label: str = "local", pages_per_task: int = 8,
+                         progress: Callable[[int, int, int], None] | None = None) -> Iterator[Doc]:
+    # Generator version of build_docs_from_paths; progress(files_done, files_total, chunks)
+    paths = list(paths or [])
+    n_chunks = 0
+    max_inflight = 2 * (os.cpu_count() or 1)
+    for done, (p, pieces) in enumerate(_iter_file_pieces(paths, pages_per_task, max_inflight), 1):
         coin = guess_coin(p)
-        for i, chunk in enumerate(split_to_chunks(raw)):
-            docs.append(Doc(
-                id=f"{uuid.uuid4()}",
-                text=normalize_text(chunk),
+        for i, chunk in enumerate(iter_chunks(pieces)):
+            n_chunks += 1
+            text = normalize_text(chunk)
+            yield Doc(
+                id=chunk_id(text),
+                text=text,
                 metadata={"source": source_label, "path": p, "chunk": i, "coin": coin}
-            ))
-    return docs
+            )
+        if progress:
+            progress(done, len(paths), n_chunks)
+
+def build_docs_from_paths(paths: List[str], source_label: str = "local") -> List[Doc]:
+    return list(iter_docs_from_paths(paths, source_label))
 
-def build_docs_from_urls(urls: List[str], source_label: str = "web") -> List[Doc]:
+def build_docs_from_urls(urls: List[str], source_label: str = "web", fetcher: UrlFetcher | None = None,
+                         skip_unchanged: bool = False) -> List[Doc]:
+    # skip_unchanged drops pages the HTTP cache proved identical to the last fetch
     docs: List[Doc] = []
-    for u in urls or []:
-        raw = fetch_url(u)
-        if not raw: 
+    fetcher = fetcher or url_fetcher()
+    # A single page is extracted on the fetch thread rather than starting spawn workers
+    pool = _worker_pool() if len(set(urls or [])) > 1 else None
+    for res in fetcher.fetch_all(urls, extract_pool=pool):
+        u, raw = res.url, res.text
+        if not raw or (skip_unchanged and res.status in ("not_modified", "unchanged")):
             continue
         coin = guess_coin(u)
-        for i, chunk in enumerate(split_to_chunks(raw)):
+        for i, chunk in enumerate(iter_chunks([raw])):
+            text = normalize_text(chunk)
             docs.append(Doc(
-                id=f"{uuid.uuid4()}",
-                text=normalize_text(chunk),
+                id=chunk_id(text),
+                text=text,
                 metadata={"source": source_label, "url": u, "chunk": i, "coin": coin}
             ))
     return docs
@@ -0,0 +1,92 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+class _Column:
+    # Dictionary-encoded metadata column: one int32 code per doc (-1 = key missing)
+    # plus per-value postings (CSR over doc ids) rebuilt on finalize().
+    __slots__ = ("values", "lookup", "codes", "order", "indptr")
+
+    def __init__(self, n_docs: int):
+        self.values: List[str] = []
+        self.lookup: Dict[str, int] = {}
+        self.codes = np.full(n_docs, -1, dtype=np.int32)
+        self.order = np.empty(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+
+    def code(self, value: Any) -> int:
+        # Values are compared lowercased as strings, like the original filter closure
+        v = str(value).lower()
+        c = self.lookup.get(v)
+        if c is None:
+            c = self.lookup[v] = len(self.values)
+            self.values.append(v)
+        return c
+
+    def finalize(self):
+        present = np.flatnonzero(self.codes >= 0)
+        codes = self.codes[present]
+        self.order = present[np.argsort(codes, kind="stable")]
+        self.indptr = np.zeros(len(self.values) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(self.values)), out=self.indptr[1:])
+
+    def postings(self, c: int) -> np.ndarray:
+        return self.order[self.indptr[c]:self.indptr[c + 1]]
+
+class MetaStore:
+    def __init__(self):
+        self.n_docs = 0
+        self.columns: Dict[str, _Column] = {}
+        self._masks: Dict[Tuple, np.ndarray] = {}
+
+    def copy(self) -> "MetaStore":
+        # Fork for building the next index generation; add() replaces the code/postings
+        # arrays, so only the per-column value dictionaries are duplicated
+        out = MetaStore()
+        out.n_docs = self.n_docs
+        for key, col in self.columns.items():
+            c = _Column(0)
+            c.values, c.lookup = list(col.values), dict(col.lookup)
+            c.codes, c.order, c.indptr = col.codes, col.order, col.indptr
+            out.columns[key] = c
+        return out
+
+    def add(self, metadatas: List[Dict[str, Any]]):
+        base, n = self.n_docs, len(metadatas)
+        for col in self.columns.values():
+            col.codes = np.concatenate([col.codes, np.full(n, -1, dtype=np.int32)])
+        for j, md in enumerate(metadatas):
+            for key, value in md.items():
+                col = self.columns.get(key)
+                if col is None:
+                    col = self.columns[key] = _Column(base + n)
+                col.codes[base + j] = col.code(value)
+        self.n_docs = base + n
+        for col in self.columns.values():
+            col.finalize()
+        self._masks.clear()
+
+    def mask(self, filters: Dict[str, Any]) -> np.ndarray:
+        # AND across keys, OR across listed values; a value matches when it is a
+        # substring of the stored value. Matching runs over distinct values only,
+        # then their postings are OR-ed into a boolean doc mask.
+        spec = tuple(sorted(
+            (k, tuple(sorted(str(x).lower() for x in v)) if isinstance(v, (list, tuple, set)) else (str(v).lower(),))
+            for k, v in filters.items()))
+        cached = self._masks.get(spec)
+        if cached is not None:
+            return cached
+        out = np.ones(self.n_docs, dtype=bool)
+        for key, wanted in spec:
+            col = self.columns.get(key)
+            field = np.zeros(self.n_docs, dtype=bool)
+            if col is not None:
+                for c, v in enumerate(col.values):
+                    if any(w in v for w in wanted):
+                        field[col.postings(c)] = True
+            out &= field
+        if len(self._masks) >= 256:
+            self._masks.clear()
+        self._masks[spec] = out
+        return out
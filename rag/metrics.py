@@ -0,0 +1,249 @@
+from __future__ import annotations
+import time, bisect, logging, threading, weakref, contextvars
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Tuple
+
+log = logging.getLogger(__name__)
+
+# Stage timings, LLM streaming rates and counters for the RAG path, exported in the
+# Prometheus text format. Recording is off until enable() is called: timed() then
+# returns a shared no-op context unless a per-answer Trace is active, so the
+# instrumented code pays one flag check and one context-variable lookup per stage.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 60, 80, 120, 200, 400)
+
+_enabled = False
+_NOOP = nullcontext()
+_TRACE: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("rag_trace", default=None)
+
+def enable(flag: bool = True):
+    global _enabled
+    _enabled = flag
+
+def enabled() -> bool:
+    return _enabled
+
+def _fmt(v: float) -> str:
+    return "+Inf" if v == float("inf") else repr(float(v))
+
+def _labels(name: str | None, value: str, extra: Dict[str, str] | None = None) -> str:
+    pairs = ([(name, value)] if name else []) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    esc = lambda s: str(s).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        self.name, self.help, self.label = name, help, label
+        self.values: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1.0, label: str = ""):
+        with self._lock:
+            self.values[label] = self.values.get(label, 0.0) + n
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_labels(self.label, l)} {_fmt(v)}" for l, v in items]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS, label: str | None = None):
+        self.name, self.help, self.label = name, help, label
+        self.buckets = tuple(float(b) for b in buckets)
+        self.values: Dict[str, list] = {}  # label -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, label: str = ""):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            b = self.values.get(label)
+            if b is None:
+                b = self.values[label] = [[0] * (len(self.buckets) + 1), 0.0]
+            b[0][i] += 1
+            b[1] += value
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            items = sorted((l, list(b[0]), b[1]) for l, b in self.values.items())
+        out = []
+        for l, counts, total in items:
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                out.append(f"{self.name}_bucket{_labels(self.label, l, {'le': _fmt(le)})} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.label, l)} {_fmt(total)}")
+            out.append(f"{self.name}_count{_labels(self.label, l)} {acc}")
+        return out
+
+class Registry:
+    # Owned metrics plus collectors: callables returning
+    # (name, kind, help, labels, value) samples read at scrape time (sizes, cache
+    # counters kept elsewhere). Bound-method collectors are held weakly.
+    def __init__(self):
+        self.metrics: Dict[str, Counter | Histogram] = {}
+        self._collectors: List[Callable[[], Callable | None]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, fn: Callable[[], List[Tuple[str, str, str, Dict[str, str], float]]]):
+        ref = weakref.WeakMethod(fn) if hasattr(fn, "__self__") else (lambda: fn)
+        with self._lock:
+            self._collectors.append(ref)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self.metrics.values())
+            self._collectors = [r for r in self._collectors if r() is not None]
+            collectors = [r() for r in self._collectors]
+        out: List[str] = []
+        for m in metrics:
+            out += [f"# HELP {m.name} {m.help}", f"# TYPE {m.name} {m.kind}"] + m.lines()
+        grouped: Dict[str, Tuple[str, str, List[str]]] = {}
+        for fn in collectors:
+            if fn is None:
+                continue
+            try:
+                samples = fn()
+            except Exception as e:
+                log.warning("metrics collector failed: %s", e)
+                continue
+            for name, kind, help, labels, value in samples:
+                entry = grouped.setdefault(name, (kind, help, []))
+                entry[2].append(f"{name}{_labels(None, '', labels)} {_fmt(value)}")
+        for name, (kind, help, lines) in grouped.items():
+            out += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"] + lines
+        return "\n".join(out) + "\n"
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(Histogram("rag_stage_seconds", "Duration of each RAG stage", label="stage"))
+TTFT_SECONDS = REGISTRY.register(Histogram("rag_llm_time_to_first_token_seconds",
+                                           "Time from sending the chat request to the first streamed token"))
+TOKENS_PER_SECOND = REGISTRY.register(Histogram("rag_llm_tokens_per_second",
+                                                "Streamed completion tokens per second after the first", RATE_BUCKETS))
+COMPLETION_TOKENS = REGISTRY.register(Counter("rag_llm_completion_tokens_total", "Streamed completion tokens"))
+REQUESTS = REGISTRY.register(Counter("rag_requests_total", "Questions by outcome route", label="route"))
+
+class Trace:
+    # Timings of one answer, for the per-answer timing line; stages are kept in the
+    # order they first ran and repeated stages are summed
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.ttft: float | None = None
+        self.tokens = 0
+        self.tokens_per_second: float | None = None
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def line(self) -> str:
+        parts = [f"{s} {v * 1000:.0f}ms" for s, v in self.stages.items()]
+        if self.ttft is not None:
+            parts.append(f"first token {self.ttft * 1000:.0f}ms")
+        if self.tokens_per_second is not None:
+            parts.append(f"{self.tokens_per_second:.0f} tok/s")
+        parts.append(f"total {time.perf_counter() - self.started:.2f}s")
+        return "⏱ " + " · ".join(parts)
+
+class _Timer:
+    __slots__ = ("stage", "trace", "t0")
+
+    def __init__(self, stage: str, trace: Trace | None):
+        self.stage, self.trace = stage, trace
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        dt = time.perf_counter() - self.t0
+        if _enabled:
+            STAGE_SECONDS.observe(dt, self.stage)
+        if self.trace is not None:
+            self.trace.add(self.stage, dt)
+        return False
+
+def timed(stage: str):
+    # with timed("bm25"): ...  -- recorded into the histograms and the active Trace, if any
+    tr = _TRACE.get()
+    if not _enabled and tr is None:
+        return _NOOP
+    return _Timer(stage, tr)
+
+@contextmanager
+def use(trace: Trace | None) -> Iterator[Trace | None]:
+    # Makes `trace` the active trace of the current context (thread or task)
+    token = _TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        _TRACE.reset(token)
+
+class StreamTimer:
+    # Time-to-first-token and tokens/s of one LLM stream. Each streamed content delta is
+    # counted as one token (what OpenAI-compatible servers send for chat completions).
+    __slots__ = ("trace", "t0", "first", "tokens")
+
+    def __init__(self, trace: Trace | None = None):
+        self.trace = trace
+        self.t0 = time.perf_counter()
+        self.first: float | None = None
+        self.tokens = 0
+
+    def token(self):
+        if self.first is None:
+            self.first = time.perf_counter()
+        self.tokens += 1
+
+    def done(self):
+        if self.first is None:
+            return
+        ttft = self.first - self.t0
+        gen = time.perf_counter() - self.first
+        rate = (self.tokens - 1) / gen if self.tokens > 1 and gen > 0 else None
+        if _enabled:
+            TTFT_SECONDS.observe(ttft)
+            COMPLETION_TOKENS.inc(self.tokens)
+            if rate is not None:
+                TOKENS_PER_SECOND.observe(rate)
+        if self.trace is not None:
+            self.trace.ttft, self.trace.tokens, self.trace.tokens_per_second = ttft, self.tokens, rate
+
+def count_request(route: str):
+    if _enabled:
+        REQUESTS.inc(label=route)
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port: int = 9464, addr: str = "127.0.0.1") -> ThreadingHTTPServer:
+    # Prometheus scrape endpoint (GET /metrics) on a daemon thread; enables recording
+    enable()
+    server = ThreadingHTTPServer((addr, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
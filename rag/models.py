@@ -0,0 +1,134 @@
+from __future__ import annotations
+import time, logging, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Tuple
+
+log = logging.getLogger(__name__)
+
+# Process-wide model registry. Models are loaded once per (kind, name) on a background
+# thread, warmed up with a tiny forward pass (so the first query doesn't pay for lazy
+# graph/kernel initialisation) and shared by every pipeline, index shard and reranker
+# that asks for them. The heavy libraries are only imported by the loader threads.
+
+def _load_embedder(name: str):
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(name)
+    model.encode(["warm up"], convert_to_numpy=True, normalize_embeddings=True)
+    return model
+
+def _load_cross_encoder(name: str):
+    from sentence_transformers import CrossEncoder
+    model = CrossEncoder(name)
+    model.predict([("warm up", "warm up")])
+    return model
+
+LOADERS: Dict[str, Callable[[str], Any]] = {
+    "embedder": _load_embedder,
+    "cross-encoder": _load_cross_encoder,
+}
+
+class ModelHandle:
+    # Stands in for the model while it loads: attribute access (encode, predict, ...)
+    # waits for the load to finish and then goes to the real model, so callers can hold
+    # a handle from the start and only block if they use it before it is ready.
+    # A failed load is not final: the next use after RETRY_AFTER seconds (or load() of
+    # the same model) starts a new one in place, so everyone holding the handle recovers
+    # from a transient download error.
+    RETRY_AFTER = 10.0
+
+    def __init__(self, kind: str, name: str, future: Future):
+        self.kind = kind
+        self.name = name
+        self.seconds: float | None = None
+        self.failed_at: float | None = None
+        self._lock = threading.Lock()
+        self._watch(future)
+
+    def _watch(self, future: Future):
+        self.future = future
+        self.started = time.time()
+        future.add_done_callback(self._done)
+
+    def _done(self, fut: Future):
+        self.seconds = time.time() - self.started
+        if fut.exception() is not None:
+            self.failed_at = time.time()
+            log.warning("loading %s %s failed: %s", self.kind, self.name, fut.exception())
+        else:
+            log.info("loaded %s %s in %.1fs", self.kind, self.name, self.seconds)
+
+    def retry(self, force: bool = False) -> bool:
+        # Starts a new load if the last one failed (at least RETRY_AFTER ago unless forced)
+        with self._lock:
+            if self.state != "failed" or self.kind not in LOADERS:
+                return False
+            if not force and time.time() - (self.failed_at or 0.0) < self.RETRY_AFTER:
+                return False
+            log.info("retrying %s %s", self.kind, self.name)
+            self._watch(_POOL.submit(LOADERS[self.kind], self.name))
+            return True
+
+    def get(self, timeout: float | None = None):
+        if self.future.done() and self.future.exception() is not None:
+            self.retry()
+        return self.future.result(timeout)
+
+    def ready(self) -> bool:
+        return self.future.done() and self.future.exception() is None
+
+    @property
+    def state(self) -> str:
+        if not self.future.done():
+            return "loading"
+        return "failed" if self.future.exception() is not None else "ready"
+
+    def status(self) -> Dict[str, Any]:
+        err = self.future.exception() if self.future.done() else None
+        return {"kind": self.kind, "name": self.name, "state": self.state, "seconds": self.seconds,
+                "error": str(err) if err is not None else None}
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"):
+            raise AttributeError(attr)
+        return getattr(self.get(), attr)
+
+    def __repr__(self):
+        return f"ModelHandle({self.kind!r}, {self.name!r}, {self.state})"
+
+_HANDLES: Dict[Tuple[str, str], ModelHandle] = {}
+_LOCK = threading.Lock()
+_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-load")
+
+def load(kind: str, name: str) -> ModelHandle:
+    # Returns the shared handle, starting the load if this model hasn't been requested yet
+    # (or retrying it right away if its last load failed)
+    if kind not in LOADERS:
+        raise ValueError(f"unknown model kind {kind!r}; expected one of {sorted(LOADERS)}")
+    with _LOCK:
+        h = _HANDLES.get((kind, name))
+        if h is None:
+            h = _HANDLES[(kind, name)] = ModelHandle(kind, name, _POOL.submit(LOADERS[kind], name))
+            return h
+    h.retry(force=True)
+    return h
+
+def register(kind: str, name: str, model) -> ModelHandle:
+    # Installs an already-constructed model under `name` (e.g. an offline stand-in for
+    # benchmarks); pipelines asking for that name then use it as is
+    fut: Future = Future()
+    fut.set_result(model)
+    with _LOCK:
+        h = _HANDLES[(kind, name)] = ModelHandle(kind, name, fut)
+    return h
+
+def preload(dense_model: str | None = None, reranker_model: str | None = None) -> Dict[str, ModelHandle]:
+    out = {}
+    if dense_model:
+        out["embedder"] = load("embedder", dense_model)
+    if reranker_model:
+        out["reranker"] = load("cross-encoder", reranker_model)
+    return out
+
+def status() -> Dict[str, Dict[str, Any]]:
+    with _LOCK:
+        return {f"{k}:{n}": h.status() for (k, n), h in _HANDLES.items()}
@@ -1,30 +1,148 @@
 from __future__ import annotations
-from typing import List, Dict, Any
+import os, asyncio, logging, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, List, Dict, Any, AsyncIterator, Iterator
 
-from openai import OpenAI
-from .utils import HybridIndex, Reranker, Doc, select_fewshots
-from .ingest import build_docs_from_paths, build_docs_from_urls
+from . import models, metrics
+from .utils import HybridIndex, Reranker, Doc, select_fewshots, encode_fewshots
+from .shards import ShardedHybridIndex
+from .cache import QueryEmbeddingCache, AnswerCache
+from .batching import BatchedEmbedder, BatchedCrossEncoder
+from .prompt import PromptAssembler, AssembledPrompt, DEFAULT_PROMPT_BUDGET
+from .tokens import get_encoding, encoding_name_for_model
+from .ingest import iter_docs_from_paths, build_docs_from_urls
 from prompts import SYSTEM_PROMPT, FEWSHOTS
 
+if TYPE_CHECKING:
+    from openai import OpenAI, AsyncOpenAI
+
+log = logging.getLogger(__name__)
+
 class CryptoRAGPipeline:
-    def __init__(self, dense_model: str = "sentence-transformers/all-MiniLM-L6-v2", reranker_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"):
-        self.index = HybridIndex(dense_model_name=dense_model)
+    def __init__(self, dense_model: str = "sentence-transformers/all-MiniLM-L6-v2", reranker_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+                 dense_backend: str = "exact", dense_params: Dict[str, Any] | None = None,
+                 query_cache_size: int = 4096, answer_cache: AnswerCache | None = None,
+                 micro_batch: bool = False, batch_max: int = 32, batch_wait_ms: float = 4.0,
+                 adaptive_rerank: bool = False, embedding_dtype: str = "float32",
+                 shards: int = 0, shard_key: str | None = None,
+                 prompt_budget: int = DEFAULT_PROMPT_BUDGET, prompt_budgets: Dict[str, int] | None = None):
+        # Both models start loading (and warming up) in the background right away; handles
+        # are shared process-wide, so another pipeline with the same names reuses them
+        self.models = models.preload(dense_model, reranker_model)
+        index_args = dict(dense_model_name=dense_model, dense_backend=dense_backend, dense_params=dense_params,
+                          embedding_dtype=embedding_dtype)
+        # shard_key partitions by that metadata field, shards > 0 alone by doc id hash
+        if shards > 0 or shard_key:
+            self.index = ShardedHybridIndex(shard_key=shard_key, n_shards=shards or 4, **index_args)
+        else:
+            self.index = HybridIndex(**index_args)
         self.reranker = Reranker(reranker_model)
+        self.adaptive_rerank = adaptive_rerank
+        if micro_batch:
+            # Concurrent queries share embedder/cross-encoder forward passes
+            self.index.embedder = BatchedEmbedder(self.index.embedder, max_batch=batch_max, max_wait_ms=batch_wait_ms)
+            self.reranker.model = BatchedCrossEncoder(self.reranker.model, max_batch=2 * batch_max, max_wait_ms=batch_wait_ms)
         self.client: OpenAI | None = None
+        self.aclient: AsyncOpenAI | None = None
+        # CPU-bound stages (embedding, BM25, dense scoring, reranking) of the async path
+        self.executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="rag")
+        # One query embedding per question, shared by retrieval and few-shot selection
+        self.query_cache = QueryEmbeddingCache(maxsize=query_cache_size)
+        self.index.query_cache = self.query_cache
+        self._fewshot_vecs = None
+        # Completed answers for repeated/near-duplicate questions; dropped when the index changes
+        self.answer_cache = answer_cache if answer_cache is not None else AnswerCache()
+        self._answer_cache_gen = self.index.generation
+        # Input-token budget for the chat prompt (default, and per-model overrides)
+        self.prompt = PromptAssembler(SYSTEM_PROMPT, budgets=prompt_budgets, default_budget=prompt_budget)
+        # Per-pipeline warm-up once the embedder is in: few-shot vectors and the tokenizer
+        self.warmup = self.executor.submit(self._warm_up)
+        metrics.REGISTRY.register_collector(self._collect_metrics)
+
+    def _warm_up(self):
+        self._fewshot_vecs = encode_fewshots(FEWSHOTS, self.index.embedder)
+        get_encoding(encoding_name_for_model("gpt-4o-mini"))
+
+    def models_status(self) -> Dict[str, Dict[str, Any]]:
+        return {role: h.status() for role, h in self.models.items()}
+
+    def models_ready(self) -> bool:
+        return all(h.ready() for h in self.models.values())
+
+    def retry_models(self) -> bool:
+        # Restarts failed model loads now; True if any was restarted
+        return any([h.retry(force=True) for h in self.models.values()])
 
-    def set_openai(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
+    def _collect_metrics(self):
+        # Scrape-time samples: cache counters, index sizes and model readiness
+        out = []
+        caches = {"query_embedding": self.query_cache, "answer": self.answer_cache, "rerank": self.reranker.cache}
+        for name, c in caches.items():
+            st = c.stats()
+            out += [("rag_cache_hits_total", "counter", "Cache hits", {"cache": name}, st["hits"]),
+                    ("rag_cache_misses_total", "counter", "Cache misses", {"cache": name}, st["misses"]),
+                    ("rag_cache_hit_ratio", "gauge", "Cache hits / lookups", {"cache": name}, st["hit_rate"]),
+                    ("rag_cache_entries", "gauge", "Cached entries", {"cache": name}, st["size"])]
+        out += [("rag_index_chunks", "gauge", "Searchable chunks", {}, self.index.n_built),
+                ("rag_index_pending_chunks", "gauge", "Chunks staged for the next build", {}, self.index.pending()),
+                ("rag_index_generation", "gauge", "Index generation", {}, self.index.generation)]
+        out += [("rag_model_ready", "gauge", "1 once the model is loaded and warmed up", {"role": role}, float(h.ready()))
+                for role, h in self.models.items()]
+        return out
 
-    def add_local_files(self, paths: List[str]):
-        docs = build_docs_from_paths(paths, source_label="local")
-        self.index.add(docs)
+    def set_openai(self, api_key: str, base_url: str | None = None):
+        # base_url allows any OpenAI-compatible endpoint (e.g. a local fake server)
+        from openai import OpenAI, AsyncOpenAI
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.aclient = AsyncOpenAI(api_key=api_key, base_url=base_url)
 
-    def add_urls(self, urls: List[str]):
+    def add_local_files(self, paths: List[str], progress=None, batch_size: int = 64) -> int:
+        # Chunks stream out of the ingestion pool and are embedded in batches as they arrive;
+        # progress(files_done, files_total, chunks) is forwarded from ingestion.
+        # Returns how many new (non-duplicate) chunks were added.
+        n, batch = 0, []
+        for doc in iter_docs_from_paths(paths, source_label="local", progress=progress):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                n += self.index.add(batch, embed=True)
+                batch = []
+        if batch:
+            n += self.index.add(batch, embed=True)
+        return n
+
+    def add_urls(self, urls: List[str]) -> int:
         docs = build_docs_from_urls(urls, source_label="web")
-        self.index.add(docs)
+        return self.index.add(docs)
+
+    def build(self, rebuild: bool = False) -> int:
+        # Incremental by default: returns how many new chunks were embedded
+        n = self.index.pending() if not rebuild else len(self.index.docs)
+        self.index.build(rebuild=rebuild)
+        return n
+
+    def build_async(self, rebuild: bool = False, save_to: str | None = None):
+        # Background build; the new index is swapped in when done and queries keep running
+        # against the previous one meanwhile. save_to snapshots it from the build worker.
+        after = partial(self.save_index, save_to) if save_to else None
+        return self.index.build_async(rebuild=rebuild, after=after)
+
+    def build_status(self) -> Dict[str, Any]:
+        return self.index.build_status()
+
+    def batching_stats(self) -> Dict[str, Any]:
+        out = {}
+        if isinstance(self.index.embedder, BatchedEmbedder):
+            out["embedder"] = self.index.embedder.batcher.stats()
+        if isinstance(self.reranker.model, BatchedCrossEncoder):
+            out["reranker"] = self.reranker.model.batcher.stats()
+        return out
 
-    def build(self):
-        self.index.build()
+    def save_index(self, root: str) -> str:
+        return self.index.save(root)
+
+    def load_index(self, root: str) -> bool:
+        return self.index.load(root)
 
     def route(self, query: str) -> str:
         q = query.lower()
@@ -32,55 +150,199 @@ class CryptoRAGPipeline:
             return "tools"
         return "rag"
 
-    def build_prompt(self, query: str, contexts: List[Doc]) -> str:
-        fs = select_fewshots(query, FEWSHOTS, self.index.embedder, n=2)
-        few = "\n\n".join([f"Q: {x['q']}\nA: {x['a']}" for x in fs])
-        ctx = "\n\n".join([f"[{i+1}] {c.text[:1200]}" for i, c in enumerate(contexts)])
-        prompt = f"""{SYSTEM_PROMPT}
-
-Few-shot examples:
-{few}
-
-Context (use to answer if relevant; cite [#]):
-{ctx}
+    def build_prompt(self, query: str, contexts: List[Doc], model: str = "gpt-4o-mini") -> AssembledPrompt:
+        with metrics.timed("fewshots"):
+            fs = select_fewshots(query, FEWSHOTS, self.index.embedder, n=2,
+                                 query_vec=self.index.encode_query(query), example_vecs=self._fewshot_vecs)
+        # Canonical order, so the same pair always renders the same prompt prefix
+        fs = sorted(fs, key=lambda x: FEWSHOTS.index(x) if x in FEWSHOTS else len(FEWSHOTS))
+        with metrics.timed("prompt"):
+            return self.prompt.assemble(query, contexts, fs, model)
 
-User question: {query}
+    def _cached_answer(self, query: str, contexts: List[Doc], model: str):
+        # (cached answer or None, context key, query vector); the vector is reused by
+        # put() so a fresh answer is stored without encoding the query again
+        if self.index.generation != self._answer_cache_gen:
+            self.answer_cache.clear()
+            self._answer_cache_gen = self.index.generation
+        key = tuple(c.id for c in contexts)
+        qvec = self.index.encode_query(query)
+        return self.answer_cache.get(query, qvec, model, key), key, qvec
 
-Answer:"""
-        return prompt
-
-    def answer_stream(self, query: str, contexts: List[Doc], model: str = "gpt-4o-mini"):
-        assert self.client is not None, "LLM client not set"
-        prompt = self.build_prompt(query, contexts)
-        with self.client.chat.completions.create(
+    def _completion_args(self, query: str, contexts: List[Doc], model: str,
+                         info: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        prompt = self.build_prompt(query, contexts, model)
+        stats = prompt.stats()
+        log.info("prompt model=%s tokens=%d/%d contexts=%d dropped=%d", model, stats["prompt_tokens"],
+                 stats["budget"], stats["contexts_used"], stats["contexts_dropped"])
+        if info is not None:
+            info.update(stats)
+        return dict(
             model=model,
-            messages=[{"role":"system","content":SYSTEM_PROMPT},
-                      {"role":"user","content":prompt}],
+            messages=prompt.messages,
             stream=True,
             temperature=0.3,
             max_tokens=400
-        ) as stream:
+        )
+
+    def answer_stream(self, query: str, contexts: List[Doc], model: str = "gpt-4o-mini",
+                      info: Dict[str, Any] | None = None, trace: metrics.Trace | None = None):
+        # info, if given, receives the prompt's token count and context usage;
+        # trace, if given, the prompt stage timings, time-to-first-token and tokens/s
+        assert self.client is not None, "LLM client not set"
+        cached, ctx_key, qvec = self._cached_answer(query, contexts, model)
+        if cached is not None:
+            yield cached
+            return
+        parts: List[str] = []
+        with metrics.use(trace):
+            args = self._completion_args(query, contexts, model, info)
+        timer = metrics.StreamTimer(trace)
+        with self.client.chat.completions.create(**args) as stream:
             for event in stream:
                 if hasattr(event, "choices") and event.choices:
                     delta = event.choices[0].delta
                     if delta and delta.content:
+                        timer.token()
+                        parts.append(delta.content)
                         yield delta.content
+        timer.done()
+        # Only complete streams are cached (an abandoned generator never gets here)
+        if parts:
+            self.answer_cache.put(query, qvec, model, ctx_key, "".join(parts))
+
+    def _not_ready(self) -> Dict[str, Any]:
+        if self.index.pending():
+            self.index.build_async()
+            return {"route": "not_ready", "contexts": [], "reason": "building", "status": self.index.build_status()}
+        status = self.index.build_status()
+        reason = "build_failed" if status.get("error") else "index_empty"
+        return {"route": "not_ready", "contexts": [], "reason": reason, "status": status}
 
-    def ask(self, query: str, k: int = 8, alpha: float = 0.5, top_k_rerank: int = 5, filters: Dict[str, Any] | None = None, stream: bool = True):
-        route = self.route(query)
+    def ask(self, query: str, k: int = 8, alpha: float = 0.5, top_k_rerank: int = 5, filters: Dict[str, Any] | None = None,
+            stream: bool = True, trace: metrics.Trace | None = None):
+        # trace, if given, collects this question's stage timings
+        with metrics.use(trace):
+            result = self._ask(query, k, alpha, top_k_rerank, filters)
+        metrics.count_request(result["route"])
+        return result
+
+    def _ask(self, query: str, k: int, alpha: float, top_k_rerank: int, filters: Dict[str, Any] | None):
+        with metrics.timed("route"):
+            route = self.route(query)
         if route == "tools":
             return {"route": "tools", "contexts": []}
 
-        # Try auto-build if needed
+        # Nothing searchable yet: start a background build instead of holding the question
         if not self.index.ready():
-            self.index.build()
-            if not self.index.ready():
-                return {"route": "not_ready", "contexts": [], "reason": "index_empty" if len(self.index.docs)==0 else "build_failed"}
+            return self._not_ready()
 
         hits = self.index.search(query, k=k, alpha=alpha, filters=filters)
         if not hits:
             return {"route": "not_ready", "contexts": [], "reason": "no_results"}
 
-        reranked = self.reranker.rerank(query, hits, top_k=top_k_rerank)
+        with metrics.timed("rerank"):
+            reranked = self.reranker.rerank(query, hits, top_k=top_k_rerank, generation=self.index.generation,
+                                            adaptive=self.adaptive_rerank)
         top_contexts = [d for d,_ in reranked]
         return {"route": "rag", "contexts": top_contexts}
+
+    # --- bulk variants for offline evaluation / precomputation ---
+
+    def search_batch(self, queries: List[str], k: int = 8, alpha: float = 0.5,
+                     filters: Dict[str, Any] | List[Dict[str, Any] | None] | None = None):
+        # Hybrid hits for every query (input order): one batched query-encoder pass, one
+        # multi-query BM25 pass and matrix-matrix dense scoring per filter group
+        if not self.index.ready():
+            return [[] for _ in queries]
+        return self.index.search_many(list(queries), k=k, alpha=alpha, filters=filters)
+
+    def ask_batch(self, queries: List[str], k: int = 8, alpha: float = 0.5, top_k_rerank: int = 5,
+                  filters: Dict[str, Any] | List[Dict[str, Any] | None] | None = None,
+                  batch_size: int = 512, rerank_pack: int = 512) -> Iterator[Dict[str, Any]]:
+        # ask() for many questions: yields one result per question, in input order, as soon
+        # as it is reranked. Questions are searched batch_size at a time; reranking packs
+        # pairs across questions into model calls of about rerank_pack pairs.
+        queries = list(queries)
+        flist = filters if isinstance(filters, list) else [filters] * len(queries)
+        for a in range(0, len(queries), batch_size):
+            qs, fs = queries[a:a + batch_size], flist[a:a + batch_size]
+            routes = [self.route(q) for q in qs]
+            rag = [i for i, r in enumerate(routes) if r == "rag"]
+            not_ready = self._not_ready() if rag and not self.index.ready() else None
+            hits: Dict[int, list] = {}
+            if rag and not_ready is None:
+                found = self.search_batch([qs[i] for i in rag], k=k, alpha=alpha, filters=[fs[i] for i in rag])
+                hits = {i: h for i, h in zip(rag, found) if h}
+            order = sorted(hits)
+            reranked = self.reranker.rerank_many([qs[i] for i in order], [hits[i] for i in order], top_k=top_k_rerank,
+                                                 generation=self.index.generation, adaptive=self.adaptive_rerank,
+                                                 pack=rerank_pack)
+            for i in range(len(qs)):
+                if routes[i] == "tools":
+                    result = {"route": "tools", "contexts": []}
+                elif not_ready is not None:
+                    result = dict(not_ready)
+                elif i not in hits:
+                    result = {"route": "not_ready", "contexts": [], "reason": "no_results"}
+                else:
+                    result = {"route": "rag", "contexts": [d for d, _ in next(reranked)]}
+                metrics.count_request(result["route"])
+                yield result
+
+    # --- async variants: same results, but the event loop is never blocked ---
+
+    async def _run(self, fn, *args, **kwargs):
+        # The caller's context (active metrics trace) goes along to the worker thread
+        ctx = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(ctx.run, fn, *args, **kwargs))
+
+    async def aask(self, query: str, k: int = 8, alpha: float = 0.5, top_k_rerank: int = 5, filters: Dict[str, Any] | None = None,
+                   stream: bool = True, trace: metrics.Trace | None = None):
+        with metrics.use(trace):
+            result = await self._aask(query, k, alpha, top_k_rerank, filters)
+        metrics.count_request(result["route"])
+        return result
+
+    async def _aask(self, query: str, k: int, alpha: float, top_k_rerank: int, filters: Dict[str, Any] | None):
+        with metrics.timed("route"):
+            route = self.route(query)
+        if route == "tools":
+            return {"route": "tools", "contexts": []}
+
+        if not self.index.ready():
+            return self._not_ready()
+
+        hits = await self._run(self.index.search, query, k=k, alpha=alpha, filters=filters)
+        if not hits:
+            return {"route": "not_ready", "contexts": [], "reason": "no_results"}
+
+        with metrics.timed("rerank"):
+            reranked = await self._run(self.reranker.rerank, query, hits, top_k=top_k_rerank,
+                                       generation=self.index.generation, adaptive=self.adaptive_rerank)
+        return {"route": "rag", "contexts": [d for d,_ in reranked]}
+
+    async def aanswer_stream(self, query: str, contexts: List[Doc], model: str = "gpt-4o-mini",
+                             info: Dict[str, Any] | None = None,
+                             trace: metrics.Trace | None = None) -> AsyncIterator[str]:
+        assert self.aclient is not None, "LLM client not set"
+        cached, ctx_key, qvec = await self._run(self._cached_answer, query, contexts, model)
+        if cached is not None:
+            yield cached
+            return
+        parts: List[str] = []
+        with metrics.use(trace):
+            args = await self._run(self._completion_args, query, contexts, model, info)
+        timer = metrics.StreamTimer(trace)
+        stream = await self.aclient.chat.completions.create(**args)
+        async with stream:
+            async for event in stream:
+                if hasattr(event, "choices") and event.choices:
+                    delta = event.choices[0].delta
+                    if delta and delta.content:
+                        timer.token()
+                        parts.append(delta.content)
+                        yield delta.content
+        timer.done()
+        if parts:
+            self.answer_cache.put(query, qvec, model, ctx_key, "".join(parts))
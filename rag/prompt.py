@@ -0,0 +1,101 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from .tokens import count_tokens, encoding_name_for_model, split_sentences
+from .utils import Doc, normalize_text
+
+# Input-token budget per chat model (system + few-shots + contexts + question). Small
+# prompts keep time-to-first-token and cost down; contexts are what gets trimmed.
+DEFAULT_PROMPT_BUDGET = 2048
+MODEL_PROMPT_BUDGETS: Dict[str, int] = {}
+
+# Per-message overhead of the chat format (role/separator tokens)
+_MESSAGE_OVERHEAD = 4
+
+@dataclass
+class AssembledPrompt:
+    messages: List[Dict[str, str]]
+    prompt_tokens: int
+    budget: int
+    context_ids: List[str] = field(default_factory=list)  # contexts included, in citation order
+    dropped: int = 0              # contexts left out (duplicate text or over budget)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"prompt_tokens": self.prompt_tokens, "budget": self.budget,
+                "contexts_used": len(self.context_ids), "contexts_dropped": self.dropped}
+
+class PromptAssembler:
+    # Builds the chat messages for one question: the system prompt once (as the system
+    # message), then a user message with few-shots, numbered contexts and the question.
+    # Contexts are packed in rerank order until the model's budget is spent; sentences
+    # already present in a higher-ranked context (chunk overlap, near-duplicate pages)
+    # are dropped. Static text comes first and the layout is deterministic, so repeated
+    # prefixes can be served from the provider's prompt cache.
+    def __init__(self, system_prompt: str, budgets: Dict[str, int] | None = None,
+                 default_budget: int = DEFAULT_PROMPT_BUDGET, min_context_tokens: int = 48):
+        self.system_prompt = system_prompt.strip()
+        self.budgets = {**MODEL_PROMPT_BUDGETS, **(budgets or {})}
+        self.default_budget = default_budget
+        # A context that only fits partially is cut at a sentence boundary if at least
+        # this many tokens of it fit; otherwise packing stops
+        self.min_context_tokens = min_context_tokens
+
+    def budget(self, model: str) -> int:
+        return self.budgets.get(model, self.default_budget)
+
+    def _dedup(self, contexts: List[Doc]) -> List[tuple]:
+        # (doc, sentences not seen in an earlier context); fully duplicated contexts vanish
+        seen = set()
+        out = []
+        for c in contexts:
+            fresh = []
+            for s in split_sentences(c.text):
+                key = normalize_text(s).lower()
+                if key not in seen:
+                    seen.add(key)
+                    fresh.append(s)
+            if fresh:
+                out.append((c, fresh))
+        return out
+
+    def assemble(self, query: str, contexts: List[Doc], fewshots: List[Dict[str, str]],
+                 model: str) -> AssembledPrompt:
+        enc = encoding_name_for_model(model)
+        budget = self.budget(model)
+        few = "\n\n".join(f"Q: {x['q']}\nA: {x['a']}" for x in fewshots)
+        head = f"Few-shot examples:\n{few}\n\nContext (use to answer if relevant; cite [#]):\n"
+        tail = f"\nUser question: {query}\n\nAnswer:"
+        used = (count_tokens(self.system_prompt, enc) + count_tokens(head, enc) + count_tokens(tail, enc)
+                + 2 * _MESSAGE_OVERHEAD)
+
+        blocks: List[str] = []
+        ids: List[str] = []
+        unique = self._dedup(contexts)
+        for c, sents in unique:
+            block = f"[{len(blocks) + 1}] {' '.join(sents)}\n\n"
+            n = count_tokens(block, enc)
+            if used + n > budget:
+                # Whole sentences from the front of the context, if enough of them fit
+                part, m = [], count_tokens(f"[{len(blocks) + 1}] \n\n", enc)
+                for s in sents:
+                    k = count_tokens(" " + s, enc)
+                    if used + m + k > budget:
+                        break
+                    part.append(s)
+                    m += k
+                if part and m >= self.min_context_tokens:
+                    blocks.append(f"[{len(blocks) + 1}] {' '.join(part)}\n\n")
+                    ids.append(c.id)
+                    used += m
+                break
+            blocks.append(block)
+            ids.append(c.id)
+            used += n
+
+        user = head + "".join(blocks).rstrip("\n") + "\n" + tail
+        messages = [{"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": user}]
+        total = sum(count_tokens(m["content"], enc) + _MESSAGE_OVERHEAD for m in messages)
+        return AssembledPrompt(messages=messages, prompt_tokens=total, budget=budget,
+                               context_ids=ids, dropped=len(contexts) - len(ids))
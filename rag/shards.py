@@ -0,0 +1,320 @@
+from __future__ import annotations
+import os, json, zlib, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from . import models, metrics
+from .bm25 import CorpusStats, tokenize
+from .dense import topk_indices
+from .dedup import NearDupIndex
+from .utils import HybridIndex, BuildRunner, Doc, fuse_scores, _write_atomic
+
+SHARDS_VERSION = 1
+
+class ShardedHybridIndex:
+    # Docs are partitioned into independent HybridIndex shards (own BM25, dense backend,
+    # metadata), either one shard per value of a metadata key (e.g. "coin" or
+    # "source") or n_shards buckets by doc id hash. Searches fan out to the shards on a
+    # thread pool with corpus-wide BM25 statistics; per-shard candidates are merged and
+    # min-max normalised together, so results match a single index over the same docs
+    # up to per-shard candidate depth. Filters on the shard key skip non-matching shards.
+    # Same surface as HybridIndex, so the pipeline can use either.
+    def __init__(self, dense_model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 shard_key: str | None = None, n_shards: int = 4, max_workers: int | None = None,
+                 embedder=None, **index_kwargs):
+        self.dense_model_name = dense_model_name
+        self.shard_key = shard_key
+        self.n_shards = n_shards
+        self._embedder = embedder if embedder is not None else models.load("embedder", dense_model_name)
+        self._query_cache = None
+        self._index_kwargs = index_kwargs
+        self.names: List[str] = []
+        self.shards: List[HybridIndex] = []
+        self._by_name: Dict[str, int] = {}
+        # Duplicates are dropped across shards: exact ones here, near-duplicates by the
+        # shards against one shared NearDupIndex (set by the first shard)
+        self._ids: set = set()
+        self.near_dups: NearDupIndex | None = None
+        self._epoch = 0
+        self._building: List[HybridIndex] = []
+        workers = max_workers or min(32, os.cpu_count() or 4)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard")
+        # Builds and snapshots get their own pool so a background build never queues
+        # ahead of a search's shard fan-out
+        self.build_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard-build")
+        # Guards the shard layout and cross-shard ids; searches read the layout lock-free
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.builder = BuildRunner(lambda rebuild: self.build(rebuild=rebuild), name="shard-build")
+        if shard_key is None:
+            for i in range(n_shards):
+                self._shard(str(i))
+
+    def _new_shard(self) -> HybridIndex:
+        idx = HybridIndex(dense_model_name=self.dense_model_name, embedder=self._embedder, **self._index_kwargs)
+        idx.query_cache = self._query_cache
+        if self.near_dups is None:
+            self.near_dups = idx.near_dups
+        else:
+            idx.near_dups = self.near_dups
+        return idx
+
+    def _shard(self, name: str) -> HybridIndex:
+        pos = self._by_name.get(name)
+        if pos is None:
+            idx = self._new_shard()
+            pos = self._by_name[name] = len(self.shards)
+            self.names.append(name)
+            self.shards.append(idx)
+        return self.shards[pos]
+
+    def shard_name(self, doc: Doc) -> str:
+        if self.shard_key is None:
+            return str(zlib.crc32(doc.id.encode()) % self.n_shards)
+        # Lowercased like MetaStore values, so filters route the same way they match
+        return str(doc.metadata.get(self.shard_key, "")).lower()
+
+    # --- shared state propagated to every shard ---
+
+    @property
+    def embedder(self):
+        return self._embedder
+
+    @embedder.setter
+    def embedder(self, model):
+        self._embedder = model
+        for s in self.shards:
+            s.embedder = model
+
+    @property
+    def query_cache(self):
+        return self._query_cache
+
+    @query_cache.setter
+    def query_cache(self, cache):
+        self._query_cache = cache
+        for s in self.shards:
+            s.query_cache = cache
+
+    @property
+    def docs(self) -> List[Doc]:
+        return [d for s in self.shards for d in s.docs]
+
+    @property
+    def n_built(self) -> int:
+        return sum(s.n_built for s in self.shards)
+
+    @property
+    def generation(self) -> int:
+        # Shard generations only grow; the epoch keeps it moving forward across load()
+        return self._epoch + sum(s.generation for s in self.shards)
+
+    @property
+    def dup_stats(self) -> Dict[str, int]:
+        out = {"exact": 0, "near": 0}
+        for s in self.shards:
+            for key, n in s.dup_stats.items():
+                out[key] = out.get(key, 0) + n
+        return out
+
+    # --- ingestion / build ---
+
+    def add(self, docs: List[Doc], embed: bool = False) -> int:
+        groups: Dict[str, List[Doc]] = {}
+        with self._lock:
+            for d in docs:
+                if d.id in self._ids:
+                    continue
+                self._ids.add(d.id)
+                groups.setdefault(self.shard_name(d), []).append(d)
+            targets = [(self._shard(name), group) for name, group in groups.items()]
+        return sum(shard.add(group, embed=embed) for shard, group in targets)
+
+    def pending(self) -> int:
+        return sum(s.pending() for s in self.shards)
+
+    def build(self, rebuild: bool = False):
+        # Shards build independently; only those with staged docs (or all, on rebuild) run.
+        # Each swaps its new generation in as soon as it is done.
+        with self._build_lock:
+            todo = [s for s in self.shards if rebuild or s.pending()]
+            for s in todo:
+                s.builder.update(stage="queued", done=0, total=len(s.docs) if rebuild else s.pending())
+            self._building = todo
+            self.builder.update(stage="building", done=0, total=sum(s.builder.progress["total"] for s in todo))
+            try:
+                list(self.build_executor.map(lambda s: s.build(rebuild=rebuild), todo))
+            finally:
+                self.builder.settle()
+
+    def build_async(self, rebuild: bool = False, after: Callable[[], Any] | None = None) -> Future:
+        return self.builder.submit(rebuild, after)
+
+    def build_status(self) -> Dict[str, Any]:
+        out = {**self.builder.progress, "n_built": self.n_built, "pending": self.pending(),
+               "generation": self.generation}
+        if out["running"]:
+            # Embedded chunks summed over the shards of the running build
+            out["done"] = sum(s.builder.progress["done"] for s in self._building)
+        return out
+
+    def ready(self) -> bool:
+        return any(s.ready() for s in self.shards)
+
+    # --- search ---
+
+    def encode_query(self, query: str) -> np.ndarray:
+        if self._query_cache is not None:
+            return self._query_cache.encode(self._embedder, self.dense_model_name, query)
+        return self._embedder.encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
+
+    def encode_queries(self, queries: List[str], batch_size: int = 256) -> np.ndarray:
+        if self._query_cache is not None:
+            return self._query_cache.encode_many(self._embedder, self.dense_model_name, queries, batch_size=batch_size)
+        return self._embedder.encode(list(queries), batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+
+    def route(self, filters: Dict[str, Any] | None) -> List[HybridIndex]:
+        # Built shards that can hold matches; a filter on the shard key uses the same
+        # substring semantics as MetaStore.mask
+        layout = list(zip(self.names, self.shards))
+        if not filters or self.shard_key is None or self.shard_key not in filters:
+            return [s for _, s in layout if s.ready()]
+        v = filters[self.shard_key]
+        wanted = [str(x).lower() for x in v] if isinstance(v, (list, tuple, set)) else [str(v).lower()]
+        return [s for name, s in layout if s.ready() and any(w in name for w in wanted)]
+
+    def corpus_stats(self, tokens: List[str]) -> CorpusStats:
+        # BM25 statistics over every built shard (not only the routed ones), so a doc's
+        # score does not depend on which shards a query touches
+        built = [s.bm25 for s in self.shards if s.ready()]
+        n = sum(bm.n_docs for bm in built)
+        df: Dict[str, int] = {}
+        for bm in built:
+            for w, c in bm.term_df(tokens).items():
+                df[w] = df.get(w, 0) + c
+        return CorpusStats(n_docs=n, avgdl=sum(bm.n_tokens for bm in built) / max(1, n), df=df)
+
+    def search(self, query: str, k: int = 8, alpha: float = 0.5, filters: Dict[str, Any] | None = None,
+               query_vec: np.ndarray | None = None):
+        shards = self.route(filters)
+        if not shards:
+            return []
+        if query_vec is None:
+            with metrics.timed("embed_query"):
+                query_vec = self.encode_query(query)
+        with metrics.timed("bm25_stats"):
+            stats = self.corpus_stats(tokenize(query))
+        if len(shards) == 1:
+            parts = [shards[0].retrieve(query, k, filters, query_vec, stats)]
+        else:
+            # Per-shard stages are recorded in the histograms; the answer's trace sees the fan-out
+            with metrics.timed("shards"):
+                parts = list(self.executor.map(lambda s: s.retrieve(query, k, filters, query_vec, stats), shards))
+        owner = np.concatenate([np.full(len(p[0]), i, dtype=np.int32) for i, p in enumerate(parts)])
+        if not len(owner):
+            return []
+        idxs = np.concatenate([p[0] for p in parts])
+        scores = fuse_scores(np.concatenate([p[1] for p in parts]), np.concatenate([p[2] for p in parts]), alpha)
+        order = topk_indices(scores, k)
+        return [(shards[owner[i]].docs[int(idxs[i])], float(scores[i])) for i in order]
+
+    def search_many(self, queries: List[str], k: int = 8, alpha: float = 0.5,
+                    filters: Dict[str, Any] | List[Dict[str, Any] | None] | None = None,
+                    query_vecs: np.ndarray | None = None) -> List[List[Tuple[Doc, float]]]:
+        # Batched search(): each shard gets the queries routed to it in one retrieve_many
+        # call (shards run in parallel); BM25 statistics cover the union of query terms
+        queries = list(queries)
+        flist = filters if isinstance(filters, list) else [filters] * len(queries)
+        routed = [self.route(f) for f in flist]
+        if not queries or not any(routed):
+            return [[] for _ in queries]
+        if query_vecs is None:
+            with metrics.timed("embed_query"):
+                query_vecs = self.encode_queries(queries)
+        with metrics.timed("bm25_stats"):
+            stats = self.corpus_stats(sorted({t for q in queries for t in tokenize(q)}))
+        work: Dict[int, List[int]] = {}
+        for i, shards in enumerate(routed):
+            for s in shards:
+                work.setdefault(id(s), []).append(i)
+        by_id = {id(s): s for shards in routed for s in shards}
+
+        def run(sid: int):
+            members = work[sid]
+            return members, by_id[sid].retrieve_many([queries[i] for i in members], k, [flist[i] for i in members],
+                                                     query_vecs[members], stats)
+
+        with metrics.timed("shards"):
+            results = list(self.executor.map(run, list(work)))
+        parts: List[List[tuple]] = [[] for _ in queries]
+        for sid, (members, res) in zip(list(work), results):
+            for i, r in zip(members, res):
+                if len(r[0]):
+                    parts[i].append((by_id[sid], r))
+        out = []
+        for p in parts:
+            if not p:
+                out.append([])
+                continue
+            idxs = np.concatenate([r[0] for _, r in p])
+            scores = fuse_scores(np.concatenate([r[1] for _, r in p]), np.concatenate([r[2] for _, r in p]), alpha)
+            owner = np.concatenate([np.full(len(r[0]), j, dtype=np.int32) for j, (_, r) in enumerate(p)])
+            out.append([(p[owner[i]][0].docs[int(idxs[i])], float(scores[i])) for i in topk_indices(scores, k)])
+        return out
+
+    # --- persistence ---
+
+    def save(self, root: str, keep: int = 2) -> str:
+        # <root>/shards.json lists the shards; each shard keeps its own snapshot dir
+        # (<root>/shard-NNN/, same layout as HybridIndex.save) and is saved in parallel
+        if not self.ready():
+            raise RuntimeError("index not built; nothing to save")
+        os.makedirs(root, exist_ok=True)
+        built = [(i, s) for i, s in enumerate(self.shards) if s.ready()]
+        list(self.build_executor.map(lambda it: it[1].save(os.path.join(root, f"shard-{it[0]:03d}"), keep=keep), built))
+        manifest = {"version": SHARDS_VERSION, "dense_model": self.dense_model_name,
+                    "shard_key": self.shard_key, "n_shards": self.n_shards,
+                    "shards": [{"name": self.names[i], "dir": f"shard-{i:03d}"} for i, _ in built]}
+        _write_atomic(os.path.join(root, "shards.json"), json.dumps(manifest))
+        return root
+
+    def load(self, root: str, mmap: bool = True) -> bool:
+        # Returns False when there is no sharded snapshot; staged docs are kept and
+        # built on the next build()
+        path = os.path.join(root, "shards.json")
+        if not os.path.exists(path):
+            return False
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != SHARDS_VERSION:
+            raise ValueError(f"shard manifest version {manifest.get('version')} != {SHARDS_VERSION}")
+        if manifest.get("shard_key") != self.shard_key or manifest.get("n_shards") != self.n_shards:
+            raise ValueError(f"snapshot sharded by {manifest.get('shard_key')!r}/{manifest.get('n_shards')}, "
+                             f"index uses {self.shard_key!r}/{self.n_shards}")
+        # The new layout is loaded off to the side and swapped in; searches keep the old one
+        names = [e["name"] for e in manifest["shards"]]
+        if self.shard_key is None:
+            names = [str(i) for i in range(self.n_shards)]
+        shards = [self._new_shard() for _ in names]
+        dirs = {e["name"]: os.path.join(root, e["dir"]) for e in manifest["shards"]}
+        list(self.executor.map(lambda it: it[1].load(dirs[it[0]], mmap=mmap), [(n, s) for n, s in zip(names, shards) if n in dirs]))
+        # Each shard loaded its own fingerprints; merge them back into one shared index
+        near_dups = None
+        if self.near_dups is not None:
+            near_dups = NearDupIndex(max_distance=self.near_dups.max_distance, bands=self.near_dups.bands)
+            for s in shards:
+                for fp in s._fps.values():
+                    near_dups.add(fp)
+                s.near_dups = near_dups
+        with self._build_lock, self._lock:
+            staged = [d for s in self.shards for d in s.docs[s.n_built:]]
+            epoch = self.generation + 1
+            self._by_name = {n: i for i, n in enumerate(names)}
+            self.names, self.shards = names, shards
+            self._ids = {d.id for s in shards for d in s.docs}
+            self.near_dups = near_dups
+            self._epoch = epoch
+        self.add(staged)
+        return True
@@ -0,0 +1,48 @@
+from __future__ import annotations
+import asyncio, time
+from typing import AsyncIterator
+
+async def coalesce(tokens: AsyncIterator[str], interval: float = 0.05, min_chars: int = 24,
+                   growth: float = 0.1, delta: bool = False) -> AsyncIterator[str]:
+    # Groups streamed tokens into flushes instead of one UI update per token. A flush
+    # happens once `interval` seconds have passed since the last one and the pending
+    # text is at least max(min_chars, growth * text so far); pending text is also
+    # flushed when no token has arrived for `interval`. Because the threshold grows with
+    # the answer, the number of flushes grows only logarithmically and re-sending the
+    # full text stays linear in answer length.
+    # delta=False yields the full text so far (for components that re-render, e.g.
+    # Markdown); delta=True yields only the new text (for clients that append).
+    it = tokens.__aiter__()
+    full, pending = "", []
+    n_pending = 0
+    last = last_tok = time.monotonic()
+    nxt = asyncio.ensure_future(it.__anext__())
+    try:
+        while True:
+            # Stall timeout counts from the last token, not the last flush
+            wait = interval - (time.monotonic() - last_tok) if n_pending else None
+            done, _ = await asyncio.wait({nxt}, timeout=max(0.0, wait) if wait is not None else None)
+            if nxt in done:
+                try:
+                    tok = nxt.result()
+                except StopAsyncIteration:
+                    break
+                nxt = asyncio.ensure_future(it.__anext__())
+                pending.append(tok)
+                n_pending += len(tok)
+                last_tok = time.monotonic()
+                due = last_tok - last >= interval and n_pending >= max(min_chars, growth * len(full))
+            else:
+                due = True  # source stalled: show what we have
+            if due and n_pending:
+                chunk = "".join(pending)
+                pending, n_pending = [], 0
+                full += chunk
+                last = time.monotonic()
+                yield chunk if delta else full
+        if n_pending:
+            chunk = "".join(pending)
+            yield chunk if delta else full + chunk
+    finally:
+        if not nxt.done():
+            nxt.cancel()
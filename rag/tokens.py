@@ -0,0 +1,40 @@
+from __future__ import annotations
+import re, threading
+from typing import Dict, List
+
+# Token counting shared by the chunker and the prompt assembler. tiktoken encodings are
+# loaded once per process; if one cannot be loaded (e.g. offline without a cached BPE
+# file) a word/punctuation count is used, which overestimates slightly.
+DEFAULT_ENCODING = "cl100k_base"
+
+_ENCODINGS: Dict[str, object] = {}
+_LOCK = threading.Lock()
+_APPROX_RE = re.compile(r"\w+|[^\w\s]")
+_SENT_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+
+def get_encoding(name: str = DEFAULT_ENCODING):
+    with _LOCK:
+        if name not in _ENCODINGS:
+            try:
+                import tiktoken
+                _ENCODINGS[name] = tiktoken.get_encoding(name)
+            except Exception:
+                _ENCODINGS[name] = None
+        return _ENCODINGS[name]
+
+def encoding_name_for_model(model: str) -> str:
+    try:
+        import tiktoken
+        return tiktoken.encoding_name_for_model(model)
+    except Exception:
+        # Unknown or prefixed model names (e.g. on OpenAI-compatible endpoints)
+        return "o200k_base" if model.startswith(("gpt-4o", "gpt-4.1", "o1", "o3", "o4")) else DEFAULT_ENCODING
+
+def count_tokens(text: str, encoding: str = DEFAULT_ENCODING) -> int:
+    enc = get_encoding(encoding)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return len(_APPROX_RE.findall(text))
+
+def split_sentences(text: str) -> List[str]:
+    return [x for x in _SENT_RE.split(text.strip()) if x]
@@ -1,5 +1,10 @@
 from __future__ import annotations
+import os, time, asyncio, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List
+
 import requests
+from requests.adapters import HTTPAdapter
 
 # Minimal map from common names/symbols → CoinGecko IDs
 COIN_MAP = {
@@ -9,6 +14,9 @@ COIN_MAP = {
     "xrp": "ripple", "ripple": "ripple",
 }
 
+COINGECKO_URL = os.environ.get("CRYPTORAG_COINGECKO_URL", "https://api.coingecko.com/api/v3")
+FNG_URL = os.environ.get("CRYPTORAG_FNG_URL", "https://api.alternative.me/fng/")
+
 def resolve_coin_id(text_or_symbol: str, default: str = "bitcoin") -> str:
     t = (text_or_symbol or "").lower().strip()
     # try exact-in-text matches first (longest keys first)
@@ -17,30 +25,208 @@ def resolve_coin_id(text_or_symbol: str, default: str = "bitcoin") -> str:
             return COIN_MAP[key]
     return default
 
+class MarketDataClient:
+    # Pooled HTTP session, short-TTL cache, single-flight for identical in-flight lookups,
+    # and micro-batching: single-coin price lookups arriving within `batch_window` seconds
+    # are merged into one simple/price call per vs-currency.
+    def __init__(self, base_url: str = COINGECKO_URL, fng_url: str = FNG_URL, ttl: float = 30.0,
+                 batch_window: float = 0.01, timeout: float = 10.0, pool_size: int = 16):
+        self.base_url, self.fng_url = base_url.rstrip("/"), fng_url
+        self.ttl, self.batch_window, self.timeout = ttl, batch_window, timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="market")
+        self._lock = threading.Lock()
+        self._cache: Dict[Hashable, tuple] = {}       # key -> (expires_at, value)
+        self._inflight: Dict[Hashable, Future] = {}
+        self._pending: Dict[str, Dict[str, Future]] = {}  # vs -> coin -> future
+        self.stats = {"cache_hits": 0, "coalesced": 0, "http_calls": 0}
+
+    def _http_json(self, url: str, params: Dict[str, str] | None = None) -> Any:
+        with self._lock:
+            self.stats["http_calls"] += 1
+        r = self.session.get(url, params=params, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def _cached(self, key: Hashable):
+        # (hit, value); caller holds the lock
+        hit = self._cache.get(key)
+        if hit is not None and hit[0] > time.monotonic():
+            self.stats["cache_hits"] += 1
+            return True, hit[1]
+        return False, None
+
+    def _resolve(self, key: Hashable, fut: Future, value: Any = None, error: BaseException | None = None):
+        with self._lock:
+            if error is None:
+                self._cache[key] = (time.monotonic() + self.ttl, value)
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+        if error is None:
+            fut.set_result(value)
+        else:
+            fut.set_exception(error)
+
+    def _single_flight(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            hit, value = self._cached(key)
+            if hit:
+                return value
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+            else:
+                self.stats["coalesced"] += 1
+        if not owner:
+            return fut.result(timeout=self.timeout + 1)
+        try:
+            value = fn()
+        except BaseException as e:
+            self._resolve(key, fut, error=e)
+            raise
+        self._resolve(key, fut, value)
+        return value
+
+    def _price_future(self, coin_id: str, vs: str) -> Future:
+        key = ("price", coin_id, vs)
+        with self._lock:
+            hit, value = self._cached(key)
+            if hit:
+                fut: Future = Future()
+                fut.set_result(value)
+                return fut
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self.stats["coalesced"] += 1
+                return fut
+            fut = self._inflight[key] = Future()
+            batch = self._pending.setdefault(vs, {})
+            batch[coin_id] = fut
+            if len(batch) == 1:
+                timer = threading.Timer(self.batch_window, self._flush, (vs,))
+                timer.daemon = True
+                timer.start()
+        return fut
+
+    def _flush(self, vs: str):
+        with self._lock:
+            batch = self._pending.pop(vs, {})
+        if not batch:
+            return
+        try:
+            data = self._http_json(f"{self.base_url}/simple/price",
+                                   {"ids": ",".join(sorted(batch)), "vs_currencies": vs})
+        except BaseException as e:
+            for coin_id, fut in batch.items():
+                self._resolve(("price", coin_id, vs), fut, error=e)
+            return
+        for coin_id, fut in batch.items():
+            self._resolve(("price", coin_id, vs), fut, (data.get(coin_id) or {}).get(vs))
+
+    def get_price(self, coin_id: str = "bitcoin", vs: str = "usd"):
+        return self._price_future(coin_id, vs).result(timeout=self.timeout + self.batch_window + 1)
+
+    def get_price_multi(self, coin_ids: List[str], vs: str = "usd") -> dict:
+        # Same shape as CoinGecko's simple/price response; shares cache/batches with get_price
+        futs = {c: self._price_future(c, vs) for c in sorted(set(coin_ids))}
+        out = {}
+        for c, fut in futs.items():
+            price = fut.result(timeout=self.timeout + self.batch_window + 1)
+            if price is not None:
+                out[c] = {vs: price}
+        return out
+
+    def get_fear_greed(self):
+        def fetch():
+            data = self._http_json(self.fng_url)
+            return data["data"][0] if data.get("data") else None
+        return self._single_flight(("fng",), fetch)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+_CLIENT: MarketDataClient | None = None
+_CLIENT_LOCK = threading.Lock()
+
+def market_client() -> MarketDataClient:
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = MarketDataClient()
+        return _CLIENT
+
 def get_price(coin_id: str = "bitcoin", vs: str = "usd"):
-    url = f"https://api.coingecko.com/api/v3/simple/price?ids={coin_id}&vs_currencies={vs}"
-    r = requests.get(url, timeout=10)
-    r.raise_for_status()
-    data = r.json()
-    return data.get(coin_id, {}).get(vs)
+    return market_client().get_price(coin_id, vs)
 
 def get_price_any(coin_or_query: str, vs: str = "usd"):
     coin_id = resolve_coin_id(coin_or_query)
     return coin_id, get_price(coin_id, vs)
 
 def get_price_multi(coin_ids: list[str], vs: str = "usd") -> dict:
-    # Efficient batch call (one request) e.g. ["bitcoin","ethereum","solana","ripple"]
-    unique = ",".join(sorted(set(coin_ids)))
-    url = f"https://api.coingecko.com/api/v3/simple/price?ids={unique}&vs_currencies={vs}"
-    r = requests.get(url, timeout=10)
-    r.raise_for_status()
-    return r.json()
+    return market_client().get_price_multi(coin_ids, vs)
 
 def get_fear_greed():
-    url = "https://api.alternative.me/fng/"
-    r = requests.get(url, timeout=10)
-    r.raise_for_status()
-    data = r.json()
-    if data.get("data"):
-        return data["data"][0]
-    return None
+    return market_client().get_fear_greed()
+
+def _tool_plan(query: str):
+    coin_id = resolve_coin_id(query)
+    want_trio = coin_id not in {"ethereum", "solana", "ripple"} and any(w in query.lower() for w in ["price", "quote"])
+    return coin_id, want_trio
+
+def _format_tool_answer(coin_id: str, price, fng, trio_batch, vs: str) -> str:
+    # fng / trio_batch are None or an Exception when unavailable; they are optional extras
+    # Always include Fear & Greed (market mood)
+    parts = []
+    if price is not None:
+        parts.append(f"{coin_id} price ≈ ${price}")
+    else:
+        parts.append(f"{coin_id} price unavailable")
+
+    if fng and not isinstance(fng, BaseException):
+        parts.append(f"Fear&Greed: {fng.get('value')} – {fng.get('value_classification')}")
+
+    # (Optional) If user didn’t specify a coin clearly, also show a quick trio: ETH, SOL, XRP
+    if trio_batch and not isinstance(trio_batch, BaseException):
+        trio = []
+        if "ethereum" in trio_batch and vs in trio_batch["ethereum"]:
+            trio.append(f"ETH ${trio_batch['ethereum'][vs]}")
+        if "solana" in trio_batch and vs in trio_batch["solana"]:
+            trio.append(f"SOL ${trio_batch['solana'][vs]}")
+        if "ripple" in trio_batch and vs in trio_batch["ripple"]:
+            trio.append(f"XRP ${trio_batch['ripple'][vs]}")
+        if trio:
+            parts.append("Also: " + " | ".join(trio))
+
+    return "🔧 " + " | ".join(parts)
+
+def _tool_lookups(query: str, vs: str):
+    # Price for the coin in the query, Fear & Greed, and (for generic price questions) an
+    # ETH/SOL/XRP trio, submitted concurrently; only the main price is required
+    client = market_client()
+    coin_id, want_trio = _tool_plan(query)
+    jobs = [client.executor.submit(client.get_price, coin_id, vs), client.executor.submit(client.get_fear_greed)]
+    if want_trio:
+        jobs.append(client.executor.submit(client.get_price_multi, ["ethereum", "solana", "ripple"], vs))
+    return coin_id, jobs
+
+def _tool_text(coin_id: str, results: List[Any], vs: str) -> str:
+    # results: value or exception per lookup, in _tool_lookups order
+    price = results[0]
+    if isinstance(price, Exception):
+        return f"🔧 Tool route: error resolving coin/price — {price}"
+    return _format_tool_answer(coin_id, price, results[1], results[2] if len(results) > 2 else None, vs)
+
+def tool_answer(query: str, vs: str = "usd") -> str:
+    coin_id, jobs = _tool_lookups(query, vs)
+    return _tool_text(coin_id, [j.exception() or j.result() for j in jobs], vs)
+
+async def atool_answer(query: str, vs: str = "usd") -> str:
+    # tool_answer for event-loop callers
+    coin_id, jobs = _tool_lookups(query, vs)
+    results = await asyncio.gather(*(asyncio.wrap_future(j) for j in jobs), return_exceptions=True)
+    return _tool_text(coin_id, list(results), vs)
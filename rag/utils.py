@@ -1,11 +1,20 @@
 from __future__ import annotations
-import re, json, hashlib
-from dataclasses import dataclass
-from typing import List, Dict, Any, Tuple
+import os, re, json, time, shutil, hashlib, logging, tempfile, weakref, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import TYPE_CHECKING, List, Dict, Any, Callable, Iterator, Sequence, Tuple
 
 import numpy as np
-from rank_bm25 import BM25Okapi
-from sentence_transformers import SentenceTransformer, CrossEncoder
+from . import models, metrics
+from .dense import make_dense_backend, topk_indices
+from .bm25 import SparseBM25, CorpusStats, tokenize, sparse_lookup
+from .meta import MetaStore
+from .dedup import fingerprint, NearDupIndex
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+log = logging.getLogger(__name__)
 
 def cache_key(obj: Any) -> str:
     return hashlib.sha256(json.dumps(obj, sort_keys=True).encode()).hexdigest()
@@ -13,109 +22,624 @@ def cache_key(obj: Any) -> str:
 def normalize_text(s: str) -> str:
     return re.sub(r"\s+", " ", s).strip()
 
+# Bump when the on-disk snapshot layout changes
+SNAPSHOT_VERSION = 2
+
+def _write_atomic(path: str, text: str):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def fuse_scores(bm25_scores: np.ndarray, dense_scores: np.ndarray, alpha: float) -> np.ndarray:
+    # NumPy 2.x-safe normalization (float32 is plenty for min-max fusion)
+    def _norm(x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        rng = np.ptp(x)
+        return (x - x.min()) / (rng + 1e-8)
+    return alpha * _norm(bm25_scores) + (1 - alpha) * _norm(dense_scores)
+
 @dataclass
 class Doc:
     id: str
     text: str
     metadata: Dict[str, Any]
 
+class BuildRunner:
+    # Single background worker for index builds. progress is replaced, never mutated,
+    # so pollers (e.g. a UI timer) always read a consistent dict.
+    def __init__(self, build: Callable[[bool], None], name: str = "index-build"):
+        self._build, self._name = build, name
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._future: Future | None = None
+        self.progress: Dict[str, Any] = {"running": False, "stage": "idle", "done": 0, "total": 0,
+                                         "error": None, "note": None, "started": None, "finished": None}
+
+    def update(self, **kw):
+        self.progress = {**self.progress, **kw}
+
+    def settle(self):
+        # After a build() called directly rather than through submit(): the stages it
+        # published must not keep reading as a build in progress
+        if not self.progress["running"]:
+            self.update(stage="idle")
+
+    def submit(self, rebuild: bool = False, after: Callable[[], Any] | None = None) -> Future:
+        # A build that is queued but not started yet already covers docs staged until it
+        # starts, so it is returned instead of queueing another one
+        with self._lock:
+            fut = self._future
+            if fut is not None and not fut.done() and not fut.running():
+                return fut
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self._name)
+            self._future = self._executor.submit(self._run, rebuild, after)
+            return self._future
+
+    def _run(self, rebuild: bool, after: Callable[[], Any] | None):
+        self.update(running=True, stage="starting", done=0, total=0, error=None, note=None,
+                    started=time.time(), finished=None)
+        try:
+            self._build(rebuild)
+            if after is not None:
+                # e.g. a snapshot save; its failure does not undo the swapped-in build
+                self.update(stage="saving")
+                try:
+                    after()
+                except Exception as e:
+                    self.update(note=f"post-build step failed: {e}")
+        except BaseException as e:
+            self.update(running=False, stage="failed", error=str(e), finished=time.time())
+            raise
+        self.update(running=False, stage="done", finished=time.time())
+
+@dataclass
+class _IndexState:
+    # One searchable generation: the built prefix of docs and the structures over it.
+    # build()/load() assemble a new state off to the side and publish it with a single
+    # attribute store; a query reads self._state once, so it never sees a half-built index.
+    docs: List[Doc]
+    n_built: int
+    bm25: SparseBM25 | None
+    embeddings: np.ndarray | None
+    meta: MetaStore
+    dense: Any
+    generation: int
+
 class HybridIndex:
-    def __init__(self, dense_model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(self, dense_model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 dense_backend: str = "exact", dense_params: Dict[str, Any] | None = None,
+                 candidates: int = 64, near_dup_distance: int = 3, embedding_dtype: str = "float32",
+                 embedder=None):
         self.dense_model_name = dense_model_name
-        self.embedder = SentenceTransformer(dense_model_name)
+        # Shared per model name across the process; loads in the background and only
+        # blocks the first caller that needs it before it is ready
+        self.embedder = embedder if embedder is not None else models.load("embedder", dense_model_name)
+        # Staged + built docs (append-only between loads/rebuilds); guarded by _lock
         self.docs: List[Doc] = []
-        self.bm25 = None
-        self.embeddings = None
-
-    def add(self, docs: List[Doc]):
-        self.docs.extend(docs)
-
-    def build(self):
-        # Build only if we have docs
-        if not self.docs:
-            self.bm25, self.embeddings = None, None
-            return
-        corpus = [d.text for d in self.docs]
-        tokenized = [c.split() for c in corpus]
-        self.bm25 = BM25Okapi(tokenized)
-        self.embeddings = self.embedder.encode(
-            corpus, convert_to_numpy=True, normalize_embeddings=True
-        )
+        # "exact" (NumPy brute force) or a faiss backend: "flat", "ivf", "hnsw"
+        params = dict(dense_params or {})
+        if dense_backend in ("exact", "numpy"):
+            params.setdefault("dtype", embedding_dtype)
+        self._dense_spec = (dense_backend, params)
+        # Columnar metadata with per-value postings; filters resolve to a doc mask before scoring
+        self._state = _IndexState(self.docs, 0, None, None, MetaStore(), make_dense_backend(dense_backend, **params), 0)
+        # float16/int8: the exact backend scans a compressed copy and the float32 matrix is
+        # kept on disk (memmapped spill file or snapshot), read only to re-score candidates
+        self.embedding_dtype = embedding_dtype
+        self._spill_path: str | None = None
+        self._spilled = 0  # rows of the current matrix mirrored by the spill file
+        # Per-retriever candidate depth fed into hybrid fusion (at least k)
+        self.candidates = candidates
+        # Optional rag.cache.QueryEmbeddingCache, shared with the pipeline
+        self.query_cache = None
+        # (position in docs, vectors) for staged docs that were embedded on add()
+        self._pre_vecs: List[Tuple[int, np.ndarray]] = []
+        # Duplicate suppression on add(): exact by content-hash id, near-duplicates by SimHash
+        # (fingerprints are kept per doc id, since concurrent add() calls can accept docs in a
+        # different order than they append them to self.docs; short chunks have none and
+        # are only deduplicated exactly; None disables near-dup checks)
+        self._ids: set = set()
+        self._fps: Dict[str, int] = {}
+        self.near_dups: NearDupIndex | None = NearDupIndex(max_distance=near_dup_distance) if near_dup_distance >= 0 else None
+        self.dup_stats = {"exact": 0, "near": 0}
+        # _lock guards staging (docs, ids, pre-embedded vectors); _build_lock serialises
+        # build()/load(). Queries take neither.
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.builder = BuildRunner(lambda rebuild: self.build(rebuild=rebuild))
+
+    # Read-only views of the published state
+    @property
+    def n_built(self) -> int:
+        # Number of leading docs already embedded/indexed; build() only touches docs[n_built:]
+        return self._state.n_built
+
+    @property
+    def generation(self) -> int:
+        # Bumped whenever the searchable corpus changes; caches key their validity on it
+        return self._state.generation
+
+    @property
+    def bm25(self) -> SparseBM25 | None:
+        return self._state.bm25
+
+    @property
+    def embeddings(self) -> np.ndarray | None:
+        return self._state.embeddings
+
+    @property
+    def meta(self) -> MetaStore:
+        return self._state.meta
+
+    @property
+    def dense(self):
+        return self._state.dense
+
+    def _dedup(self, docs: List[Doc]) -> List[Doc]:
+        kept, near = [], 0
+        for d in docs:
+            if d.id in self._ids:
+                self.dup_stats["exact"] += 1
+                continue
+            fp = fingerprint(d.text) if self.near_dups is not None else None
+            if fp is not None:
+                if not self.near_dups.add_new(fp):
+                    near += 1
+                    continue
+                self._fps[d.id] = fp
+            self._ids.add(d.id)
+            kept.append(d)
+        if near:
+            self.dup_stats["near"] += near
+            log.info("dropped %d near-duplicate chunk(s) of %d", near, len(docs))
+        return kept
+
+    def add(self, docs: List[Doc], embed: bool = False) -> int:
+        # Exact and near-duplicate chunks are dropped before they are embedded or indexed.
+        # embed=True encodes the batch now (e.g. while ingestion is still producing chunks);
+        # build() then reuses those vectors instead of encoding the docs again.
+        # Safe to call while a build or queries are running.
+        with self._lock:
+            docs = self._dedup(docs)
+        vecs = None
+        if embed and docs:
+            vecs = self.embedder.encode([d.text for d in docs], convert_to_numpy=True, normalize_embeddings=True)
+        with self._lock:
+            if vecs is not None:
+                self._pre_vecs.append((len(self.docs), vecs))
+            self.docs.extend(docs)
+        return len(docs)
+
+    def _encode_new(self, new: List[Doc], start: int, pre: List[Tuple[int, np.ndarray]],
+                    batch_size: int = 256) -> np.ndarray:
+        # Vectors for docs[start:start+len(new)], taking pre-embedded blocks where available
+        out: List[np.ndarray | None] = [None] * len(new)
+        for pos, vecs in pre:
+            for j in range(max(pos, start), min(pos + len(vecs), start + len(new))):
+                out[j - start] = vecs[j - pos]
+        missing = [j for j, v in enumerate(out) if v is None]
+        self.builder.update(stage="embedding", done=len(new) - len(missing), total=len(new))
+        for a in range(0, len(missing), batch_size):
+            part = missing[a:a + batch_size]
+            enc = self.embedder.encode([new[j].text for j in part], convert_to_numpy=True, normalize_embeddings=True)
+            for j, v in zip(part, enc):
+                out[j] = v
+            self.builder.update(done=len(new) - len(missing) + a + len(part))
+        return np.vstack(out).astype(np.float32, copy=False)
+
+    def pending(self) -> int:
+        return len(self.docs) - self.n_built
+
+    def build(self, rebuild: bool = False):
+        # Builds the next generation next to the live one and swaps it in; concurrent
+        # queries keep using the state they started with.
+        try:
+            self._build_generation(rebuild)
+        finally:
+            self.builder.settle()
+
+    def _build_generation(self, rebuild: bool):
+        with self._build_lock:
+            with self._lock:
+                cur, docs = self._state, self.docs
+                start = 0 if rebuild or cur.bm25 is None or cur.embeddings is None else cur.n_built
+                new = docs[start:]
+                pre, self._pre_vecs = self._pre_vecs, []
+            # Build only if we have docs
+            if not docs:
+                if cur.n_built:
+                    self._state = _IndexState(docs, 0, None, None, MetaStore(), self._new_dense(), cur.generation + 1)
+                return
+            if not new:
+                return
+            self.builder.update(stage="bm25", done=0, total=len(new))
+            bm25 = SparseBM25() if start == 0 else cur.bm25.copy()
+            bm25.add(tokenize(d.text) for d in new)
+            meta = MetaStore() if start == 0 else cur.meta.copy()
+            meta.add([d.metadata for d in new])
+            vecs = self._encode_new(new, start, pre)
+            self.builder.update(stage="dense")
+            prev = cur.embeddings if start else None
+            if self.embedding_dtype != "float32":
+                embeddings = self._spill(prev, vecs)
+            else:
+                embeddings = vecs if prev is None else np.vstack([prev, vecs])
+            dense = self._new_dense() if start == 0 else cur.dense.copy()
+            dense.sync(embeddings, start)
+            self._state = _IndexState(docs, start + len(new), bm25, embeddings, meta, dense, cur.generation + 1)
+
+    def build_async(self, rebuild: bool = False, after: Callable[[], Any] | None = None) -> Future:
+        # build() on the background worker; `after` runs there once the new generation is
+        # live (e.g. saving a snapshot). Progress is readable from build_status().
+        return self.builder.submit(rebuild, after)
+
+    def build_status(self) -> Dict[str, Any]:
+        return {**self.builder.progress, "n_built": self.n_built, "pending": self.pending(),
+                "generation": self.generation}
+
+    def _new_dense(self):
+        kind, params = self._dense_spec
+        return make_dense_backend(kind, **params)
+
+    def _spill(self, prev: np.ndarray | None, vecs: np.ndarray) -> np.ndarray:
+        # Appends to the spill file and returns a read-only memmap over all rows. When the
+        # file does not mirror `prev` (first build, rebuild, after load) it is rewritten
+        # under a new name; the old one is unlinked, existing maps stay valid.
+        n_prev = 0 if prev is None else len(prev)
+        if self._spill_path is None or self._spilled != n_prev:
+            if self._spill_path is None:
+                tmp = tempfile.mkdtemp(prefix="cryptorag-emb-")
+                weakref.finalize(self, shutil.rmtree, tmp, True)
+                old, path = None, os.path.join(tmp, "embeddings-0.f32")
+            else:
+                old = self._spill_path
+                stem = int(os.path.basename(old)[len("embeddings-"):-len(".f32")])
+                path = os.path.join(os.path.dirname(old), f"embeddings-{stem + 1}.f32")
+            with open(path, "wb") as f:
+                for a in range(0, n_prev, 65536):
+                    f.write(np.ascontiguousarray(prev[a:a + 65536], dtype=np.float32).tobytes())
+            if old is not None:
+                os.remove(old)
+            self._spill_path, self._spilled = path, n_prev
+        with open(self._spill_path, "ab") as f:
+            f.write(np.ascontiguousarray(vecs, dtype=np.float32).tobytes())
+        self._spilled = n_prev + len(vecs)
+        return np.memmap(self._spill_path, dtype=np.float32, mode="r", shape=(self._spilled, vecs.shape[1]))
 
     def ready(self) -> bool:
-        return (self.bm25 is not None) and (self.embeddings is not None) and (len(self.docs) > 0)
+        st = self._state
+        return (st.bm25 is not None) and (st.embeddings is not None) and (st.n_built > 0)
+
+    def save(self, root: str, keep: int = 2) -> str:
+        # Snapshot layout: <root>/snap-<stamp>/{manifest.json, embeddings.npy, bm25*.{json,npy}, docs.jsonl}
+        # plus <root>/CURRENT naming the live snapshot. Written to a temp dir and renamed,
+        # so readers never see a half-written snapshot.
+        st = self._state
+        if st.bm25 is None or st.embeddings is None or not st.n_built:
+            raise RuntimeError("index not built; nothing to save")
+        os.makedirs(root, exist_ok=True)
+        name = f"snap-{time.strftime('%Y%m%d-%H%M%S')}-{st.n_built}"
+        final = os.path.join(root, name)
+        tmp = os.path.join(root, f".{name}.tmp-{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        # Copied in blocks so a memmapped matrix is never fully materialised
+        out = np.lib.format.open_memmap(os.path.join(tmp, "embeddings.npy"), mode="w+",
+                                        dtype=np.float32, shape=st.embeddings.shape)
+        for a in range(0, len(out), 65536):
+            out[a:a + 65536] = st.embeddings[a:a + 65536]
+        out.flush()
+        del out
+        st.bm25.save(tmp)
+        if self.near_dups is not None:
+            np.save(os.path.join(tmp, "simhash.npy"), np.array([self._fps.get(d.id, 0) for d in st.docs[:st.n_built]], dtype=np.uint64))
+        st.dense.save(tmp)
+        with open(os.path.join(tmp, "docs.jsonl"), "w", encoding="utf-8") as f:
+            for d in st.docs[:st.n_built]:
+                f.write(json.dumps(asdict(d), ensure_ascii=False) + "\n")
+        with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": SNAPSHOT_VERSION, "dense_model": self.dense_model_name,
+                       "n_docs": st.n_built, "dim": int(st.embeddings.shape[1]),
+                       "dense_backend": st.dense.kind, "dense_params": st.dense.params(),
+                       "created": time.time()}, f)
+
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(tmp, final)
+        _write_atomic(os.path.join(root, "CURRENT"), name)
+
+        # Prune older snapshots; workers that already mmapped them keep their open pages
+        snaps = sorted(d for d in os.listdir(root) if d.startswith("snap-"))
+        for old in snaps[:-keep] if keep > 0 else []:
+            if old != name:
+                shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+        return final
+
+    def load(self, root: str, mmap: bool = True) -> bool:
+        # Returns False when there is no snapshot; raises on version/model mismatch.
+        cur = os.path.join(root, "CURRENT")
+        if not os.path.exists(cur):
+            return False
+        with open(cur, encoding="utf-8") as f:
+            snap = os.path.join(root, f.read().strip())
+        with open(os.path.join(snap, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"snapshot version {manifest.get('version')} != {SNAPSHOT_VERSION}")
+        if manifest.get("dense_model") != self.dense_model_name:
+            raise ValueError(f"snapshot built with {manifest.get('dense_model')}, index uses {self.dense_model_name}")
+
+        # Read-only memmap: the OS page cache is shared by every worker mapping the same file
+        embeddings = np.load(os.path.join(snap, "embeddings.npy"), mmap_mode="r" if mmap else None)
+        bm = SparseBM25.load(snap, mmap=mmap)
+        with open(os.path.join(snap, "docs.jsonl"), encoding="utf-8") as f:
+            docs = [Doc(**json.loads(line)) for line in f if line.strip()]
+        if len(docs) != manifest["n_docs"] or embeddings.shape[0] != len(docs) or bm.n_docs != len(docs):
+            raise ValueError(f"corrupt snapshot: {snap}")
+        meta = MetaStore()
+        meta.add([d.metadata for d in docs])
+        # Reuses a persisted ANN structure of the same kind, otherwise rebuilds it from the matrix
+        dense = self._new_dense()
+        if manifest.get("dense_backend") == dense.kind:
+            dense.load(snap, embeddings)
+        else:
+            dense.sync(embeddings, 0)
+        near_dups, fp_by_id = None, {}
+        if self.near_dups is not None:
+            fp_path = os.path.join(snap, "simhash.npy")
+            # 0 marks a chunk without a fingerprint (too short for near-dup checks)
+            fps = np.load(fp_path).tolist() if os.path.exists(fp_path) else [fingerprint(d.text) or 0 for d in docs]
+            near_dups = NearDupIndex(max_distance=self.near_dups.max_distance, bands=self.near_dups.bands)
+            for d, fp in zip(docs, fps):
+                if fp:
+                    near_dups.add(int(fp))
+                    fp_by_id[d.id] = int(fp)
+
+        with self._build_lock:
+            with self._lock:
+                # Docs staged but not yet built survive the load and get built on the next build()
+                staged = self.docs[self.n_built:]
+                self.docs, self._ids, self._pre_vecs = docs, {d.id for d in docs}, []
+                self.near_dups, self._fps = near_dups, fp_by_id
+                self._spilled = 0
+                self._state = _IndexState(docs, len(docs), bm, embeddings, meta, dense, self.generation + 1)
+        self.add(staged)
+        return True
+
+    def encode_query(self, query: str) -> np.ndarray:
+        if self.query_cache is not None:
+            return self.query_cache.encode(self.embedder, self.dense_model_name, query)
+        return self.embedder.encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
+
+    def encode_queries(self, queries: List[str], batch_size: int = 256) -> np.ndarray:
+        # One batched encoder pass for many queries (cached ones are not re-encoded)
+        if self.query_cache is not None:
+            return self.query_cache.encode_many(self.embedder, self.dense_model_name, queries, batch_size=batch_size)
+        return self.embedder.encode(list(queries), batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+
+    def retrieve(self, query: str, k: int, filters: Dict[str, Any] | None, query_vec: np.ndarray,
+                 bm25_stats: CorpusStats | None = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Un-normalised hybrid candidates: (doc positions, BM25 scores, dense scores).
+        # Shards return these so scores can be normalised over the merged candidate set.
+        return self._retrieve(self._state, query, k, filters, query_vec, bm25_stats)
+
+    def _retrieve(self, st: _IndexState, query: str, k: int, filters: Dict[str, Any] | None,
+                  query_vec: np.ndarray, bm25_stats: CorpusStats | None = None):
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+        if st.bm25 is None or st.embeddings is None:
+            return empty
+
+        # Optional metadata filters resolve to a doc mask up front, so only the
+        # matching subset is scored
+        with metrics.timed("filter"):
+            mask = st.meta.mask(filters) if filters else None
+        if mask is not None and not mask.any():
+            return empty
+
+        # Each retriever contributes its own top candidates; only their union is fused.
+        # Docs added after the last build are not searchable yet.
+        fetch = max(k, self.candidates)
+        with metrics.timed("bm25"):
+            # BM25 scores for docs that contain a query term (sparse: ascending ids, scores)
+            bm_ids, bm_scores = st.bm25.scores(tokenize(query), mask=mask, stats=bm25_stats)
+            bm25_ids = bm_ids[topk_indices(bm_scores, fetch)]
+        with metrics.timed("dense"):
+            # Restricted subsets are scored over the allowed rows only
+            rows = np.flatnonzero(mask) if mask is not None else None
+            dense_ids, _ = st.dense.search(query_vec, fetch, rows=rows)
+        idxs = np.union1d(dense_ids, bm25_ids)
+        if not len(idxs):
+            return empty
+
+        # Candidates without any query term have BM25 score 0; dense scores are exact
+        # for the fused candidates only (a few rows of the matrix)
+        with metrics.timed("fuse"):
+            return idxs, sparse_lookup(bm_ids, bm_scores, idxs), np.asarray(st.embeddings[idxs] @ query_vec, dtype=np.float32)
 
-    def search(self, query: str, k: int = 8, alpha: float = 0.5, filters: Dict[str, Any] | None = None):
+    def retrieve_many(self, queries: List[str], k: int, filters: List[Dict[str, Any] | None], query_vecs: np.ndarray,
+                      bm25_stats: CorpusStats | None = None) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        return self._retrieve_many(self._state, queries, k, filters, query_vecs, bm25_stats)
+
+    def _retrieve_many(self, st: _IndexState, queries: List[str], k: int, filters: List[Dict[str, Any] | None],
+                       query_vecs: np.ndarray, bm25_stats: CorpusStats | None = None):
+        # _retrieve for many queries: queries sharing a filter are scored together, with
+        # one multi-query BM25 pass and one matrix-matrix dense scan per group
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+        out = [empty] * len(queries)
+        if st.bm25 is None or st.embeddings is None:
+            return out
+        groups: Dict[str, List[int]] = {}
+        for i, f in enumerate(filters):
+            groups.setdefault(json.dumps(f, sort_keys=True, default=str) if f else "", []).append(i)
+        fetch = max(k, self.candidates)
+        for members in groups.values():
+            f = filters[members[0]]
+            with metrics.timed("filter"):
+                mask = st.meta.mask(f) if f else None
+            if mask is not None and not mask.any():
+                continue
+            Q = np.asarray(query_vecs[members], dtype=np.float32)
+            with metrics.timed("bm25"):
+                bm = st.bm25.scores_many([tokenize(queries[i]) for i in members], mask=mask, stats=bm25_stats)
+            with metrics.timed("dense"):
+                dn = st.dense.search_many(Q, fetch, rows=np.flatnonzero(mask) if mask is not None else None)
+            with metrics.timed("fuse"):
+                for j, i in enumerate(members):
+                    bm_ids, bm_scores = bm[j]
+                    idxs = np.union1d(dn[j][0], bm_ids[topk_indices(bm_scores, fetch)])
+                    if len(idxs):
+                        out[i] = (idxs, sparse_lookup(bm_ids, bm_scores, idxs),
+                                  np.asarray(st.embeddings[idxs] @ Q[j], dtype=np.float32))
+        return out
+
+    def search_many(self, queries: List[str], k: int = 8, alpha: float = 0.5,
+                    filters: Dict[str, Any] | List[Dict[str, Any] | None] | None = None,
+                    query_vecs: np.ndarray | None = None) -> List[List[Tuple[Doc, float]]]:
+        # search() for a batch of queries, same results in input order; filters is one
+        # dict for all queries or one per query
+        queries = list(queries)
+        st = self._state
+        if st.bm25 is None or st.embeddings is None or not st.n_built or not queries:
+            return [[] for _ in queries]
+        flist = filters if isinstance(filters, list) else [filters] * len(queries)
+        if query_vecs is None:
+            with metrics.timed("embed_query"):
+                query_vecs = self.encode_queries(queries)
+        out = []
+        for idxs, bm25_scores, dense_scores in self._retrieve_many(st, queries, k, flist, query_vecs):
+            if not len(idxs):
+                out.append([])
+                continue
+            scores = fuse_scores(bm25_scores, dense_scores, alpha)
+            out.append([(st.docs[int(idxs[i])], float(scores[i])) for i in topk_indices(scores, k)])
+        return out
+
+    def search(self, query: str, k: int = 8, alpha: float = 0.5, filters: Dict[str, Any] | None = None,
+               query_vec: np.ndarray | None = None):
         # If index isn't ready, return empty (UI/pipeline should guide the user)
-        if not self.ready():
+        st = self._state
+        if st.bm25 is None or st.embeddings is None or not st.n_built:
             return []
 
         # Dense embedding for query
-        query_vec = self.embedder.encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
+        if query_vec is None:
+            with metrics.timed("embed_query"):
+                query_vec = self.encode_query(query)
 
-        # BM25 + dense scores
-        q_tokens = query.split()
-        try:
-            bm25_scores = self.bm25.get_scores(q_tokens)
-        except Exception:
-            # Fallback if BM25 hiccups (e.g., empty tokens)
-            bm25_scores = np.zeros(len(self.docs), dtype=float)
-        dense_scores = (self.embeddings @ query_vec)
-
-        # NumPy 2.x-safe normalization
-        def _norm(x: np.ndarray) -> np.ndarray:
-            x = np.asarray(x, dtype=float)
-            rng = np.ptp(x)
-            return (x - x.min()) / (rng + 1e-8)
-
-        bm25_norm = _norm(bm25_scores)
-        dense_norm = _norm(dense_scores)
-        scores = alpha * bm25_norm + (1 - alpha) * dense_norm
-
-        # Optional metadata filters
-        idxs = np.arange(len(self.docs))
-        if filters:
-            def ok(d: Doc) -> bool:
-                for kf, vf in filters.items():
-                    if kf not in d.metadata:
-                        return False
-                    dv = str(d.metadata[kf]).lower()
-                    if isinstance(vf, (list, tuple, set)):
-                        if not any(str(x).lower() in dv for x in vf):
-                            return False
-                    else:
-                        if str(vf).lower() not in dv:
-                            return False
-                return True
-
-            keep = [i for i in idxs if ok(self.docs[int(i)])]
-            if not keep:
-                return []
-            idxs = np.array(keep, dtype=int)
-            scores = scores[idxs]
+        idxs, bm25_scores, dense_scores = self._retrieve(st, query, k, filters, query_vec)
+        if not len(idxs):
+            return []
+        with metrics.timed("fuse"):
+            scores = fuse_scores(bm25_scores, dense_scores, alpha)
 
         # Top-k results
-        order = np.argsort(-scores)[:k]
-        return [(self.docs[int(idxs[i])], float(scores[i])) for i in order]
+        order = topk_indices(scores, k)
+        return [(st.docs[int(idxs[i])], float(scores[i])) for i in order]
 
 class Reranker:
-    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"):
-        self.model = CrossEncoder(model_name)
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2", cache_size: int = 16384):
+        from .cache import LRUCache
+        self.model = models.load("cross-encoder", model_name)
+        # (query hash, doc id) -> score; cleared when the index generation changes
+        self.cache = LRUCache(cache_size)
+        self._generation = None
+        self._max_words: int | None = None
+
+    @property
+    def max_words(self) -> int:
+        # The cross-encoder truncates at max_length tokens anyway; ~0.75 words per token
+        # keeps the passed window at (or just under) what the model actually reads.
+        # Read on first use, so constructing a Reranker doesn't wait for the model.
+        if self._max_words is None:
+            max_len = getattr(self.model, "max_length", None) or 512
+            self._max_words = max(32, int(max_len * 0.75))
+        return self._max_words
+
+    def _window(self, text: str) -> str:
+        words = text.split()
+        return text if len(words) <= self.max_words else " ".join(words[:self.max_words])
 
-    def rerank(self, query: str, docs: List[Tuple[Doc, float]], top_k: int = 5) -> List[Tuple[Doc, float]]:
+    def _check_generation(self, generation: int | None):
+        if generation is not None and generation != self._generation:
+            self.cache.clear()
+            self._generation = generation
+
+    @staticmethod
+    def _candidates(docs: List[Tuple[Doc, float]], adaptive: bool, margin: float, min_keep: int):
+        # adaptive: candidates whose hybrid score trails the leader by more than `margin`
+        # are dropped before the cross-encoder, so clear-cut queries rerank fewer pairs
+        if not adaptive or not docs:
+            return docs
+        lead = max(s for _, s in docs)
+        ranked = sorted(docs, key=lambda x: -x[1])
+        return [x for i, x in enumerate(ranked) if i < min_keep or x[1] >= lead - margin]
+
+    def rerank_many(self, queries: Sequence[str], docs_lists: Sequence[List[Tuple[Doc, float]]], top_k: int = 5,
+                    generation: int | None = None, adaptive: bool = False, margin: float = 0.35, min_keep: int = 2,
+                    pack: int = 512, batch_size: int = 64) -> Iterator[List[Tuple[Doc, float]]]:
+        # rerank() for many queries, yielded in input order. Uncached pairs of consecutive
+        # queries are packed into model calls of about `pack` pairs, sorted by length so
+        # each forward batch pads little; a query's result is yielded once its pack is scored.
+        self._check_generation(generation)
+        pending: List[tuple] = []
+        pairs: List[Tuple[str, str]] = []
+        for query, docs in zip(queries, docs_lists):
+            docs = self._candidates(docs, adaptive, margin, min_keep)
+            qh = hashlib.sha1(normalize_text(query).encode()).hexdigest()
+            scores = [self.cache.get((qh, d.id)) for d, _ in docs]
+            todo = [i for i, sc in enumerate(scores) if sc is None]
+            pending.append((docs, scores, todo, qh, len(pairs)))
+            pairs += [(query, self._window(docs[i][0].text)) for i in todo]
+            if len(pairs) >= pack:
+                yield from self._score_packed(pending, pairs, top_k, batch_size)
+                pending, pairs = [], []
+        yield from self._score_packed(pending, pairs, top_k, batch_size)
+
+    def _score_packed(self, pending: List[tuple], pairs: List[Tuple[str, str]], top_k: int, batch_size: int):
+        preds = np.empty(len(pairs), dtype=np.float32)
+        if pairs:
+            order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][1]))
+            preds[order] = self.model.predict([pairs[i] for i in order], batch_size=batch_size)
+        for docs, scores, todo, qh, start in pending:
+            for j, i in enumerate(todo):
+                scores[i] = float(preds[start + j])
+                self.cache.put((qh, docs[i][0].id), scores[i])
+            rescored = sorted(zip([d for d, _ in docs], scores), key=lambda x: -x[1])
+            yield rescored[:top_k]
+
+    def rerank(self, query: str, docs: List[Tuple[Doc, float]], top_k: int = 5, generation: int | None = None,
+               adaptive: bool = False, margin: float = 0.35, min_keep: int = 2) -> List[Tuple[Doc, float]]:
         if not docs:
             return []
-        pairs = [(query, d.text) for d, _ in docs]
-        scores = self.model.predict(pairs)
-        rescored = list(zip([d for d,_ in docs], [float(s) for s in scores]))
+        self._check_generation(generation)
+        docs = self._candidates(docs, adaptive, margin, min_keep)
+
+        qh = hashlib.sha1(normalize_text(query).encode()).hexdigest()
+        scores: List[float | None] = [self.cache.get((qh, d.id)) for d, _ in docs]
+        todo = [i for i, sc in enumerate(scores) if sc is None]
+        if todo:
+            pairs = [(query, self._window(docs[i][0].text)) for i in todo]
+            for i, sc in zip(todo, self.model.predict(pairs)):
+                scores[i] = float(sc)
+                self.cache.put((qh, docs[i][0].id), scores[i])
+        rescored = list(zip([d for d,_ in docs], scores))
         rescored.sort(key=lambda x: -x[1])
         return rescored[:top_k]
 
-def select_fewshots(query: str, fewshots: List[Dict[str, str]], embedder: SentenceTransformer, n: int = 2):
+def encode_fewshots(fewshots: List[Dict[str, str]], embedder: SentenceTransformer) -> np.ndarray | None:
+    if not fewshots:
+        return None
+    return embedder.encode([fs["q"] for fs in fewshots], convert_to_numpy=True, normalize_embeddings=True)
+
+def select_fewshots(query: str, fewshots: List[Dict[str, str]], embedder: SentenceTransformer, n: int = 2,
+                    query_vec: np.ndarray | None = None, example_vecs: np.ndarray | None = None):
+    # Pass precomputed query/example vectors to avoid re-encoding on every request
     if not fewshots:
         return []
-    qv = embedder.encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
-    ex_vecs = embedder.encode([fs["q"] for fs in fewshots], convert_to_numpy=True, normalize_embeddings=True)
+    qv = query_vec if query_vec is not None else embedder.encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
+    ex_vecs = example_vecs if example_vecs is not None else encode_fewshots(fewshots, embedder)
     sims = ex_vecs @ qv
     order = np.argsort(-sims)[:n]
     return [fewshots[i] for i in order]
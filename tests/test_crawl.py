@@ -0,0 +1,93 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rag.crawl import UrlFetcher, decode_body
+
+PAGE = "<html><body><article><p>{}</p></article></body></html>"
+TEXT = " ".join(["Bitcoin halving — 2024, café owners accept ₿ payments."] * 20)
+
+class Site:
+    # Local stand-in HTTP server: path -> (body, content type, etag); counts requests
+    def __init__(self, pages):
+        self.pages, self.hits, self.not_modified = pages, [], 0
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.hits.append(self.path)
+                if self.path not in site.pages:
+                    self.send_error(404)
+                    return
+                body, ctype, etag = site.pages[self.path]
+                if etag and self.headers.get("If-None-Match") == etag:
+                    site.not_modified += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{path}"
+
+@pytest.fixture
+def site():
+    s = Site({
+        "/etag": (PAGE.format(TEXT).encode(), "text/html; charset=utf-8", '"v1"'),
+        "/plain": (PAGE.format(TEXT).encode(), "text/html", None),
+        "/latin": (PAGE.format("Crème brûlée à Zürich, déjà vu.").encode("cp1252"), "text/html", None),
+    })
+    yield s
+    s.httpd.shutdown()
+    s.httpd.server_close()
+
+def test_decode_body_charsets():
+    assert decode_body("café ₿".encode(), "text/html") == "café ₿"
+    assert decode_body("café €".encode("cp1252"), "text/html") == "café €"
+    assert decode_body("é".encode("latin-1"), "text/html; charset=ISO-8859-1") == "é"
+    meta = "<meta charset='koi8-r'>Биткоин".encode("koi8-r")
+    assert decode_body(meta, "text/html").endswith("Биткоин")
+
+def test_undeclared_charset_is_not_garbled(site, tmp_path):
+    f = UrlFetcher(cache_dir=str(tmp_path))
+    _, _, html = f._get(site.url("/plain"))
+    assert "— 2024, café" in html and "â€" not in html
+    _, _, html = f._get(site.url("/latin"))
+    assert "Crème brûlée à Zürich" in html
+
+def test_etag_revalidation_and_cache_hit(site, tmp_path):
+    pytest.importorskip("trafilatura")
+    f = UrlFetcher(cache_dir=str(tmp_path))
+    first = list(f.fetch_all([site.url("/etag")]))[0]
+    assert first.status == "fetched" and "café" in first.text
+    again = list(f.fetch_all([site.url("/etag")]))[0]
+    assert again.status == "not_modified" and again.text == first.text
+    assert site.not_modified == 1
+    # A fresh fetcher over the same cache dir revalidates from disk
+    other = list(UrlFetcher(cache_dir=str(tmp_path)).fetch_all([site.url("/etag")]))[0]
+    assert other.status == "not_modified" and other.text == first.text
+
+def test_identical_body_without_validators_skips_extraction(site, tmp_path):
+    pytest.importorskip("trafilatura")
+    f = UrlFetcher(cache_dir=str(tmp_path))
+    first = list(f.fetch_all([site.url("/plain")]))[0]
+    again = list(f.fetch_all([site.url("/plain")]))[0]
+    assert first.status == "fetched" and again.status == "unchanged" and again.text == first.text
+    assert f.stats["fetched"] == 1 and f.stats["unchanged"] == 1
+
+def test_http_errors_are_reported(site, tmp_path):
+    res = list(UrlFetcher(cache_dir=str(tmp_path)).fetch_all([site.url("/missing")]))[0]
+    assert res.status == "error" and "404" in res.error
@@ -0,0 +1,38 @@
+from bench.stand_ins import HashEmbedder
+from rag.dedup import fingerprint
+from rag.utils import Doc, HybridIndex
+
+class _NoEmbedder:
+    def encode(self, texts, **kwargs):
+        raise AssertionError("not used")
+
+def _doc(text):
+    return Doc(id=str(abs(hash(text))), text=text, metadata={})
+
+LONG = ("Bitcoin halvings cut the block subsidy in half roughly every four years, reducing "
+        "new supply; miners then rely more on fees, and past halvings preceded volatile "
+        "markets as hash rate and difficulty adjusted to the lower reward.")
+
+def test_short_distinct_texts_survive():
+    idx = HybridIndex(embedder=_NoEmbedder())
+    texts = [f"Price of bitcoin on day {i}." for i in range(900)] + ["", "  ", "!!!"]
+    assert idx.add([_doc(t) for t in texts]) == len(texts)
+    assert idx.dup_stats["near"] == 0
+    # Exact duplicates of short texts are still dropped
+    assert idx.add([_doc(texts[0])]) == 0
+
+def test_long_near_duplicates_are_dropped():
+    idx = HybridIndex(embedder=_NoEmbedder())
+    assert fingerprint(LONG) is not None and fingerprint("Price of bitcoin on day 1.") is None
+    assert idx.add([_doc(LONG), _doc(LONG.replace(";", ","))]) == 1
+    assert idx.dup_stats["near"] == 1
+
+def test_fingerprints_survive_snapshot_reload(tmp_path):
+    idx = HybridIndex(embedder=HashEmbedder())
+    idx.add([_doc("Price of bitcoin on day 1."), _doc(LONG)])
+    idx.build()
+    idx.save(str(tmp_path))
+    again = HybridIndex(embedder=HashEmbedder())
+    assert again.load(str(tmp_path))
+    assert again.add([_doc(LONG.replace(";", ",")), _doc("Price of bitcoin on day 2.")]) == 1
+    assert again.dup_stats["near"] == 1
@@ -0,0 +1,25 @@
+import pytest
+
+from rag import models
+
+def test_failed_load_is_retried_in_place(monkeypatch):
+    calls = []
+
+    def flaky(name):
+        calls.append(name)
+        if len(calls) == 1:
+            raise OSError("connection reset")
+        return "model"
+
+    monkeypatch.setitem(models.LOADERS, "embedder", flaky)
+    monkeypatch.setattr(models.ModelHandle, "RETRY_AFTER", 3600.0)
+    h = models.load("embedder", "test/flaky-retry")
+    with pytest.raises(OSError):
+        h.get()
+    # Within the back-off the stored error is raised without reloading
+    with pytest.raises(OSError):
+        h.get()
+    assert h.state == "failed" and len(calls) == 1
+    # load() of the same model retries now, and every holder of the handle sees it
+    assert models.load("embedder", "test/flaky-retry") is h
+    assert h.get() == "model" and h.state == "ready" and len(calls) == 2
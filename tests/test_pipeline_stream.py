@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("openai")
+
+from bench import stand_ins
+from bench.corpus import CorpusGenerator
+from bench.fake_llm import FakeLLMServer
+from rag.pipeline import CryptoRAGPipeline
+
+@pytest.fixture(scope="module")
+def pipe():
+    dense, reranker = stand_ins.install()
+    p = CryptoRAGPipeline(dense_model=dense, reranker_model=reranker)
+    p.index.add(list(CorpusGenerator(seed=0).docs(300)))
+    p.build()
+    return p
+
+def test_aanswer_stream_through_fake_endpoint(pipe):
+    question = "What does the bitcoin halving change for miners?"
+    with FakeLLMServer(ttft=0.01, tokens_per_second=0, n_tokens=20) as llm:
+        pipe.set_openai("test", base_url=llm.base_url)
+
+        async def run():
+            res = await pipe.aask(question, k=8, top_k_rerank=3)
+            assert res["route"] == "rag" and res["contexts"]
+            first = [t async for t in pipe.aanswer_stream(question, res["contexts"])]
+            again = [t async for t in pipe.aanswer_stream(question, res["contexts"])]
+            return first, again
+
+        first, again = asyncio.run(run())
+    expected = "".join(f"tok{i} " for i in range(20))
+    # Streamed token by token the first time, then served whole from the answer cache
+    assert len(first) == 20 and "".join(first) == expected
+    assert again == [expected]
+    assert llm.requests == 1
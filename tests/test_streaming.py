@@ -0,0 +1,42 @@
+import asyncio
+
+from rag.streaming import coalesce
+
+async def _tokens(n, gap):
+    for i in range(n):
+        await asyncio.sleep(gap)
+        yield f"tok{i} "
+
+def _run(n, gap=0.001, interval=0.01, delta=False):
+    async def go():
+        return [u async for u in coalesce(_tokens(n, gap), interval=interval, delta=delta)]
+    return asyncio.run(go())
+
+def test_full_text_and_deltas_are_complete():
+    text = "".join(f"tok{i} " for i in range(300))
+    assert _run(300)[-1] == text
+    assert "".join(_run(300, delta=True)) == text
+
+def test_flushes_grow_sublinearly_and_resent_bytes_linearly():
+    short, long = _run(400), _run(1600)
+    text_short, text_long = len(short[-1]), len(long[-1])
+    # 4x the tokens must not mean 4x the updates
+    assert len(long) < 2 * len(short)
+    # Re-sending the full text stays a bounded multiple of the answer length
+    sent_short = sum(map(len, short)) / text_short
+    sent_long = sum(map(len, long)) / text_long
+    assert sent_long < 15 and sent_long < 1.5 * sent_short
+
+def test_stalled_source_still_flushes():
+    async def slow():
+        yield "first"
+        await asyncio.sleep(0.2)
+        yield " second"
+
+    async def go():
+        out = []
+        async for u in coalesce(slow(), interval=0.02, min_chars=1000):
+            out.append(u)
+        return out
+
+    assert asyncio.run(go()) == ["first", "first second"]
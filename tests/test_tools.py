@@ -0,0 +1,88 @@
+import json, time, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+from rag import tools
+
+PRICES = {"bitcoin": 65000, "ethereum": 3000, "solana": 150, "ripple": 0.5}
+
+class Market:
+    # Local stand-in for the CoinGecko simple/price and alternative.me F&G endpoints
+    def __init__(self, delay: float = 0.1):
+        self.calls = []
+        market = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                market.calls.append(url.path)
+                time.sleep(delay)
+                if url.path == "/api/v3/simple/price":
+                    q = parse_qs(url.query)
+                    vs = q["vs_currencies"][0]
+                    body = {c: {vs: PRICES[c]} for c in q["ids"][0].split(",") if c in PRICES}
+                elif url.path == "/fng/":
+                    body = {"data": [{"value": "55", "value_classification": "Greed"}]}
+                else:
+                    self.send_error(404)
+                    return
+                raw = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.client = tools.MarketDataClient(base_url=f"{base}/api/v3", fng_url=f"{base}/fng/")
+
+    def close(self):
+        self.client.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def market(monkeypatch):
+    m = Market()
+    monkeypatch.setattr(tools, "_CLIENT", m.client)
+    yield m
+    m.close()
+
+def test_concurrent_price_lookups_are_batched(market):
+    coins = ["bitcoin", "ethereum", "solana", "ripple"]
+    with ThreadPoolExecutor(len(coins)) as ex:
+        prices = list(ex.map(market.client.get_price, coins))
+    assert prices == [PRICES[c] for c in coins]
+    assert market.calls == ["/api/v3/simple/price"]
+
+def test_fear_greed_is_single_flight_and_cached(market):
+    with ThreadPoolExecutor(10) as ex:
+        out = list(ex.map(lambda _: market.client.get_fear_greed(), range(10)))
+    assert all(o["value"] == "55" for o in out)
+    assert market.calls == ["/fng/"]
+    market.client.get_fear_greed()
+    assert market.calls == ["/fng/"] and market.client.stats["cache_hits"] >= 1
+
+def test_price_cache_skips_http(market):
+    assert market.client.get_price("bitcoin") == PRICES["bitcoin"]
+    assert market.client.get_price_multi(["bitcoin"]) == {"bitcoin": {"usd": PRICES["bitcoin"]}}
+    assert len(market.calls) == 1
+
+def test_tool_answer_sync_and_async_agree(market):
+    text = tools.tool_answer("BTC price")
+    assert text.startswith("🔧 bitcoin price ≈ $65000") and "Greed" in text and "ETH $3000" in text
+    assert asyncio.run(tools.atool_answer("BTC price")) == text
+
+def test_tool_answer_reports_price_errors(market):
+    market.httpd.shutdown()
+    market.httpd.server_close()
+    market.client.timeout = 1.0
+    assert "error resolving coin/price" in tools.tool_answer("sol price")